@@ -1,15 +1,27 @@
 import os
-from flask import Flask, request, jsonify
+import time
+_import_started_at = time.perf_counter()
+from flask import Flask, request, jsonify, Response, g, has_app_context, has_request_context
 from flask_cors import CORS 
-from tensorflow import keras 
+from werkzeug.exceptions import RequestEntityTooLarge
 import numpy as np 
-from PIL import Image 
-import io 
-import datetime
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import base64
+import zipfile
+import tarfile
+import threading
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from inference_engine import BatchingInferenceEngine
+from chart_renderer import render_chart_png, LazyChartStore  # matplotlib itself is imported on first render
+from chart_store import ChartArtifactStore
+from image_preprocessing import decode_rgb, resize_rgb, to_array, decode_batch, sniff_image, ImageRejected
+from prediction_cache import PredictionCache, hash_image_bytes, hash_image_stream, file_fingerprint
+from metrics import Registry, RequestTimer, ProfileSampler
+from job_store import JobStore, JOB_RUNNING, JOB_DONE, JOB_FAILED
+from model_registry import ServedModel, RegistryWatcher, current_version, has_model_file, list_versions, version_files
+from soil_rules import load_rules, compile_rules, interpret_predictions
+from tiling import parse_grid, decode_tiles, aggregate_tiles, AGGREGATIONS
+from embedding_index import EmbeddingStore, EmbeddingIndex, embedding_model, normalize, version_directory
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -17,189 +29,1089 @@ CORS(app)
 
 MODEL_PATH = 'multi_task_soil_model.h5' 
 CLASS_NAMES_PATH = 'soil_classes.txt' 
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'keras').lower()  # 'keras' or 'tflite'
+TFLITE_MODEL_PATH = os.environ.get('TFLITE_MODEL_PATH', 'multi_task_soil_model_fp16.tflite')
+SERVED_MODEL_PATH = TFLITE_MODEL_PATH if MODEL_BACKEND == 'tflite' else MODEL_PATH
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp'} 
+# Formats as identified from the file header (MPO is the multi-picture JPEG some phone cameras write).
+ALLOWED_IMAGE_FORMATS = {'JPEG', 'MPO', 'PNG', 'GIF', 'BMP', 'WEBP', 'TIFF'}
+MAX_REQUEST_BYTES = int(float(os.environ.get('MAX_REQUEST_MB', 256)) * 1024 * 1024)  # whole request, incl. batches
+MAX_IMAGE_BYTES = int(float(os.environ.get('MAX_IMAGE_MB', 20)) * 1024 * 1024)  # each image, incl. archive members
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 40_000_000))
 MODEL_INPUT_SHAPE = (224, 224, 3) 
 UPLOAD_FOLDER = 'uploads' 
+INFERENCE_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 16))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 10))
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+BATCH_MAX_IMAGES = int(os.environ.get('BATCH_MAX_IMAGES', 1000))
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 64))
+CHART_MODES = ('inline', 'stored', 'lazy', 'none')
+LAZY_CHART_MAX_ENTRIES = int(os.environ.get('LAZY_CHART_MAX_ENTRIES', 1000))
+CHART_STORE_DIR = os.environ.get('CHART_STORE_DIR', os.path.join(UPLOAD_FOLDER, 'charts'))
+# Scores of chart=lazy predictions; shared by all worker processes so /chart/<id> works on any of them.
+LAZY_CHART_DB = os.environ.get('LAZY_CHART_DB', os.path.join(CHART_STORE_DIR, 'lazy_charts.sqlite3'))
+CHART_STORE_MAX_BYTES = int(os.environ.get('CHART_STORE_MAX_BYTES', 256 * 1024 * 1024))
+CHART_STORE_MAX_FILES = int(os.environ.get('CHART_STORE_MAX_FILES', 10000))
+CHART_STORE_MAX_AGE_SECONDS = float(os.environ.get('CHART_STORE_MAX_AGE_SECONDS', 7 * 24 * 3600))
+PREDICTION_CACHE_MAX_ENTRIES = int(os.environ.get('PREDICTION_CACHE_MAX_ENTRIES', 10000))
+PREDICTION_CACHE_MAX_BYTES = int(os.environ.get('PREDICTION_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+PREDICTION_CACHE_DB = os.environ.get('PREDICTION_CACHE_DB')  # e.g. 'prediction_cache.sqlite3'; unset keeps it in memory only
+TF_INTRA_OP_THREADS = int(os.environ.get('TF_INTRA_OP_THREADS', 0))  # 0 lets TensorFlow decide
+TF_INTER_OP_THREADS = int(os.environ.get('TF_INTER_OP_THREADS', 0))
+# Load the model on a background thread so the server can accept requests (and answer /ready) right away.
+LOAD_MODEL_IN_BACKGROUND = os.environ.get('LOAD_MODEL_IN_BACKGROUND', 'true').lower() in ('1', 'true', 'yes')
+DECODE_WORKERS = int(os.environ.get('DECODE_WORKERS', min(8, os.cpu_count() or 1)))
+# Fraction of requests run under cProfile; profiles are only kept for requests slower than SLOW_REQUEST_MS.
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+JOB_DB = os.environ.get('JOB_DB', 'jobs.sqlite3')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 1))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 8))  # queued + running jobs per process before POST /jobs returns 429
+JOB_TTL_SECONDS = float(os.environ.get('JOB_TTL_SECONDS', 24 * 3600))
+JOB_HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', 30))  # jobs of a worker silent for 4 heartbeats are failed
+# Versions published by train_model.py; when empty, MODEL_PATH/CLASS_NAMES_PATH are served instead.
+MODEL_REGISTRY_DIR = os.environ.get('MODEL_REGISTRY_DIR', 'model_registry')
+MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', 10))  # seconds between checks; 0 disables hot reload
+DEFAULT_SOIL_CLASSES = ['Alluvial soil', 'Black Soil', 'Clay soil', 'Red soil']
+SOIL_RULES_PATH = os.environ.get('SOIL_RULES_PATH', 'soil_rules.json')
+# Tiled /predict (tiles=true or tiles=ROWSxCOLS): grid used for tiles=true, flips and aggregation defaults.
+TILE_GRID = parse_grid(os.environ.get('TILE_GRID', '3x3'))
+TILE_FLIPS = os.environ.get('TILE_FLIPS', 'false').lower() in ('1', 'true', 'yes')
+TILE_AGGREGATION = os.environ.get('TILE_AGGREGATION', 'mean')
+TILE_MAX_CROPS = int(os.environ.get('TILE_MAX_CROPS', 32))  # tiles per request, mirrored copies included
+# Embeddings of the model's Dense(128) layer, for embedding=true and /similar (Keras backend only).
+EMBEDDINGS_ENABLED = os.environ.get('EMBEDDINGS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+EMBEDDINGS_DIR = os.environ.get('EMBEDDINGS_DIR', 'embeddings')
+EMBEDDING_DTYPE = os.environ.get('EMBEDDING_DTYPE', 'float16')
+STORE_EMBEDDINGS = os.environ.get('STORE_EMBEDDINGS', 'true').lower() in ('1', 'true', 'yes')  # keep every analyzed sample
+SIMILAR_MAX_K = int(os.environ.get('SIMILAR_MAX_K', 100))
+SIMILAR_NPROBE = int(os.environ.get('SIMILAR_NPROBE', 32))  # IVF clusters scanned per search, once an index is built
 
+# Werkzeug refuses larger requests with 413 before the body is parsed.
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
 
-model = None
-SOIL_CLASSES = [] 
+# Soil quality and recommendation rules (see soil_rules.py); compiled per model version for its class list.
+soil_rules_table = load_rules(SOIL_RULES_PATH)
 
-try:
-    model = keras.models.load_model(MODEL_PATH)
-    print(f"AI Model '{MODEL_PATH}' loaded successfully.")
+# The model version answering requests. It is replaced as a whole on reload;
+# request handlers take it once with acquire_served_model() and use that
+# reference throughout, so requests in flight during a swap finish on the
+# version they started with.
+served = None
+# In-flight users per ServedModel (by id). A replaced model whose count is not
+# zero yet is kept in retired_models; its engine stops when the last user releases it.
+served_lock = threading.Lock()
+served_users = {}
+retired_models = {}
+load_model_file = None
+model_watcher = None
 
-    if os.path.exists(CLASS_NAMES_PATH):
-        with open(CLASS_NAMES_PATH, 'r') as f:
-            SOIL_CLASSES = [line.strip() for line in f if line.strip()]
-        print(f"Loaded soil classes for prediction: {SOIL_CLASSES}")
+startup_status = {"state": "loading", "error": None, "phases_ms": {}, "reload_error": None}
+
+@contextmanager
+def startup_phase(name):
+    phase_started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - phase_started_at) * 1000.0
+        startup_status["phases_ms"][name] = round(elapsed_ms, 1)
+        print(f"Startup: {name} took {elapsed_ms:.1f} ms.")
+
+def import_model_runtime():
+    """
+    Imports TensorFlow (or the TFLite runtime) and returns a function that
+    loads a model file with it.
+    """
+    if MODEL_BACKEND == 'tflite':
+        from tflite_model import TFLiteModel
+        return lambda path: TFLiteModel(path, num_threads=TF_INTRA_OP_THREADS or None)
+
+    import tensorflow as tf
+    from tensorflow import keras
+
+    # Must happen before the model is loaded; see serve.py for the multi-process setup.
+    if TF_INTRA_OP_THREADS:
+        tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+    if TF_INTER_OP_THREADS:
+        tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+    return keras.models.load_model
+
+def legacy_model_version():
+    # Stat-based, so replacing the fixed model files is picked up like a new registry version.
+    return f"legacy-{file_fingerprint(SERVED_MODEL_PATH, CLASS_NAMES_PATH)}"
+
+_missing_backend_warned = set()
+
+def wanted_model_version():
+    version = current_version(MODEL_REGISTRY_DIR)
+    if version is not None and not has_model_file(version, MODEL_REGISTRY_DIR, MODEL_BACKEND):
+        # e.g. a TFLite server before export_tflite.py has converted the newest version.
+        if version not in _missing_backend_warned:
+            _missing_backend_warned.add(version)
+            print(f"WARNING: Model version {version} has no {MODEL_BACKEND} model file; serving '{SERVED_MODEL_PATH}' "
+                  f"instead. Run 'python export_tflite.py --registry-version {version}' to add it.")
+        return legacy_model_version()
+    return version if version is not None else legacy_model_version()
+
+def attach_embeddings(loaded_model, version):
+    """
+    Returns (engine_model, embeddings): the model extended with an embedding
+    output and the similar-sample index of this version, or the plain model
+    and None when embeddings are disabled or unavailable.
+    """
+    if not EMBEDDINGS_ENABLED:
+        return loaded_model, None
+    if MODEL_BACKEND != 'keras':
+        print("Embeddings are only available with the Keras backend; /similar is disabled.")
+        return loaded_model, None
+    try:
+        engine_model = embedding_model(loaded_model)
+        store = EmbeddingStore(
+            version_directory(version, EMBEDDINGS_DIR), int(engine_model.outputs[-1].shape[-1]), EMBEDDING_DTYPE
+        )
+    except Exception as e:
+        print(f"WARNING: Embeddings disabled for model version {version}: {e}")
+        return loaded_model, None
+    print(f"Embedding store '{store.directory}' holds {store.count()} samples.")
+    return engine_model, EmbeddingIndex(store)
+
+def build_served_model(version):
+    """
+    Loads the model file and class names of a version and warms up an
+    inference engine for it, without touching the version being served.
+    """
+    if version.startswith('legacy-'):
+        model_path, classes_path, metadata = SERVED_MODEL_PATH, CLASS_NAMES_PATH, {}
     else:
-        print(f"WARNING: Class names file '{CLASS_NAMES_PATH}' not found. Using a default class list.")
-        SOIL_CLASSES = ['Alluvial soil', 'Black Soil', 'Clay soil', 'Red soil'] 
-except Exception as e:
-    print(f"ERROR: Failed to load AI model or class names: {e}")
-    print("Please check if 'multi_task_soil_model.h5' and 'soil_classes.txt' exist in the 'backend' folder.")
-    SOIL_CLASSES = ['Unknown'] 
+        model_path, classes_path, metadata = version_files(version, MODEL_REGISTRY_DIR, MODEL_BACKEND)
+
+    with startup_phase("load_model"):
+        loaded_model = load_model_file(model_path)
+    print(f"AI Model '{model_path}' (version {version}) loaded successfully ({MODEL_BACKEND} backend).")
+
+    with startup_phase("load_classes"):
+        if os.path.exists(classes_path):
+            with open(classes_path, 'r') as f:
+                soil_classes = [line.strip() for line in f if line.strip()]
+            print(f"Loaded soil classes for prediction: {soil_classes}")
+        else:
+            print(f"WARNING: Class names file '{classes_path}' not found. Using a default class list.")
+            soil_classes = list(DEFAULT_SOIL_CLASSES)
+        # A version whose classes the rules table does not cover is rejected here, before it serves anything.
+        rules = compile_rules(soil_rules_table, soil_classes)
+
+    with startup_phase("embeddings"):
+        engine_model, embeddings = attach_embeddings(loaded_model, version)
+
+    engine = BatchingInferenceEngine(
+        engine_model,
+        max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+        max_wait_ms=INFERENCE_MAX_WAIT_MS,
+        input_shape=MODEL_INPUT_SHAPE
+    )
+    with startup_phase("warmup"):
+        engine.warmup()
+    engine.start()
+    return ServedModel(version, loaded_model, engine, soil_classes, rules, embeddings, model_path, metadata)
+
+def acquire_served_model():
+    """
+    Returns the model version to use for one request or job (None if no
+    model is loaded) and counts it as in use until release_served_model().
+    """
+    with served_lock:
+        bundle = served
+        if bundle is not None:
+            served_users[id(bundle)] = served_users.get(id(bundle), 0) + 1
+    return bundle
+
+def release_served_model(bundle):
+    with served_lock:
+        remaining = served_users.pop(id(bundle)) - 1
+        if remaining:
+            served_users[id(bundle)] = remaining
+            return
+        retired = retired_models.pop(id(bundle), None)
+    if retired is not None:
+        retired.engine.stop()
+        print(f"Model version {retired.version} retired after its last in-flight request.")
+
+def retired_cache_versions():
+    """
+    Versions with cached predictions that have been removed from the registry.
+    Old legacy fingerprints are left to the disk-size limit instead, since a
+    worker that has not been restarted may still serve those files.
+    """
+    published = set(list_versions(MODEL_REGISTRY_DIR))
+    return [
+        version for version in prediction_cache.versions()
+        if not version.startswith('legacy-') and version not in published
+    ]
+
+def swap_model(new_served):
+    global served
+    prediction_cache.set_version(new_served.version)
+    prediction_cache.retire_versions(retired_cache_versions())
+    with served_lock:
+        old_served, served = served, new_served
+        # Requests and jobs still holding the old version finish on it; its engine stops after the last one.
+        in_use = old_served is not None and id(old_served) in served_users
+        if in_use:
+            retired_models[id(old_served)] = old_served
+    if old_served is not None:
+        if not in_use:
+            old_served.engine.stop()
+        print(f"Model version {old_served.version} replaced by {new_served.version}"
+              f"{' (finishing in-flight requests on it)' if in_use else ''}.")
+
+def reload_model(version):
+    """
+    Loads and warms up a new version in the background, then swaps it in.
+    On failure the current version keeps serving. Called by the watcher.
+    """
+    print(f"Model reload: loading version {version}...")
+    try:
+        new_served = build_served_model(version)
+    except Exception as e:
+        print(f"ERROR: Failed to load model version {version}: {e}. "
+              f"Still serving {served.version if served is not None else 'nothing'}.")
+        startup_status["reload_error"] = f"{version}: {e}"
+        return False
+    swap_model(new_served)
+    startup_status["state"] = "ready"
+    startup_status["error"] = None
+    startup_status["reload_error"] = None
+    return True
+
+def load_model():
+    """
+    Imports the model runtime and loads the wanted version (the registry's
+    CURRENT version, or the fixed MODEL_PATH files if the registry is empty),
+    then starts watching for new versions. The version is only published once
+    it is warmed up, so request handlers never see a half-initialized model.
+    """
+    global load_model_file, model_watcher
+    load_started_at = time.perf_counter()
+    try:
+        with startup_phase("import_runtime"):
+            load_model_file = import_model_runtime()
+        swap_model(build_served_model(wanted_model_version()))
+        startup_status["state"] = "ready"
+    except Exception as e:
+        print(f"ERROR: Failed to load AI model or class names: {e}")
+        print(f"Please check if '{SERVED_MODEL_PATH}' and 'soil_classes.txt' exist in the 'backend' folder, "
+              f"or publish a model to '{MODEL_REGISTRY_DIR}' with train_model.py.")
+        startup_status["state"] = "failed"
+        startup_status["error"] = str(e)
+    finally:
+        total_ms = (time.perf_counter() - load_started_at) * 1000.0
+        startup_status["phases_ms"]["model_total"] = round(total_ms, 1)
+        print(f"Startup: model {startup_status['state']} after {total_ms:.1f} ms.")
+
+    # Also started after a failed load, so publishing a working version fixes the server without a restart.
+    if MODEL_RELOAD_INTERVAL > 0 and load_model_file is not None:
+        model_watcher = RegistryWatcher(
+            wanted_model_version,
+            lambda: served.version if served is not None else None,
+            reload_model,
+            interval=MODEL_RELOAD_INTERVAL
+        ).start()
+
+def model_unavailable():
+    """
+    Returns an error response if the model cannot serve requests yet, else None.
+    """
+    if served is not None:
+        return None
+    if startup_status["state"] == "loading":
+        response = jsonify({"error": "AI model is still loading. Please retry in a few seconds."})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    return jsonify({"error": "AI model not loaded on server. Server setup issue."}), 500
+
+# Pillow releases the GIL while decoding and resizing, so threads are enough here.
+decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix='decode')
+
+chart_store = ChartArtifactStore(
+    CHART_STORE_DIR,
+    max_bytes=CHART_STORE_MAX_BYTES,
+    max_files=CHART_STORE_MAX_FILES,
+    max_age_seconds=CHART_STORE_MAX_AGE_SECONDS
+)
+
+lazy_charts = LazyChartStore(LAZY_CHART_DB, max_entries=LAZY_CHART_MAX_ENTRIES)
+
+prediction_cache = PredictionCache(
+    max_entries=PREDICTION_CACHE_MAX_ENTRIES,
+    max_bytes=PREDICTION_CACHE_MAX_BYTES,
+    db_path=PREDICTION_CACHE_DB
+)
+
+metrics_registry = Registry()
+REQUEST_COUNT = metrics_registry.counter('soil_requests_total', 'HTTP requests handled.', ('endpoint', 'status'))
+REQUEST_LATENCY = metrics_registry.histogram('soil_request_duration_seconds', 'Request latency in seconds.', ('endpoint',))
+STAGE_LATENCY = metrics_registry.histogram(
+    'soil_stage_duration_seconds', 'Time spent in each stage of a request, in seconds.', ('endpoint', 'stage')
+)
+ERROR_COUNT = metrics_registry.counter('soil_errors_total', 'Errors by endpoint and type.', ('endpoint', 'type'))
+PREDICTION_COUNT = metrics_registry.counter(
+    'soil_predictions_total', 'Predicted soil types, including cached results.', ('soil_type', 'cached')
+)
+BYTES_PROCESSED = metrics_registry.counter('soil_bytes_processed_total', 'Image bytes received.', ('endpoint',))
+profile_sampler = ProfileSampler(PROFILE_SAMPLE_RATE)
+
+def collect_component_metrics():
+    cache = prediction_cache.stats()
+    collected = [
+        ('soil_prediction_cache_lookups_total', 'counter', 'Prediction cache lookups by result.',
+         {('memory_hit',): cache['hits'], ('disk_hit',): cache['disk_hits'], ('miss',): cache['misses']}, ('result',)),
+        ('soil_prediction_cache_entries', 'gauge', 'Entries held in memory by the prediction cache.',
+         {(): cache['entries']}, ()),
+    ]
+    charts = chart_store.stats()
+    collected += [
+        ('soil_chart_store_charts', 'gauge', 'Charts held by the chart artifact store.', {(): charts['charts']}, ()),
+        ('soil_chart_store_bytes', 'gauge', 'Bytes held by the chart artifact store.', {(): charts['bytes']}, ()),
+        ('soil_chart_store_evictions_total', 'counter', 'Charts evicted by the retention policy.',
+         {(): charts['evictions']}, ()),
+    ]
+    collected.append(('soil_jobs', 'gauge', 'Jobs in the job store by state.',
+                      {(state,): count for state, count in job_store.stats().items()}, ('state',)))
+    current = served
+    if current is not None:
+        engine = current.engine.stats()
+        collected += [
+            ('soil_inference_forward_passes_total', 'counter', 'Forward passes run by the inference engine.',
+             {(): engine['forward_passes']}, ()),
+            ('soil_inference_images_total', 'counter', 'Images run through the model.',
+             {(): engine['images_served']}, ()),
+            ('soil_inference_queue_depth', 'gauge', 'Requests waiting for the inference engine.',
+             {(): engine['queue_depth']}, ()),
+        ]
+    return collected
+
+metrics_registry.add_collector(collect_component_metrics)
+
+# Jobs run on their own small pool so a large submission cannot starve /predict of decode threads.
+job_store = JobStore(JOB_DB, ttl_seconds=JOB_TTL_SECONDS, heartbeat_seconds=JOB_HEARTBEAT_SECONDS)
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='jobs')
+job_slots = threading.BoundedSemaphore(JOB_QUEUE_SIZE)
+
+def stage(name):
+    """
+    Times a stage of the current request, e.g. `with stage('decode'):`.
+    Does nothing outside a request.
+    """
+    timer = g.get('request_timer') if has_app_context() else None
+    return timer.stage(name) if timer is not None else nullcontext()
+
+def record_error(error_type, count=1, endpoint=None):
+    if endpoint is None:
+        endpoint = (request.endpoint if has_request_context() else None) or 'unknown'
+    ERROR_COUNT.inc(count, endpoint=endpoint, type=error_type)
+
+startup_status["phases_ms"]["app_import"] = round((time.perf_counter() - _import_started_at) * 1000.0, 1)
+print(f"Startup: app import took {startup_status['phases_ms']['app_import']:.1f} ms.")
+
+if LOAD_MODEL_IN_BACKGROUND:
+    threading.Thread(target=load_model, name='model-loader', daemon=True).start()
+else:
+    load_model()
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def generate_chart_image(confidence_scores_dict, soil_classes_order, save_path=None):
-    labels = soil_classes_order
-    scores = [confidence_scores_dict.get(label, 0) for label in labels]
-    
-    plt.figure(figsize=(6, 4))
-    bars = plt.bar(labels, scores, color=['#4BC0C0', '#FF6384', '#36A2EB', '#FFCE56'])
-    plt.title('Prediction Confidence')
-    plt.ylabel('Confidence (%)')
-    plt.ylim(0, 100)
-    
-    for bar in bars:
-        yval = bar.get_height()
-        plt.text(bar.get_x() + bar.get_width()/2.0, yval, f'{yval:.2f}%', ha='center', va='bottom')
-            
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
-    
-    if save_path:
+def is_archive(filename):
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def stream_size(stream):
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+def image_too_large_message(size):
+    return f"Image is too large ({size / 1e6:.1f} MB, limit is {MAX_IMAGE_BYTES / 1e6:.1f} MB)."
+
+def check_image_upload(source, size):
+    """
+    Rejects uploads that are too large or are not images of an allowed
+    format, using only the size and header bytes.
+
+    Returns:
+        tuple: (error message, error type), or (None, None) if the upload
+               may be decoded.
+    """
+    if size > MAX_IMAGE_BYTES:
+        return image_too_large_message(size), 'image_too_large'
+    try:
+        sniff_image(source, ALLOWED_IMAGE_FORMATS, MAX_IMAGE_PIXELS)
+    except ImageRejected as e:
+        return str(e), e.reason
+    return None, None
+
+def preprocess_image(source):
+    target_size = (MODEL_INPUT_SHAPE[1], MODEL_INPUT_SHAPE[0])
+    with stage('decode'):
+        img = decode_rgb(source, target_size)
+    with stage('resize'):
+        return to_array(resize_rgb(img, target_size))
+
+def store_embedding(bundle, key, vector, analysis):
+    """
+    Queues an analyzed sample's embedding for /similar (written in the background).
+    """
+    if STORE_EMBEDDINGS and bundle.embeddings is not None:
+        pH = analysis["predicted_pH"]
+        bundle.embeddings.store.put(
+            key, vector, 'analysis', analysis["predicted_soil_type"], pH if pH != "N/A" else None,
+            {"soil_quality": analysis["soil_quality"]}
+        )
+
+def render_chart(confidence_scores_dict):
+    with stage('chart_render'):
+        # The scores are ordered like the class list of the model that produced them.
+        return render_chart_png(confidence_scores_dict, list(confidence_scores_dict))
+
+def store_chart(result, png_bytes):
+    """
+    Hands the chart to the artifact store (written in the background) and
+    adds its chart_id and chart_url to result.
+    """
+    with stage('chart_store'):
+        chart_id = chart_store.put(png_bytes)
+    result["chart_id"] = chart_id
+    result["chart_url"] = f"/chart/{chart_id}"
+    return result
+
+def cacheable_fields(result):
+    return {
+        key: value for key, value in result.items()
+        if key not in ('filename', 'timestamp', 'cached', 'chart_id', 'chart_url', 'embedding')
+    }
+
+def get_chart_mode(default='inline'):
+    """
+    Reads the 'chart' request parameter: 'inline' embeds a base64 PNG in the
+    response, 'stored' renders it into the chart store and returns only its
+    chart_url, 'lazy' returns a chart_url and renders on first fetch, and
+    'none' skips it.
+    """
+    mode = request.values.get('chart', default).lower()
+    return mode if mode in CHART_MODES else default
+
+def get_tile_options():
+    """
+    Reads the tiled-inference request parameters: 'tiles' (true for the
+    default TILE_GRID, or ROWSxCOLS), 'tile_flips' and 'tile_aggregate'.
+
+    Returns:
+        tuple: (grid, flips, aggregation), with grid None when tiling is off.
+
+    Raises:
+        ValueError: If a parameter is invalid or the request asks for more
+                    than TILE_MAX_CROPS tiles.
+    """
+    tiles = request.values.get('tiles', 'false').lower()
+    if tiles in ('', '0', 'false', 'no'):
+        return None, False, None
+    grid = TILE_GRID if tiles in ('1', 'true', 'yes') else parse_grid(tiles)
+    flips = request.values.get('tile_flips', str(TILE_FLIPS)).lower() in ('1', 'true', 'yes')
+    aggregation = request.values.get('tile_aggregate', TILE_AGGREGATION).lower()
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"Invalid tile_aggregate '{aggregation}'. Use one of: {', '.join(AGGREGATIONS)}.")
+    crops = grid[0] * grid[1] * (2 if flips else 1)
+    if crops > TILE_MAX_CROPS:
+        raise ValueError(f"{crops} tiles requested; the limit is {TILE_MAX_CROPS}.")
+    return grid, flips, aggregation
+
+@app.before_request
+def start_request_timer():
+    g.request_timer = RequestTimer(STAGE_LATENCY, request.endpoint or 'unknown', profile=profile_sampler.acquire())
+
+@app.after_request
+def record_request_metrics(response):
+    timer = g.get('request_timer')
+    if timer is not None:
+        elapsed = timer.elapsed()
+        REQUEST_COUNT.inc(endpoint=timer.endpoint, status=str(response.status_code))
+        REQUEST_LATENCY.observe(elapsed, endpoint=timer.endpoint)
+        if elapsed * 1000.0 >= SLOW_REQUEST_MS:
+            breakdown = ', '.join(f"{name} {seconds * 1000.0:.1f}" for name, seconds in timer.stages.items())
+            print(f"Slow request: {timer.endpoint} took {elapsed * 1000.0:.1f} ms ({breakdown or 'no stages'})")
+    model_version = g.get('model_version')
+    if model_version is not None:
+        response.headers['X-Model-Version'] = model_version
+    return response
+
+@app.teardown_request
+def release_request_model(error=None):
+    bundle = g.pop('served_model', None)
+    if bundle is not None:
+        release_served_model(bundle)
+
+@app.teardown_request
+def finish_request_profile(error=None):
+    timer = g.pop('request_timer', None)
+    if timer is not None and timer.profiler is not None:
         try:
-            plt.savefig(save_path, format='png')
-            print(f"Chart image saved to: {save_path}")
-        except Exception as e:
-            print(f"ERROR: Failed to save chart image to file: {e}")
+            path = timer.finish_profile(PROFILE_DIR, SLOW_REQUEST_MS / 1000.0)
+            if path:
+                print(f"Profile of slow request saved to: {path}")
+        finally:
+            profile_sampler.release()
 
-    buffer = io.BytesIO()
-    plt.savefig(buffer, format='png')
-    plt.close()
-    
-    img_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    return img_str
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    record_error('request_too_large')
+    return jsonify({"error": f"Upload is too large (limit is {MAX_REQUEST_BYTES / 1e6:.0f} MB per request)."}), 413
+
+@app.route('/metrics')
+def metrics():
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def home():
     return "Soil Quality Monitoring Backend is running! Send a POST request to /predict with an image."
 
+@app.route('/ready')
+def ready():
+    current = served
+    return jsonify({
+        "ready": current is not None,
+        "state": startup_status["state"],
+        "error": startup_status["error"],
+        "model_backend": MODEL_BACKEND,
+        "model_path": SERVED_MODEL_PATH,
+        "model_version": current.version if current is not None else None,
+        "model_metadata": current.metadata if current is not None else None,
+        "reload_error": startup_status["reload_error"],
+        # Replaced versions still finishing in-flight requests or jobs.
+        "retiring_versions": sorted(bundle.version for bundle in list(retired_models.values())),
+        "batch_sizes": current.engine.batch_sizes if current is not None else [],
+        "phases_ms": startup_status["phases_ms"]
+    }), 200 if current is not None else 503
+
+@app.route('/engine_stats')
+def engine_stats():
+    current = served
+    if current is None:
+        return jsonify({"error": "Inference engine not running. AI model not loaded on server."}), 500
+    return jsonify(dict(
+        current.engine.stats(),
+        model_version=current.version,
+        embeddings=current.embeddings.store.stats() if current.embeddings is not None else None
+    ))
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify(prediction_cache.stats())
+
+@app.route('/chart_stats')
+def chart_stats():
+    return jsonify(chart_store.stats())
+
+@app.route('/chart/<chart_id>')
+def get_chart(chart_id):
+    png_bytes = lazy_charts.get_png(chart_id)
+    if png_bytes is not None:
+        return Response(png_bytes, mimetype='image/png')
+    png_bytes = chart_store.get_png(chart_id)
+    if png_bytes is None:
+        return jsonify({"error": "Chart not found. It may have expired."}), 404
+    response = Response(png_bytes, mimetype='image/png')
+    # Stored charts are named by their content, so a given ID never changes.
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
+
 @app.route('/predict', methods=['POST'])
 def predict():
     
-    if model is None:
-        return jsonify({"error": "AI model not loaded on server. Server setup issue."}), 500
+    unavailable = model_unavailable()
+    if unavailable is not None:
+        record_error('model_unavailable')
+        return unavailable
 
     if 'image' not in request.files:
+        record_error('missing_file')
         return jsonify({"error": "No image file provided in the request. Please select a file."}), 400
 
     file = request.files['image']
 
     if file.filename == '':
+        record_error('missing_file')
         return jsonify({"error": "No selected file. Please choose an image."}), 400
 
     if file and allowed_file(file.filename):
         try:
-            img_bytes = file.read()
-            img = Image.open(io.BytesIO(img_bytes))
-            img = img.resize((MODEL_INPUT_SHAPE[0], MODEL_INPUT_SHAPE[1]))
-            img_array = np.array(img).astype('float32')
-
-            if img_array.ndim == 2:
-                img_array = np.stack([img_array, img_array, img_array], axis=-1)
-            elif img_array.shape[-1] == 4:
-                img_array = img_array[..., :3]
-
-            img_array = np.expand_dims(img_array, axis=0)
-            img_array /= 255.0
-
-            soil_type_predictions, pH_predictions = model.predict(img_array)
-
-            predicted_class_idx = np.argmax(soil_type_predictions, axis=1)[0]
-            confidence = float(soil_type_predictions[0][predicted_class_idx])
-            predicted_soil_type = SOIL_CLASSES[predicted_class_idx]
-            
-           
-            if predicted_soil_type == 'Not soil':
-                predicted_pH = None 
-                soil_quality = "Not a soil sample"
-                recommendations = "This image does not appear to be a soil sample. Please upload an image of soil for analysis."
-            else:
-                # Use the model's pH prediction only if it's a soil type
-                predicted_pH = float(pH_predictions[0][0])
-                is_pH_good = 6.0 <= predicted_pH <= 6.8
-                
-                # Determine soil quality based on soil type and pH
-                if predicted_soil_type == 'Alluvial soil' and is_pH_good:
-                    soil_quality = "Excellent"
-                elif predicted_soil_type == 'Alluvial soil':
-                    soil_quality = "Good" # Alluvial is good, but pH is off
-                elif predicted_soil_type == 'Black Soil' and is_pH_good:
-                    soil_quality = "Good" # pH helps make it good
-                elif predicted_soil_type == 'Black Soil':
-                    soil_quality = "Okay"
-                elif predicted_soil_type == 'Clay soil' and is_pH_good:
-                    soil_quality = "Okay" # pH is good, but drainage is still a challenge
-                elif predicted_soil_type == 'Clay soil':
-                    soil_quality = "Challenging"
-                elif predicted_soil_type == 'Red soil' and is_pH_good:
-                    soil_quality = "Okay"
-                elif predicted_soil_type == 'Red soil':
-                    soil_quality = "Challenging"
-                else:
-                    soil_quality = "Unknown"
-
-                # Generate recommendations based on the actual soil type
-                recommendations = ""
-                if predicted_soil_type == 'Alluvial soil':
-                    recommendations = "Alluvial soil is typically fertile and good for tomatoes. Ensure consistent moisture and balanced nutrients. Good drainage is key."
-                    if not is_pH_good:
-                        recommendations += f" However, the pH level of {round(predicted_pH, 2)} is outside the ideal range (6.0-6.8). You may need to adjust it."
-                elif predicted_soil_type == 'Black Soil':
-                    recommendations = "Black soil is rich in clay and organic matter, holding water well. Ensure good aeration to prevent waterlogging. Calcium supplementation can be beneficial for tomato quality."
-                    if not is_pH_good:
-                        recommendations += f" The pH level of {round(predicted_pH, 2)} is outside the ideal range (6.0-6.8), which may require adjustment."
-                elif predicted_soil_type == 'Clay soil':
-                    recommendations = "Clay soil can become compacted and has poor drainage. Amend with plenty of organic matter (compost) and consider gypsum to improve structure and drainage. Focus on consistent watering to avoid cracking."
-                    if not is_pH_good:
-                        recommendations += f" The pH level of {round(predicted_pH, 2)} is outside the ideal range (6.0-6.8), which may require adjustment."
-                elif predicted_soil_type == 'Red soil':
-                    recommendations = "Red soil can be acidic and often lacks organic matter. Add lime to raise pH if needed (target 6.0-6.8). Incorporate organic compost to improve fertility and water retention. Monitor phosphorus and iron levels."
-                    if not is_pH_good:
-                        recommendations += f" The pH level of {round(predicted_pH, 2)} is outside the ideal range (6.0-6.8), which may require adjustment."
-          
-
-            confidence_scores_dict = {
-                soil_class: float(score) * 100
-                for soil_class, score in zip(SOIL_CLASSES, soil_type_predictions[0])
-            }
+            # The upload is hashed and decoded straight from Werkzeug's spooled stream, never copied into one bytes object.
+            stream = file.stream
+            with stage('upload_read'):
+                image_size = stream_size(stream)
+            BYTES_PROCESSED.inc(image_size, endpoint='predict')
+            with stage('sniff'):
+                error, error_type = check_image_upload(stream, image_size)
+            if error is not None:
+                record_error(error_type)
+                return jsonify({"error": error}), 413 if error_type in ('image_too_large', 'too_many_pixels') else 400
+
+            try:
+                tile_grid, tile_flips, tile_aggregation = get_tile_options()
+            except ValueError as e:
+                record_error('invalid_tiles')
+                return jsonify({"error": str(e)}), 400
 
-            timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-            chart_filename = f"chart_{timestamp}.png"
-            chart_save_path = os.path.join(UPLOAD_FOLDER, chart_filename)
-
-            chart_image_base64 = generate_chart_image(
-                confidence_scores_dict,
-                SOIL_CLASSES,
-                save_path=chart_save_path
-            )
-            
-            # Conditionally format pH value for the response
-            pH_response_value = round(predicted_pH, 2) if predicted_pH is not None else "N/A"
-
-            return jsonify({
-                "predicted_soil_type": predicted_soil_type,
-                "confidence": round(confidence * 100, 2),
-                "predicted_pH": pH_response_value,
-                "soil_quality": soil_quality,
-                "recommendations": recommendations,
+            want_embedding = request.values.get('embedding', 'false').lower() in ('1', 'true', 'yes')
+            embedding = None
+
+            # One model version serves the whole request, even if a reload swaps it meanwhile.
+            bundle = g.served_model = acquire_served_model()
+            g.model_version = bundle.version
+            with stage('cache_lookup'):
+                image_hash = sample_key = hash_image_stream(stream)
+                if tile_grid is not None:
+                    # Tiled results differ from whole-image ones, so they are cached separately.
+                    image_hash = (f"{image_hash}:tiles={tile_grid[0]}x{tile_grid[1]},"
+                                  f"flips={tile_flips},{tile_aggregation}")
+                analysis = prediction_cache.get(image_hash, bundle.version)
+            cached = analysis is not None
+
+            if not cached and tile_grid is not None:
+                target_size = (MODEL_INPUT_SHAPE[1], MODEL_INPUT_SHAPE[0])
+                with stage('decode'):
+                    tiles = decode_tiles(stream, tile_grid, target_size, tile_flips)
+                # All tiles share one engine call, so they run as one (or a few) batched forward passes.
+                with stage('predict'):
+                    soil_type_predictions, pH_predictions, *extra_outputs = bundle.engine.predict(tiles)
+                with stage('interpret'):
+                    scores, pH, spread = aggregate_tiles(soil_type_predictions, pH_predictions, tile_aggregation)
+                    analysis = interpret_predictions(scores, pH, bundle.rules)[0]
+                    spread["grid"] = f"{tile_grid[0]}x{tile_grid[1]}"
+                    spread["flips"] = tile_flips
+                    spread["score_std"] = dict(zip(bundle.classes, spread["score_std"]))
+                    analysis["tiles"] = spread
+                    analysis["model_version"] = bundle.version
+                if extra_outputs:
+                    # Tiled embeddings are the mean over tiles; only whole-image ones are stored for /similar.
+                    embedding = normalize(extra_outputs[0].mean(axis=0))
+            elif not cached:
+                img_array = np.expand_dims(preprocess_image(stream), axis=0)
+
+                with stage('predict'):
+                    soil_type_predictions, pH_predictions, *extra_outputs = bundle.engine.predict(img_array)
+                with stage('interpret'):
+                    analysis = interpret_predictions(soil_type_predictions[:1], pH_predictions[:1], bundle.rules)[0]
+                    analysis["model_version"] = bundle.version
+                if extra_outputs:
+                    embedding = normalize(extra_outputs[0][0])
+                    store_embedding(bundle, sample_key, embedding, analysis)
+            PREDICTION_COUNT.inc(soil_type=analysis["predicted_soil_type"], cached=str(cached).lower())
+
+            response = {
+                **analysis,
                 "timestamp": np.datetime_as_string(np.datetime64('now')),
-                "chart_image": chart_image_base64
-            })
+                "cached": cached
+            }
+            if want_embedding:
+                if embedding is None and bundle.embeddings is not None:
+                    embedding = bundle.embeddings.store.get(sample_key)
+                response["embedding"] = [round(v, 5) for v in embedding.tolist()] if embedding is not None else None
+            add_chart(response, get_chart_mode(), save=True)
+            if not cached or ("chart_image" in response and "chart_image" not in analysis):
+                prediction_cache.put(image_hash, cacheable_fields(response), bundle.version)
+            with stage('json'):
+                return jsonify(response)
         except Exception as e:
+            record_error(type(e).__name__)
             print(f"ERROR during image processing or prediction: {e}")
             import traceback
             traceback.print_exc()
             return jsonify({"error": f"Server error processing image: {e}"}), 500
     else:
+        record_error('invalid_file_type')
         return jsonify({"error": "Invalid file type. Please upload a PNG, JPG, JPEG, or GIF image."}), 400
 
+def add_chart(result, chart_mode, save=False):
+    """
+    Adds the chart for result in the requested chart mode. With save=True an
+    inline chart is also kept in the chart store, as /predict does.
+    """
+    if chart_mode == 'inline':
+        if "chart_image" in result:
+            # Already rendered for a cached result. It is put back into the store (a no-op
+            # if still there) so cached and fresh responses both carry a chart_url.
+            if save:
+                store_chart(result, base64.b64decode(result["chart_image"]))
+            return result
+        png_bytes = render_chart(result["confidence_scores"])
+        result["chart_image"] = base64.b64encode(png_bytes).decode('utf-8')
+        if save:
+            store_chart(result, png_bytes)
+    elif chart_mode == 'stored':
+        chart_image = result.pop("chart_image", None)
+        png_bytes = base64.b64decode(chart_image) if chart_image else render_chart(result["confidence_scores"])
+        store_chart(result, png_bytes)
+    else:
+        result.pop("chart_image", None)
+
+    if chart_mode == 'lazy':
+        chart_id = lazy_charts.add(result["confidence_scores"], list(result["confidence_scores"]))
+        result["chart_id"] = chart_id
+        result["chart_url"] = f"/chart/{chart_id}"
+    return result
+
+def iter_archive_images(file):
+    """
+    Yields (name, img_bytes, error) for every member of an uploaded zip or tar
+    archive, reading one member at a time. Members are size-checked from the
+    archive index before they are extracted, so a small archive cannot expand
+    into a huge one in memory.
+    """
+    name = file.filename.lower()
+    try:
+        if name.endswith('.zip'):
+            with zipfile.ZipFile(file.stream) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    if not allowed_file(info.filename):
+                        yield info.filename, None, "Invalid file type"
+                        continue
+                    if info.file_size > MAX_IMAGE_BYTES:
+                        yield info.filename, None, image_too_large_message(info.file_size)
+                        continue
+                    yield (info.filename, *checked_bytes(archive.read(info)))
+        else:
+            with tarfile.open(fileobj=file.stream, mode='r:*') as archive:
+                for member in archive:
+                    if not member.isfile():
+                        continue
+                    if not allowed_file(member.name):
+                        yield member.name, None, "Invalid file type"
+                        continue
+                    if member.size > MAX_IMAGE_BYTES:
+                        yield member.name, None, image_too_large_message(member.size)
+                        continue
+                    yield (member.name, *checked_bytes(archive.extractfile(member).read()))
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        yield file.filename, None, f"Unreadable archive ({e})"
+
+def checked_bytes(img_bytes):
+    """
+    Returns (img_bytes, None) for an acceptable image, or (None, error).
+    """
+    error, _ = check_image_upload(img_bytes, len(img_bytes))
+    return (None, error) if error is not None else (img_bytes, None)
+
+def iter_batch_uploads(files):
+    for file in files:
+        if file.filename == '':
+            continue
+        if is_archive(file.filename):
+            yield from iter_archive_images(file)
+        elif allowed_file(file.filename):
+            size = stream_size(file.stream)
+            error, _ = check_image_upload(file.stream, size)
+            if error is not None:
+                yield file.filename, None, error
+            else:
+                yield file.filename, file.read(), None
+        else:
+            yield file.filename, None, "Invalid file type"
+
+def analyze_batch_chunk(chunk, chart_mode, bundle, endpoint='predict_batch'):
+    """
+    Decodes a chunk of uploads in parallel, runs the decodable ones through the
+    model in one call and returns one result dict per upload, in order. Uploads
+    already in the prediction cache skip decoding and inference. bundle is the
+    ServedModel the caller captured, so every chunk of a request uses the same
+    model version.
+    """
+    results = [None] * len(chunk)
+    pending = []
+    image_hashes = {}
+    for i, (filename, img_bytes, error) in enumerate(chunk):
+        if error is not None:
+            results[i] = {"filename": filename, "error": error}
+            continue
+        BYTES_PROCESSED.inc(len(img_bytes), endpoint=endpoint)
+        with stage('cache_lookup'):
+            image_hashes[i] = hash_image_bytes(img_bytes)
+            analysis = prediction_cache.get(image_hashes[i], bundle.version)
+        if analysis is not None:
+            PREDICTION_COUNT.inc(soil_type=analysis["predicted_soil_type"], cached='true')
+            results[i] = add_chart({"filename": filename, **analysis, "cached": True}, chart_mode)
+        else:
+            pending.append(i)
+
+    # Decoding and resizing happen together on the decode pool, so they are timed as one stage.
+    with stage('decode'):
+        batch, errors = decode_batch(
+            [chunk[i][1] for i in pending],
+            target_size=(MODEL_INPUT_SHAPE[1], MODEL_INPUT_SHAPE[0]),
+            executor=decode_pool
+        )
+
+    valid = []
+    for row, (i, error) in enumerate(zip(pending, errors)):
+        if error is not None:
+            results[i] = {"filename": chunk[i][0], "error": error}
+        else:
+            valid.append((row, i))
+
+    if valid:
+        rows = [row for row, _ in valid]
+        batch = batch if len(rows) == len(pending) else batch[rows]
+        try:
+            with stage('predict'):
+                soil_type_predictions, pH_predictions, *extra_outputs = bundle.engine.predict(batch)
+        except Exception as e:
+            record_error(type(e).__name__, endpoint=endpoint)
+            print(f"ERROR during batch prediction: {e}")
+            for _, i in valid:
+                results[i] = {"filename": chunk[i][0], "error": f"Prediction failed ({e})"}
+            return results
+
+        with stage('interpret'):
+            analyses = interpret_predictions(soil_type_predictions, pH_predictions, bundle.rules)
+        embeddings = normalize(extra_outputs[0]) if extra_outputs else None
+        for row, (analysis, (_, i)) in enumerate(zip(analyses, valid)):
+            analysis["model_version"] = bundle.version
+            if embeddings is not None:
+                store_embedding(bundle, image_hashes[i], embeddings[row], analysis)
+            PREDICTION_COUNT.inc(soil_type=analysis["predicted_soil_type"], cached='false')
+            results[i] = add_chart({"filename": chunk[i][0], **analysis, "cached": False}, chart_mode)
+            prediction_cache.put(image_hashes[i], cacheable_fields(results[i]), bundle.version)
+    return results
+
+@app.route('/similar', methods=['GET', 'POST'])
+def similar():
+    """
+    Returns the k past samples (analyzed images, training images, samples
+    with lab results) most similar to a query, by cosine similarity of the
+    model's embeddings. The query is either an uploaded 'image' or the 'key'
+    (image SHA-256) of a stored sample. Optional parameters: k (default 5)
+    and source (comma-separated, e.g. 'train' to compare only with known
+    samples).
+    """
+    unavailable = model_unavailable()
+    if unavailable is not None:
+        record_error('model_unavailable')
+        return unavailable
+    bundle = g.served_model = acquire_served_model()
+    g.model_version = bundle.version
+    if bundle.embeddings is None:
+        record_error('embeddings_unavailable')
+        return jsonify({"error": "Similar-sample search is not available for this model (needs the Keras "
+                                 "backend and EMBEDDINGS_ENABLED)."}), 501
+
+    try:
+        k = int(request.values.get('k', 5))
+    except ValueError:
+        record_error('invalid_k')
+        return jsonify({"error": "k must be an integer."}), 400
+    k = max(1, min(k, SIMILAR_MAX_K))
+    sources = [source.strip() for source in request.values.get('source', '').split(',') if source.strip()] or None
+
+    store = bundle.embeddings.store
+    query = {}
+    file = request.files.get('image')
+    if file is not None and file.filename:
+        if not allowed_file(file.filename):
+            record_error('invalid_file_type')
+            return jsonify({"error": "Invalid file type. Please upload a PNG, JPG, JPEG, or GIF image."}), 400
+        stream = file.stream
+        image_size = stream_size(stream)
+        BYTES_PROCESSED.inc(image_size, endpoint='similar')
+        error, error_type = check_image_upload(stream, image_size)
+        if error is not None:
+            record_error(error_type)
+            return jsonify({"error": error}), 413 if error_type in ('image_too_large', 'too_many_pixels') else 400
+        key = hash_image_stream(stream)
+        vector = store.get(key)
+        if vector is None:
+            with stage('predict'):
+                soil_type_predictions, pH_predictions, embeddings = bundle.engine.predict(
+                    np.expand_dims(preprocess_image(stream), axis=0)
+                )
+            analysis = interpret_predictions(soil_type_predictions, pH_predictions, bundle.rules)[0]
+            vector = normalize(embeddings[0])
+            store_embedding(bundle, key, vector, analysis)
+            query = {"predicted_soil_type": analysis["predicted_soil_type"], "predicted_pH": analysis["predicted_pH"]}
+    else:
+        key = request.values.get('key')
+        if not key:
+            record_error('missing_file')
+            return jsonify({"error": "Provide an 'image' upload or the 'key' of a stored sample."}), 400
+        vector = store.get(key)
+        if vector is None:
+            record_error('unknown_sample')
+            return jsonify({"error": f"No stored sample with key '{key}' for model version {bundle.version}."}), 404
+
+    with stage('search'):
+        neighbors = bundle.embeddings.search(vector, k, SIMILAR_NPROBE, sources, exclude_key=key)
+    with stage('json'):
+        return jsonify({
+            "key": key,
+            "query": query,
+            "model_version": bundle.version,
+            "count": len(neighbors),
+            "neighbors": neighbors
+        })
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """
+    Accepts many images in one request, either as repeated 'images' fields or
+    as zip/tar archives, and returns one result per image. Items that cannot be
+    decoded get an 'error' entry instead of failing the whole batch. Charts are
+    only produced when requested with chart=inline|lazy (or include_chart=true).
+    """
+    unavailable = model_unavailable()
+    if unavailable is not None:
+        record_error('model_unavailable')
+        return unavailable
+
+    files = request.files.getlist('images') + request.files.getlist('archive')
+    if not files:
+        record_error('missing_file')
+        return jsonify({"error": "No images provided. Send files in the 'images' field or an archive in 'archive'."}), 400
+
+    bundle = g.served_model = acquire_served_model()
+    g.model_version = bundle.version
+    include_chart = request.values.get('include_chart', 'false').lower() in ('1', 'true', 'yes')
+    chart_mode = get_chart_mode(default='inline' if include_chart else 'none')
+
+    results = []
+    chunk = []
+    try:
+        for item in iter_batch_uploads(files):
+            if len(results) + len(chunk) >= BATCH_MAX_IMAGES:
+                record_error('too_many_images')
+                return jsonify({"error": f"Too many images in one batch (limit is {BATCH_MAX_IMAGES})."}), 413
+            chunk.append(item)
+            if len(chunk) >= BATCH_CHUNK_SIZE:
+                results.extend(analyze_batch_chunk(chunk, chart_mode, bundle))
+                chunk = []
+        if chunk:
+            results.extend(analyze_batch_chunk(chunk, chart_mode, bundle))
+    except Exception as e:
+        record_error(type(e).__name__)
+        print(f"ERROR during batch processing: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"Server error processing batch: {e}"}), 500
+
+    failed = sum(1 for result in results if "error" in result)
+    if failed:
+        record_error('batch_item', failed)
+    with stage('json'):
+        return jsonify({
+            "count": len(results),
+            "succeeded": len(results) - failed,
+            "failed": failed,
+            "timestamp": np.datetime_as_string(np.datetime64('now')),
+            "results": results
+        })
+
+
+def run_job(job_id, items, chart_mode):
+    """
+    Analyzes a job's images chunk by chunk on the job pool, appending each
+    chunk's results to the job store so GET /jobs/<id> can report progress.
+    """
+    bundle = None
+    try:
+        job_store.update(job_id, JOB_RUNNING)
+        bundle = acquire_served_model()
+        failed = 0
+        while items:
+            chunk, items[:BATCH_CHUNK_SIZE] = items[:BATCH_CHUNK_SIZE], []
+            results = analyze_batch_chunk(chunk, chart_mode, bundle, endpoint='jobs')
+            failed += sum(1 for result in results if "error" in result)
+            job_store.append_results(job_id, results)
+        if failed:
+            record_error('batch_item', failed, endpoint='jobs')
+        job_store.update(job_id, JOB_DONE)
+    except Exception as e:
+        record_error(type(e).__name__, endpoint='jobs')
+        print(f"ERROR during job {job_id}: {e}")
+        import traceback
+        traceback.print_exc()
+        job_store.update(job_id, JOB_FAILED, error=f"Server error processing job: {e}")
+    finally:
+        if bundle is not None:
+            release_served_model(bundle)
+        job_slots.release()
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """
+    Accepts one or many images ('image', 'images' or zip/tar 'archive' fields)
+    and returns a job ID right away; the analysis runs in the background. Poll
+    GET /jobs/<id> for progress and results. Returns 429 when this process
+    already has JOB_QUEUE_SIZE jobs queued or running.
+    """
+    unavailable = model_unavailable()
+    if unavailable is not None:
+        record_error('model_unavailable')
+        return unavailable
+
+    # Checked before the upload is parsed, so a full server does not spend time reading it.
+    if not job_slots.acquire(blocking=False):
+        record_error('queue_full')
+        response = jsonify({"error": "Too many analysis jobs in progress. Please retry shortly."})
+        response.headers['Retry-After'] = '10'
+        return response, 429
+
+    submitted = False
+    try:
+        files = request.files.getlist('image') + request.files.getlist('images') + request.files.getlist('archive')
+        items = []
+        for item in iter_batch_uploads(files):
+            if len(items) >= BATCH_MAX_IMAGES:
+                record_error('too_many_images')
+                return jsonify({"error": f"Too many images in one job (limit is {BATCH_MAX_IMAGES})."}), 413
+            items.append(item)
+        if not items:
+            record_error('missing_file')
+            return jsonify({"error": "No images provided. Send files in the 'image' or 'images' field or an archive in 'archive'."}), 400
+
+        include_chart = request.values.get('include_chart', 'false').lower() in ('1', 'true', 'yes')
+        chart_mode = get_chart_mode(default='inline' if include_chart else 'none')
+
+        job_store.delete_expired()
+        job_id = job_store.create(len(items), chart_mode)
+        job_executor.submit(run_job, job_id, items, chart_mode)
+        submitted = True
+    finally:
+        if not submitted:
+            job_slots.release()
+
+    response = jsonify({
+        "job_id": job_id,
+        "state": "queued",
+        "total": len(items),
+        "status_url": f"/jobs/{job_id}"
+    })
+    response.headers['Location'] = f"/jobs/{job_id}"
+    return response, 202
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """
+    Returns a job's state, progress and the results gathered so far. Pass
+    results=false to poll progress without the results list.
+    """
+    include_results = request.args.get('results', 'true').lower() not in ('0', 'false', 'no')
+    job = job_store.get(job_id, include_results=include_results)
+    if job is None:
+        return jsonify({"error": "Job not found. It may have expired."}), 404
+    return jsonify(job)
+
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
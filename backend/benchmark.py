@@ -0,0 +1,366 @@
+"""
+Offline, CPU-only benchmarks for the serving and training hot paths.
+
+Suites (all run by default, pick some with --suites):
+
+    stages     Per-image cost of each /predict step: decode, resize, inference,
+               chart rendering and JSON encoding.
+    serving    End-to-end /predict latency (p50/p95/p99) and throughput at
+               several concurrency levels, through the Flask test client.
+    inference  Model forward-pass throughput for each batch size.
+    pipeline   Training input pipeline (train_model.build_pipeline) images/sec.
+
+Results are written as JSON. Passing --baseline compares every metric with a
+stored run and exits with status 1 if any got worse by more than --threshold.
+
+Usage (from the 'backend' folder):
+
+    python benchmark.py --output bench_baseline.json
+    python benchmark.py --baseline bench_baseline.json --threshold 0.15
+    python benchmark.py --suites serving --concurrency 1,8,32 --requests 400
+
+The serving suite runs with the prediction cache disabled, so every request
+does the full decode and inference work.
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from dataset_files import sample_images
+
+SAMPLE_DIR = '../Dataset/test'
+SUITES = ('stages', 'serving', 'inference', 'pipeline')
+SAMPLE_COUNT = 32
+REPEATS = 50
+SERVING_REQUESTS = 200
+CONCURRENCY_LEVELS = (1, 4, 16)
+BATCH_SIZES = (1, 2, 4, 8, 16, 32)
+PIPELINE_BATCHES = 20
+REGRESSION_THRESHOLD = 0.10
+
+
+def percentiles(samples_ms):
+    samples = np.asarray(samples_ms, dtype='float64')
+    if samples.size == 0:
+        return {}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {
+        'mean_ms': round(float(samples.mean()), 3),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+    }
+
+
+def time_calls(fn, repeats):
+    samples = []
+    for i in range(repeats):
+        started_at = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - started_at) * 1000.0)
+    return samples
+
+
+def load_samples(sample_dir, count):
+    paths = sample_images(sample_dir, count)
+    if not paths:
+        raise SystemExit(f"ERROR: No sample images found in '{sample_dir}'.")
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append((os.path.basename(path), f.read()))
+    return images
+
+
+def import_app():
+    """
+    Imports app.py with the model loaded synchronously and the prediction
+    cache disabled. Returns the module, or None if the model did not load.
+    """
+    os.environ['LOAD_MODEL_IN_BACKGROUND'] = 'false'
+    os.environ['PREDICTION_CACHE_MAX_ENTRIES'] = '0'
+    os.environ.pop('PREDICTION_CACHE_DB', None)
+    # Keep benchmark charts, jobs and analyzed samples out of the server's stores.
+    os.environ['CHART_STORE_DIR'] = tempfile.mkdtemp(prefix='bench_charts_')
+    os.environ.pop('LAZY_CHART_DB', None)
+    os.environ['JOB_DB'] = os.path.join(tempfile.mkdtemp(prefix='bench_jobs_'), 'jobs.sqlite3')
+    os.environ['STORE_EMBEDDINGS'] = 'false'
+    import app as app_module
+    if app_module.served is None:
+        print(f"  Skipping: the model did not load ({app_module.startup_status['error']}).")
+        return None
+    return app_module
+
+
+def bench_stages(images, repeats):
+    """
+    Times each step of a single /predict request in isolation.
+    """
+    from image_preprocessing import decode_rgb, resize_rgb, TARGET_SIZE
+    from chart_renderer import render_chart_png
+
+    decoded = [decode_rgb(img_bytes, TARGET_SIZE) for _, img_bytes in images]
+    results = {
+        'decode': percentiles(time_calls(lambda i: decode_rgb(images[i % len(images)][1], TARGET_SIZE), repeats)),
+        'resize': percentiles(time_calls(lambda i: resize_rgb(decoded[i % len(decoded)], TARGET_SIZE), repeats)),
+    }
+
+    app_module = import_app()
+    if app_module is None:
+        return results
+
+    model = app_module.served.model
+    classes = app_module.served.classes
+    batch = np.stack([app_module.preprocess_image(img_bytes) for _, img_bytes in images])
+    outputs = model.predict_on_batch(batch[:1])
+    results['inference'] = percentiles(time_calls(
+        lambda i: model.predict_on_batch(batch[i % len(batch):i % len(batch) + 1]), repeats
+    ))
+
+    analysis = app_module.interpret_predictions(np.asarray(outputs[0])[:1], np.asarray(outputs[1])[:1],
+                                                app_module.served.rules)[0]
+    render_chart_png(analysis['confidence_scores'], classes)
+    results['chart'] = percentiles(time_calls(
+        lambda i: render_chart_png(analysis['confidence_scores'], classes), repeats
+    ))
+
+    response = dict(analysis, chart_image=base64.b64encode(render_chart_png(analysis['confidence_scores'], classes))
+                    .decode('utf-8'), timestamp=np.datetime_as_string(np.datetime64('now')), cached=False)
+    with app_module.app.app_context():
+        results['json'] = percentiles(time_calls(lambda i: app_module.jsonify(response).get_data(), repeats))
+    return results
+
+
+def bench_serving(images, concurrency_levels, total_requests, chart_mode):
+    """
+    Sends total_requests /predict requests at each concurrency level, each
+    worker thread using its own test client, and reports latency percentiles
+    and throughput.
+    """
+    app_module = import_app()
+    if app_module is None:
+        return {}
+
+    def post(client, i):
+        filename, img_bytes = images[i % len(images)]
+        return client.post('/predict', data={'image': (io.BytesIO(img_bytes), filename), 'chart': chart_mode},
+                           content_type='multipart/form-data')
+
+    post(app_module.app.test_client(), 0)
+
+    results = {}
+    for concurrency in concurrency_levels:
+        latencies = []
+        errors = []
+        counter = iter(range(total_requests))
+        counter_lock = threading.Lock()
+
+        def worker():
+            client = app_module.app.test_client()
+            while True:
+                with counter_lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                started_at = time.perf_counter()
+                response = post(client, i)
+                elapsed_ms = (time.perf_counter() - started_at) * 1000.0
+                with counter_lock:
+                    latencies.append(elapsed_ms)
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started_at
+
+        results[f'c{concurrency}'] = dict(
+            percentiles(latencies),
+            requests_per_sec=round(total_requests / elapsed, 2),
+            errors=len(errors)
+        )
+        print(f"  concurrency {concurrency}: {results[f'c{concurrency}']}")
+
+    return results
+
+
+def bench_inference(images, batch_sizes, repeats):
+    app_module = import_app()
+    if app_module is None:
+        return {}
+
+    model = app_module.served.model
+    decoded = np.stack([app_module.preprocess_image(img_bytes) for _, img_bytes in images])
+    results = {}
+    for batch_size in batch_sizes:
+        batch = decoded[np.arange(batch_size) % len(decoded)]
+        model.predict_on_batch(batch)
+        samples = time_calls(lambda i: model.predict_on_batch(batch), max(3, repeats // batch_size))
+        stats = percentiles(samples)
+        stats['images_per_sec'] = round(batch_size * 1000.0 / stats['mean_ms'], 2)
+        results[f'b{batch_size}'] = stats
+        print(f"  batch {batch_size}: {stats['mean_ms']:.2f} ms/batch, {stats['images_per_sec']:.1f} images/sec")
+    return results
+
+
+def bench_pipeline(dataset_dir, batches):
+    """
+    Measures how fast the training input pipeline produces batches, without
+    running the model. The pipeline is built uncached, so every epoch decodes.
+    """
+    try:
+        import train_model
+    except ImportError as e:
+        print(f"  Skipping: {e}")
+        return {}
+
+    (paths, labels), _, _ = train_model.split_files(dataset_dir)
+    dataset = train_model.build_pipeline(paths, labels, training=True, cache='none')
+    iterator = iter(dataset.repeat())
+    next(iterator)
+
+    images = 0
+    started_at = time.perf_counter()
+    for _ in range(batches):
+        batch_images, _ = next(iterator)
+        images += int(batch_images.shape[0])
+    elapsed = time.perf_counter() - started_at
+    results = {
+        'images_per_sec': round(images / elapsed, 2),
+        'batch_mean_ms': round(elapsed * 1000.0 / batches, 3),
+    }
+    print(f"  {results['images_per_sec']:.1f} images/sec ({results['batch_mean_ms']:.1f} ms/batch)")
+    return results
+
+
+def flatten_metrics(results, prefix=''):
+    metrics = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten_metrics(value, name + '.'))
+        elif isinstance(value, (int, float)) and (name.endswith('_ms') or name.endswith('_per_sec')):
+            metrics[name] = value
+    return metrics
+
+
+def compare_to_baseline(results, baseline, threshold):
+    """
+    Compares every latency (*_ms, lower is better) and throughput (*_per_sec,
+    higher is better) metric present in both runs.
+
+    Returns:
+        list: (metric, baseline value, current value, relative change) for
+              each metric that got worse by more than threshold.
+    """
+    current = flatten_metrics(results)
+    previous = flatten_metrics(baseline.get('results', {}))
+    regressions = []
+    print(f"\n{'metric':<42} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name in sorted(current.keys() & previous.keys()):
+        old, new = previous[name], current[name]
+        if not old:
+            continue
+        change = (new - old) / old
+        worse = change > threshold if name.endswith('_ms') else change < -threshold
+        print(f"{name:<42} {old:>12.3f} {new:>12.3f} {change:>+8.1%}{'  REGRESSION' if worse else ''}")
+        if worse:
+            regressions.append((name, old, new, change))
+    return regressions
+
+
+def parse_int_list(value):
+    return tuple(int(item) for item in value.split(',') if item)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the soil analysis serving and training hot paths.")
+    parser.add_argument('--suites', default=','.join(SUITES), help=f"Comma-separated suites (default: all of {','.join(SUITES)}).")
+    parser.add_argument('--sample-dir', default=SAMPLE_DIR, help=f"Images used as requests (default: {SAMPLE_DIR}).")
+    parser.add_argument('--samples', type=int, default=SAMPLE_COUNT, help=f"Number of sample images (default: {SAMPLE_COUNT}).")
+    parser.add_argument('--repeats', type=int, default=REPEATS, help=f"Timed calls per stage (default: {REPEATS}).")
+    parser.add_argument('--requests', type=int, default=SERVING_REQUESTS,
+                        help=f"/predict requests per concurrency level (default: {SERVING_REQUESTS}).")
+    parser.add_argument('--concurrency', type=parse_int_list, default=CONCURRENCY_LEVELS,
+                        help="Comma-separated concurrency levels (default: 1,4,16).")
+    parser.add_argument('--chart', default='inline', choices=('inline', 'stored', 'lazy', 'none'),
+                        help="Chart mode of the /predict requests (default: inline, as the frontend uses).")
+    parser.add_argument('--batch-sizes', type=parse_int_list, default=BATCH_SIZES,
+                        help="Comma-separated batch sizes for the inference suite (default: 1,2,4,8,16,32).")
+    parser.add_argument('--dataset', default='../Dataset/Train', help="Dataset for the pipeline suite.")
+    parser.add_argument('--pipeline-batches', type=int, default=PIPELINE_BATCHES,
+                        help=f"Batches drawn from the training pipeline (default: {PIPELINE_BATCHES}).")
+    parser.add_argument('--output', default=None, help="Write the results as JSON to this path.")
+    parser.add_argument('--baseline', default=None, help="Compare against a previous --output file.")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help=f"Relative change counted as a regression (default: {REGRESSION_THRESHOLD}).")
+    args = parser.parse_args()
+
+    suites = [suite for suite in args.suites.split(',') if suite]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suites: {', '.join(sorted(unknown))}")
+
+    images = load_samples(args.sample_dir, args.samples)
+    results = {}
+    for suite in suites:
+        print(f"\n--- Benchmark: {suite} ---")
+        if suite == 'stages':
+            results[suite] = bench_stages(images, args.repeats)
+            for stage, stats in results[suite].items():
+                print(f"  {stage:<10} p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms")
+        elif suite == 'serving':
+            results[suite] = bench_serving(images, args.concurrency, args.requests, args.chart)
+        elif suite == 'inference':
+            results[suite] = bench_inference(images, args.batch_sizes, args.repeats)
+        elif suite == 'pipeline':
+            results[suite] = bench_pipeline(args.dataset, args.pipeline_batches)
+
+    run = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': {
+            'suites': suites,
+            'samples': len(images),
+            'repeats': args.repeats,
+            'requests': args.requests,
+            'concurrency': list(args.concurrency),
+            'chart': args.chart,
+            'batch_sizes': list(args.batch_sizes),
+            'model_backend': os.environ.get('MODEL_BACKEND', 'keras'),
+        },
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('host', {}).get('cpu_count') != run['host']['cpu_count']:
+            print("WARNING: The baseline was recorded on a machine with a different core count.")
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} metrics regressed by more than {args.threshold:.0%}.")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.threshold:.0%}.")
@@ -0,0 +1,436 @@
+"""
+Scores a directory tree or tar/zip archives of images offline, with the same
+model, class list and soil rules the server uses, and writes one result row
+per image.
+
+Images are streamed: archives are read member by member and only a few
+batches are in memory at a time. Decoding runs on a process pool while the
+previous batch goes through the model. Results are appended batch by batch,
+so an interrupted run can be continued with --resume; images already in the
+output are skipped.
+
+Usage (from the 'backend' folder):
+
+    python bulk_score.py ../Dataset/test --output scores.csv
+    python bulk_score.py field_photos_2024.tar.gz field_photos_2025.zip --output scores.jsonl
+    python bulk_score.py /data/photos --output scores.parquet --resume
+
+Output formats (picked from the extension or --format):
+
+    csv      One row per image, written incrementally.
+    jsonl    One JSON object per line, written incrementally.
+    parquet  A folder of part-NNNNN.parquet files (needs pyarrow). A part is
+             renamed into place once it holds --parquet-part-rows rows or the
+             run ends, so an interruption loses at most one part.
+
+Columns: id, predicted_soil_type, confidence, predicted_pH (empty for
+non-soil images), soil_quality, recommendations, model_version, one
+score_<class> column per class (in %) and error (set for images that could
+not be scored). Archive members get the id '<archive>::<member>'.
+"""
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+from PIL import UnidentifiedImageError
+
+from dataset_files import iter_image_files, is_image_file, load_class_names
+from image_preprocessing import load_rgb, to_array
+from model_registry import REGISTRY_DIR, current_version, has_model_file, list_versions, version_files
+from prediction_cache import file_fingerprint
+from soil_rules import RULES_PATH, load_rules, compile_rules, interpret_predictions
+
+MODEL_PATH = 'multi_task_soil_model.h5'
+TFLITE_MODEL_PATH = 'multi_task_soil_model_fp16.tflite'
+CLASS_NAMES_PATH = 'soil_classes.txt'
+IMG_HEIGHT = 224
+IMG_WIDTH = 224
+BATCH_SIZE = 32
+PREFETCH_BATCHES = 4          # decoded batches in flight ahead of inference
+REPORT_SECONDS = 5.0
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+PARQUET_PART_ROWS = 50000
+FORMATS = ('csv', 'jsonl', 'parquet')
+ARCHIVE_SEPARATOR = '::'
+
+
+def load_scoring_model(registry_dir=REGISTRY_DIR, version=None, backend='keras', model_path=None,
+                       classes_path=None, rules_path=RULES_PATH):
+    """
+    Loads the model app.py would serve: the given registry version, else the
+    registry's CURRENT version, else the fixed model and class files.
+
+    Returns:
+        tuple: (model, rules, version) where rules are the soil rules
+               compiled for the model's classes.
+    """
+    if model_path is None and version is None:
+        version = current_version(registry_dir)
+        if version is not None and not has_model_file(version, registry_dir, backend):
+            print(f"WARNING: Model version {version} has no {backend} model file; using the fixed model files. "
+                  f"Run 'python export_tflite.py --registry-version {version}' to add it.")
+            version = None
+    elif model_path is None and version in list_versions(registry_dir) and not has_model_file(version, registry_dir, backend):
+        raise FileNotFoundError(f"Model version '{version}' has no {backend} model file. "
+                                f"Run 'python export_tflite.py --registry-version {version}' to add it.")
+    if model_path is None and version is not None:
+        model_path, classes_path, _ = version_files(version, registry_dir, backend)
+    else:
+        model_path = model_path or (TFLITE_MODEL_PATH if backend == 'tflite' else MODEL_PATH)
+        classes_path = classes_path or CLASS_NAMES_PATH
+        version = f"legacy-{file_fingerprint(model_path, classes_path)}"
+
+    rules = compile_rules(load_rules(rules_path), load_class_names(classes_path))
+    if backend == 'tflite':
+        from tflite_model import TFLiteModel
+        model = TFLiteModel(model_path)
+    else:
+        from tensorflow import keras
+        model = keras.models.load_model(model_path)
+    print(f"Loaded model '{model_path}' (version {version}) with classes {rules.classes}.")
+    return model, rules, version
+
+
+def iter_sources(inputs, skip=frozenset(), max_image_bytes=MAX_IMAGE_BYTES):
+    """
+    Yields (item_id, source, error) for every image in the inputs, in a
+    stable order. source is a file path for loose files and the member's
+    bytes for archive members; items in skip are not read at all.
+    """
+    for input_path in inputs:
+        if os.path.isdir(input_path):
+            for path in iter_image_files(input_path):
+                if path not in skip:
+                    yield path, path, None
+        elif zipfile.is_zipfile(input_path):
+            with zipfile.ZipFile(input_path) as archive:
+                for info in archive.infolist():
+                    item_id = f"{input_path}{ARCHIVE_SEPARATOR}{info.filename}"
+                    if info.is_dir() or not is_image_file(info.filename) or item_id in skip:
+                        continue
+                    if info.file_size > max_image_bytes:
+                        yield item_id, None, f"Image is larger than {max_image_bytes} bytes"
+                    else:
+                        yield item_id, archive.read(info), None
+        elif tarfile.is_tarfile(input_path):
+            # Stream mode reads the archive front to back without seeking, so compressed tars stay cheap.
+            with tarfile.open(input_path, 'r|*') as archive:
+                for member in archive:
+                    item_id = f"{input_path}{ARCHIVE_SEPARATOR}{member.name}"
+                    if not member.isfile() or not is_image_file(member.name) or item_id in skip:
+                        continue
+                    if member.size > max_image_bytes:
+                        yield item_id, None, f"Image is larger than {max_image_bytes} bytes"
+                    else:
+                        yield item_id, archive.extractfile(member).read(), None
+        elif os.path.isfile(input_path) and is_image_file(input_path):
+            if input_path not in skip:
+                yield input_path, input_path, None
+        else:
+            print(f"WARNING: Skipping '{input_path}': not a folder, zip/tar archive or image.")
+
+
+def decode_chunk(sources, target_size):
+    """
+    Runs on the decode pool. Returns (pixels, errors): a uint8 batch (a
+    quarter of the size of the float batch to send back between processes)
+    and an error message or None per row.
+    """
+    pixels = np.zeros((len(sources), target_size[1], target_size[0], 3), dtype=np.uint8)
+    errors = []
+    for i, source in enumerate(sources):
+        try:
+            pixels[i] = np.asarray(load_rgb(source, target_size))
+            errors.append(None)
+        except UnidentifiedImageError:
+            errors.append("File is not a readable image")
+        except Exception as e:
+            errors.append(f"Could not decode image ({e})")
+    return pixels, errors
+
+
+def result_columns(class_names):
+    return (['id', 'predicted_soil_type', 'confidence', 'predicted_pH', 'soil_quality', 'recommendations',
+             'model_version'] + [f"score_{name}" for name in class_names] + ['error'])
+
+
+def _truncate_partial_line(path):
+    """
+    Cuts off a last line left half-written by an interrupted run.
+    """
+    with open(path, 'rb+') as f:
+        size = end = f.seek(0, os.SEEK_END)
+        # Scan back from the end for the last newline instead of reading the whole file.
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b'\n')
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end != size:
+            f.truncate(end)
+            print(f"Removed a partially written last line from '{path}'.")
+
+
+class CsvResultWriter:
+    def __init__(self, path, columns, resume):
+        self.done_ids = set()
+        if resume and os.path.exists(path) and os.path.getsize(path) > 0:
+            _truncate_partial_line(path)
+            with open(path, 'r', newline='') as f:
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if header != columns:
+                    raise SystemExit(f"ERROR: '{path}' has different columns (another model or class list?). "
+                                     "Write to a new file instead.")
+                self.done_ids = {row[0] for row in reader if row}
+            self._file = open(path, 'a', newline='')
+            self._writer = csv.DictWriter(self._file, fieldnames=columns)
+        else:
+            self._file = open(path, 'w', newline='')
+            self._writer = csv.DictWriter(self._file, fieldnames=columns)
+            self._writer.writeheader()
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlResultWriter:
+    def __init__(self, path, columns, resume):
+        self.done_ids = set()
+        if resume and os.path.exists(path):
+            _truncate_partial_line(path)
+            with open(path, 'r') as f:
+                self.done_ids = {json.loads(line)['id'] for line in f if line.strip()}
+        self._file = open(path, 'a' if resume else 'w')
+
+    def write(self, rows):
+        self._file.write(''.join(json.dumps(row) + '\n' for row in rows))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetResultWriter:
+    """
+    Writes results as a folder of Parquet parts. Each part is written under a
+    temporary name and renamed when complete, so every part-*.parquet file is
+    readable; parts left incomplete by an interrupted run are discarded.
+    """
+
+    def __init__(self, path, columns, resume, part_rows=PARQUET_PART_ROWS):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("ERROR: Parquet output needs pyarrow ('pip install pyarrow'). Use .csv or .jsonl instead.")
+        self._pa = pa
+        self._pq = pq
+        self.path = path
+        self.part_rows = part_rows
+        types = {'confidence': pa.float64(), 'predicted_pH': pa.float64()}
+        self.schema = pa.schema([
+            (name, pa.float64() if name.startswith('score_') else types.get(name, pa.string())) for name in columns
+        ])
+        self.done_ids = set()
+
+        os.makedirs(path, exist_ok=True)
+        for tmp_path in glob.glob(os.path.join(path, 'part-*.parquet.tmp')):
+            os.remove(tmp_path)
+        parts = sorted(glob.glob(os.path.join(path, 'part-*.parquet')))
+        if parts and not resume:
+            raise SystemExit(f"ERROR: '{path}' already holds results. Use --resume or --overwrite.")
+        for part in parts:
+            table = pq.read_table(part, columns=['id'])
+            self.done_ids.update(table.column('id').to_pylist())
+        self._next_part = int(os.path.basename(parts[-1])[5:10]) + 1 if parts else 0
+        self._writer = None
+        self._part_path = None
+        self._rows_in_part = 0
+
+    def write(self, rows):
+        if self._writer is None:
+            self._part_path = os.path.join(self.path, f"part-{self._next_part:05d}.parquet")
+            self._writer = self._pq.ParquetWriter(self._part_path + '.tmp', self.schema)
+            self._next_part += 1
+        columns = {name: [row.get(name) for row in rows] for name in self.schema.names}
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self.schema))
+        self._rows_in_part += len(rows)
+        if self._rows_in_part >= self.part_rows:
+            self._finish_part()
+
+    def _finish_part(self):
+        self._writer.close()
+        os.replace(self._part_path + '.tmp', self._part_path)
+        self._writer = None
+        self._rows_in_part = 0
+
+    def close(self):
+        if self._writer is not None:
+            self._finish_part()
+
+
+def open_writer(path, output_format, columns, resume, overwrite, parquet_part_rows=PARQUET_PART_ROWS):
+    if output_format == 'parquet':
+        if overwrite and os.path.isdir(path):
+            for part in glob.glob(os.path.join(path, 'part-*.parquet*')):
+                os.remove(part)
+        return ParquetResultWriter(path, columns, resume, parquet_part_rows)
+    if os.path.exists(path) and not (resume or overwrite):
+        raise SystemExit(f"ERROR: '{path}' already exists. Use --resume to continue it or --overwrite.")
+    writer_class = CsvResultWriter if output_format == 'csv' else JsonlResultWriter
+    return writer_class(path, columns, resume)
+
+
+def to_row(item_id, analysis, version, class_names):
+    row = {
+        'id': item_id,
+        'predicted_soil_type': analysis['predicted_soil_type'],
+        'confidence': analysis['confidence'],
+        'predicted_pH': analysis['predicted_pH'] if analysis['predicted_pH'] != "N/A" else None,
+        'soil_quality': analysis['soil_quality'],
+        'recommendations': analysis['recommendations'],
+        'model_version': version,
+        'error': None,
+    }
+    for name in class_names:
+        row[f"score_{name}"] = round(analysis['confidence_scores'][name], 4)
+    return row
+
+
+def score(inputs, output, output_format, model, rules, version, batch_size=BATCH_SIZE, workers=None,
+          prefetch=PREFETCH_BATCHES, resume=False, overwrite=False, parquet_part_rows=PARQUET_PART_ROWS):
+    """
+    Scores every image in inputs and writes the results to output.
+
+    Returns:
+        dict: Counts of scored, failed and skipped (already scored) images,
+              the elapsed seconds and images_per_sec.
+    """
+    target_size = (IMG_WIDTH, IMG_HEIGHT)
+    writer = open_writer(output, output_format, result_columns(rules.classes), resume, overwrite, parquet_part_rows)
+    if writer.done_ids:
+        print(f"Resuming: {len(writer.done_ids)} images already scored in '{output}' will be skipped.")
+    items = iter_sources(inputs, skip=writer.done_ids)
+
+    scored = failed = 0
+    started_at = last_report_at = time.perf_counter()
+    last_report_count = 0
+    # Spawned workers only import Pillow and numpy, never the model runtime.
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    pending = deque()
+
+    def submit_next():
+        chunk = list(islice(items, batch_size))
+        if not chunk:
+            return False
+        readable = [(i, source) for i, (_, source, error) in enumerate(chunk) if error is None]
+        future = pool.submit(decode_chunk, [source for _, source in readable], target_size) if readable else None
+        pending.append((chunk, readable, future))
+        return True
+
+    try:
+        while len(pending) < prefetch and submit_next():
+            pass
+        while pending:
+            chunk, readable, future = pending.popleft()
+            # Keep the pool busy with the next batch while this one goes through the model.
+            submit_next()
+
+            rows = [None] * len(chunk)
+            for i, (item_id, _, error) in enumerate(chunk):
+                if error is not None:
+                    rows[i] = {'id': item_id, 'model_version': version, 'error': error}
+            if future is not None:
+                pixels, errors = future.result()
+                valid = [row for row, error in enumerate(errors) if error is None]
+                for row, error in enumerate(errors):
+                    if error is not None:
+                        rows[readable[row][0]] = {'id': chunk[readable[row][0]][0], 'model_version': version,
+                                                  'error': error}
+                if valid:
+                    batch = to_array(pixels[valid] if len(valid) < len(pixels) else pixels,
+                                     np.empty((len(valid), IMG_HEIGHT, IMG_WIDTH, 3), dtype='float32'))
+                    soil_type_predictions, pH_predictions = model.predict_on_batch(batch)
+                    analyses = interpret_predictions(soil_type_predictions, pH_predictions, rules)
+                    for row, analysis in zip(valid, analyses):
+                        i = readable[row][0]
+                        rows[i] = to_row(chunk[i][0], analysis, version, rules.classes)
+
+            writer.write(rows)
+            failed += sum(1 for row in rows if row['error'] is not None)
+            scored += len(rows)
+
+            now = time.perf_counter()
+            if now - last_report_at >= REPORT_SECONDS:
+                print(f"Scored {scored} images ({failed} failed): "
+                      f"{(scored - last_report_count) / (now - last_report_at):.1f} images/sec now, "
+                      f"{scored / (now - started_at):.1f} overall.")
+                last_report_at, last_report_count = now, scored
+    finally:
+        writer.close()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    elapsed = time.perf_counter() - started_at
+    return {
+        'scored': scored,
+        'failed': failed,
+        'skipped': len(writer.done_ids),
+        'seconds': round(elapsed, 2),
+        'images_per_sec': round(scored / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score folders or tar/zip archives of soil images offline.")
+    parser.add_argument('inputs', nargs='+', help="Image folders, zip/tar archives (optionally compressed) or images.")
+    parser.add_argument('--output', required=True, help="Result file (.csv, .jsonl) or folder (.parquet).")
+    parser.add_argument('--format', choices=FORMATS, default=None,
+                        help="Output format (default: from the --output extension).")
+    parser.add_argument('--resume', action='store_true', help="Continue an interrupted run, skipping scored images.")
+    parser.add_argument('--overwrite', action='store_true', help="Replace existing results.")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=None, help="Decode processes (default: one per CPU).")
+    parser.add_argument('--prefetch', type=int, default=PREFETCH_BATCHES,
+                        help=f"Batches decoded ahead of inference (default: {PREFETCH_BATCHES}).")
+    parser.add_argument('--parquet-part-rows', type=int, default=PARQUET_PART_ROWS,
+                        help=f"Rows per Parquet part file (default: {PARQUET_PART_ROWS}).")
+    parser.add_argument('--registry', default=REGISTRY_DIR, help=f"Model registry (default: {REGISTRY_DIR}).")
+    parser.add_argument('--version', default=None, help="Registry version to use (default: CURRENT).")
+    parser.add_argument('--model', default=None, help="Score with this model file instead of the registry.")
+    parser.add_argument('--classes', default=None, help=f"Class names file for --model (default: {CLASS_NAMES_PATH}).")
+    parser.add_argument('--backend', choices=('keras', 'tflite'), default='keras')
+    parser.add_argument('--rules', default=RULES_PATH, help=f"Soil rules table (default: {RULES_PATH}).")
+    args = parser.parse_args()
+
+    output_format = args.format or os.path.splitext(args.output)[1].lstrip('.').lower()
+    if output_format not in FORMATS:
+        raise SystemExit(f"ERROR: Cannot tell the output format of '{args.output}'. Pass --format {'/'.join(FORMATS)}.")
+    if args.resume and args.overwrite:
+        raise SystemExit("ERROR: --resume and --overwrite cannot be used together.")
+
+    model, rules, version = load_scoring_model(args.registry, args.version, args.backend, args.model, args.classes,
+                                               args.rules)
+    summary = score(args.inputs, args.output, output_format, model, rules, version, batch_size=args.batch_size,
+                    workers=args.workers, prefetch=args.prefetch, resume=args.resume, overwrite=args.overwrite,
+                    parquet_part_rows=args.parquet_part_rows)
+    print(f"Done: {summary['scored']} images scored ({summary['failed']} failed, {summary['skipped']} skipped as "
+          f"already scored) in {summary['seconds']} s, {summary['images_per_sec']} images/sec.")
+    print(f"Results written to '{args.output}'.")
@@ -0,0 +1,136 @@
+import io
+import json
+import sqlite3
+import threading
+import uuid
+
+CHART_COLORS = ['#4BC0C0', '#FF6384', '#36A2EB', '#FFCE56']
+
+
+class ChartRenderer:
+    """
+    Renders the prediction confidence bar chart from a figure that is built
+    once per class list. Each render only updates bar heights and value labels
+    and then encodes a single PNG, instead of building a new pyplot figure and
+    re-running tight_layout for every request.
+
+    Figures are not thread-safe, so renders are serialized with a lock.
+
+    Args:
+        labels (list): Soil class names, in the order the bars are drawn.
+    """
+
+    def __init__(self, labels):
+        # Imported here so the server does not pay for matplotlib until a chart is drawn.
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.labels = list(labels)
+        self._lock = threading.Lock()
+
+        self.figure = Figure(figsize=(6, 4))
+        FigureCanvasAgg(self.figure)
+        ax = self.figure.add_subplot()
+        self.bars = ax.bar(self.labels, [0] * len(self.labels), color=CHART_COLORS)
+        ax.set_title('Prediction Confidence')
+        ax.set_ylabel('Confidence (%)')
+        ax.set_ylim(0, 100)
+        self.value_labels = [
+            ax.text(bar.get_x() + bar.get_width() / 2.0, 0, '', ha='center', va='bottom')
+            for bar in self.bars
+        ]
+        for tick in ax.get_xticklabels():
+            tick.set_rotation(45)
+            tick.set_ha('right')
+        self.figure.tight_layout()
+
+    def render(self, confidence_scores_dict):
+        """
+        Returns the chart for the given {class name: confidence %} dict as PNG bytes.
+        """
+        scores = [confidence_scores_dict.get(label, 0) for label in self.labels]
+        with self._lock:
+            for bar, text, score in zip(self.bars, self.value_labels, scores):
+                bar.set_height(score)
+                text.set_y(score)
+                text.set_text(f'{score:.2f}%')
+            buffer = io.BytesIO()
+            self.figure.savefig(buffer, format='png')
+        return buffer.getvalue()
+
+
+_renderers = {}
+_renderers_lock = threading.Lock()
+
+
+def get_renderer(labels):
+    key = tuple(labels)
+    with _renderers_lock:
+        renderer = _renderers.get(key)
+        if renderer is None:
+            renderer = ChartRenderer(key)
+            _renderers[key] = renderer
+    return renderer
+
+
+def render_chart_png(confidence_scores_dict, labels):
+    return get_renderer(labels).render(confidence_scores_dict)
+
+
+class LazyChartStore:
+    """
+    Keeps the confidence scores of recent predictions so their chart can be
+    rendered on demand through /chart/<id> instead of on the prediction path.
+    Rendered PNGs are kept alongside the scores so repeat fetches are free.
+    The oldest entries are dropped once max_entries is reached.
+
+    Entries live in SQLite, so with several server workers (serve.py) a
+    chart can be fetched from any worker, not only the one that made the
+    prediction.
+
+    Args:
+        db_path (str): SQLite file shared by all workers.
+        max_entries (int): Entries kept before the oldest are dropped.
+    """
+
+    def __init__(self, db_path, max_entries=1000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS lazy_charts (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "id TEXT NOT NULL UNIQUE, scores TEXT NOT NULL, labels TEXT NOT NULL, png BLOB)"
+        )
+        self._db.commit()
+
+    def add(self, confidence_scores_dict, labels):
+        chart_id = uuid.uuid4().hex
+        with self._lock:
+            seq = self._db.execute(
+                "INSERT INTO lazy_charts (id, scores, labels) VALUES (?, ?, ?)",
+                (chart_id, json.dumps(confidence_scores_dict), json.dumps(list(labels)))
+            ).lastrowid
+            self._db.execute("DELETE FROM lazy_charts WHERE seq <= ?", (seq - self.max_entries,))
+            self._db.commit()
+        return chart_id
+
+    def get_png(self, chart_id):
+        """
+        Returns the PNG bytes for chart_id, rendering it on first access, or
+        None if the id is unknown or has been evicted.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT scores, labels, png FROM lazy_charts WHERE id = ?", (chart_id,)).fetchone()
+        if row is None:
+            return None
+        scores, labels, png_bytes = row
+        if png_bytes is not None:
+            return bytes(png_bytes)
+
+        png_bytes = render_chart_png(json.loads(scores), json.loads(labels))
+        with self._lock:
+            self._db.execute("UPDATE lazy_charts SET png = ? WHERE id = ?", (png_bytes, chart_id))
+            self._db.commit()
+        return png_bytes
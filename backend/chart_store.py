@@ -0,0 +1,219 @@
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+
+CHART_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ChartArtifactStore:
+    """
+    Bounded on-disk store of rendered chart PNGs, served back by ID.
+
+    Charts are named by the hash of their bytes, so identical charts are
+    stored once and two requests can never overwrite each other's file.
+    Writes happen on a background thread (temp file + rename), so disk
+    latency stays off the request path; until a chart has been written it is
+    served from memory.
+
+    After each write the oldest charts are evicted until the store is within
+    max_files and max_bytes. Charts older than max_age_seconds are removed
+    after writes and also every evict_seconds while the store is idle, and
+    are never served once expired. Charts written by other processes sharing
+    the directory are picked up by a periodic rescan.
+
+    Args:
+        directory (str): Folder holding the charts.
+        max_bytes (int): Maximum total size of stored charts.
+        max_files (int): Maximum number of stored charts.
+        max_age_seconds (float): Charts older than this are removed.
+        queue_size (int): Pending writes before put() writes synchronously.
+        rescan_seconds (float): How often the directory is rescanned.
+        evict_seconds (float): How often expired charts are removed when
+                               there are no writes.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, max_files=10000, max_age_seconds=7 * 24 * 3600,
+                 queue_size=256, rescan_seconds=300, evict_seconds=60):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_age_seconds = max_age_seconds
+        self.rescan_seconds = rescan_seconds
+        self.evict_seconds = evict_seconds
+
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # chart_id -> (size, mtime), oldest first
+        self._bytes = 0
+        self._pending = {}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._last_scan = 0.0
+
+        self.writes = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+        self._thread = threading.Thread(target=self._run, name='chart-store-writer', daemon=True)
+        self._thread.start()
+
+    def _path(self, chart_id):
+        return os.path.join(self.directory, f"{chart_id}.png")
+
+    def _scan(self):
+        entries = []
+        for filename in os.listdir(self.directory):
+            chart_id, extension = os.path.splitext(filename)
+            if extension != '.png' or not CHART_ID_PATTERN.match(chart_id):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, filename))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, chart_id, st.st_size))
+        entries.sort()
+        with self._lock:
+            self._index = OrderedDict((chart_id, (size, mtime)) for mtime, chart_id, size in entries)
+            self._bytes = sum(size for _, _, size in entries)
+        self._last_scan = time.time()
+
+    def put(self, png_bytes):
+        """
+        Queues png_bytes to be stored and returns its chart ID right away.
+        """
+        chart_id = hashlib.sha256(png_bytes).hexdigest()[:32]
+        with self._lock:
+            reused = chart_id in self._index
+            if reused:
+                # Reused charts count as new for age and size eviction.
+                self._index[chart_id] = (self._index[chart_id][0], time.time())
+                self._index.move_to_end(chart_id)
+            elif chart_id in self._pending:
+                return chart_id
+            else:
+                self._pending[chart_id] = png_bytes
+        if reused:
+            # Touch the file too, so a rescan (here or in another process) sees the reuse.
+            try:
+                os.utime(self._path(chart_id))
+                return chart_id
+            except OSError:
+                # Removed by another process sharing the directory: store it again.
+                with self._lock:
+                    self._pending[chart_id] = png_bytes
+        try:
+            self._queue.put_nowait(chart_id)
+        except queue.Full:
+            self._write(chart_id)
+        return chart_id
+
+    def get_png(self, chart_id):
+        """
+        Returns the PNG bytes for chart_id, or None if it is unknown or has
+        been evicted.
+        """
+        if not CHART_ID_PATTERN.match(chart_id):
+            return None
+        with self._lock:
+            png_bytes = self._pending.get(chart_id)
+            entry = self._index.get(chart_id)
+        if png_bytes is not None:
+            return png_bytes
+        if entry is not None and entry[1] < time.time() - self.max_age_seconds:
+            # Expired but not evicted yet.
+            return None
+        try:
+            with open(self._path(chart_id), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _run(self):
+        while True:
+            try:
+                chart_id = self._queue.get(timeout=self.evict_seconds)
+            except queue.Empty:
+                # No writes for a while: still enforce the age limit.
+                try:
+                    if time.time() - self._last_scan >= self.rescan_seconds:
+                        self._scan()
+                    self._evict()
+                except Exception as e:
+                    print(f"ERROR: Chart store eviction failed: {e}")
+                continue
+            try:
+                self._write(chart_id)
+            except Exception as e:
+                print(f"ERROR: Failed to store chart {chart_id}: {e}")
+                with self._lock:
+                    self._pending.pop(chart_id, None)
+
+    def _write(self, chart_id):
+        with self._lock:
+            png_bytes = self._pending.get(chart_id)
+        if png_bytes is None:
+            return
+        path = self._path(chart_id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(png_bytes)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._pending.pop(chart_id, None)
+            old = self._index.pop(chart_id, None)
+            if old is not None:
+                self._bytes -= old[0]
+            self._index[chart_id] = (len(png_bytes), time.time())
+            self._bytes += len(png_bytes)
+            self.writes += 1
+        if time.time() - self._last_scan >= self.rescan_seconds:
+            self._scan()
+        self._evict()
+
+    def _evict(self):
+        expired_before = time.time() - self.max_age_seconds
+        victims = []
+        with self._lock:
+            while self._index:
+                chart_id, (size, mtime) = next(iter(self._index.items()))
+                if (len(self._index) <= self.max_files and self._bytes <= self.max_bytes
+                        and mtime >= expired_before):
+                    break
+                self._index.popitem(last=False)
+                self._bytes -= size
+                victims.append(chart_id)
+            self.evictions += len(victims)
+        for chart_id in victims:
+            try:
+                os.remove(self._path(chart_id))
+            except OSError:
+                pass
+
+    def flush(self, timeout=5.0):
+        """
+        Waits until queued writes are on disk (used at shutdown and in tools).
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._lock:
+                if not self._pending:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "charts": len(self._index),
+                "bytes": self._bytes,
+                "pending_writes": len(self._pending),
+                "max_files": self.max_files,
+                "max_bytes": self.max_bytes,
+                "max_age_seconds": self.max_age_seconds,
+                "writes": self.writes,
+                "evictions": self.evictions,
+            }
@@ -1,54 +1,300 @@
-from PIL import Image
+"""
+Normalizes a dataset folder to canonical JPEG files of bounded resolution.
+
+WebP, GIF (first frame), BMP and TIFF files are converted to .jpg, and JPEG or
+PNG files larger than MAX_SIDE pixels on their longest side are downscaled and
+saved as .jpg. Smaller JPEG and PNG files are left as they are. EXIF
+orientation is applied before saving, so the stored pixels are upright.
+
+Files are processed by a process pool. Every output is written to a temporary
+file in the same folder and then renamed over its destination, so an
+interrupted run never leaves a half-written image behind; the original is
+only deleted after its replacement is in place.
+
+Files that are already canonical are recorded in a manifest next to the
+dataset (.normalized_<root>.json) with their size and mtime, and are not
+opened again on the next run.
+
+Usage (from the 'backend' folder):
+
+    python convert_webp.py                          # normalize ../Dataset/Train
+    python convert_webp.py ../Dataset/test --max-side 768
+    python convert_webp.py --keep-originals --full  # keep sources, ignore the manifest
+"""
+import argparse
+import json
 import os
-import glob 
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-def convert_webp_to_jpg_in_dataset(dataset_root_dir, delete_original=True):
+from PIL import Image, ImageOps
+
+from dataset_files import IMAGE_EXTENSIONS
+from image_preprocessing import EXIF_ORIENTATION
+
+DATASET_DIR = '../Dataset/Train'
+MANIFEST_VERSION = 1
+
+# Longest side, in pixels, of a normalized image. The model only sees 224x224,
+# so this leaves room for cropping and augmentation while keeping decodes cheap.
+MAX_SIDE = 1024
+JPEG_QUALITY = 92
+
+JPEG_EXTENSIONS = {'.jpg', '.jpeg'}
+# PNGs are decodable by training as-is, so they are only rewritten when oversized.
+KEEP_IF_SMALL_FORMATS = {'JPEG', 'PNG'}
+
+STATUS_KEPT = 'kept'
+STATUS_CONVERTED = 'converted'
+STATUS_RESIZED = 'resized'
+STATUS_ERROR = 'error'
+
+
+def _needs_normalizing(img, extension, max_side):
+    if img.format not in KEEP_IF_SMALL_FORMATS:
+        return True
+    if img.format == 'JPEG' and extension not in JPEG_EXTENSIONS:
+        return True
+    return max(img.size) > max_side
+
+
+def _write_atomic_jpeg(img, destination_path, quality):
+    tmp_path = os.path.join(
+        os.path.dirname(destination_path),
+        f".{os.path.basename(destination_path)}.{os.getpid()}.tmp"
+    )
+    try:
+        with open(tmp_path, 'wb') as f:
+            img.save(f, 'JPEG', quality=quality, optimize=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, destination_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def normalize_file(source_path, destination_path, max_side=MAX_SIDE, quality=JPEG_QUALITY, delete_original=True):
+    """
+    Rewrites source_path as a JPEG at destination_path if it is not already
+    canonical.
+
+    Args:
+        source_path (str): The image to normalize.
+        destination_path (str): Where the .jpg goes; may equal source_path.
+        max_side (int): Longest side, in pixels, of the output.
+        quality (int): JPEG quality of the output.
+        delete_original (bool): Remove source_path once the output is in place.
+
+    Returns:
+        dict: status, path (the file that now holds the image), original and
+              new (width, height), and the byte sizes before and after.
+    """
+    extension = os.path.splitext(source_path)[1].lower()
+    result = {'status': STATUS_KEPT, 'path': source_path, 'error': None,
+              'original_size': None, 'new_size': None, 'bytes_before': None, 'bytes_after': None}
+    try:
+        result['bytes_before'] = os.path.getsize(source_path)
+        with Image.open(source_path) as img:
+            result['original_size'] = img.size
+            if not _needs_normalizing(img, extension, max_side):
+                result['new_size'] = img.size
+                result['bytes_after'] = result['bytes_before']
+                return result
+
+            source_format = img.format
+            if img.format == 'JPEG':
+                # Let libjpeg skip most of the work for very large photos.
+                img.draft('RGB', (max_side, max_side))
+            if img.getexif().get(EXIF_ORIENTATION, 1) != 1:
+                img = ImageOps.exif_transpose(img)
+            if img.mode != 'RGB':
+                if img.mode in ('P', 'PA', 'LA'):
+                    img = img.convert('RGBA')
+                img = img.convert('RGB')
+            if max(img.size) > max_side:
+                img.thumbnail((max_side, max_side), resample=Image.LANCZOS, reducing_gap=3.0)
+
+            _write_atomic_jpeg(img, destination_path, quality)
+            result['new_size'] = img.size
+    except Exception as e:
+        result['status'] = STATUS_ERROR
+        result['error'] = str(e)
+        return result
+
+    if delete_original and os.path.abspath(source_path) != os.path.abspath(destination_path):
+        os.remove(source_path)
+    in_place = os.path.abspath(source_path) == os.path.abspath(destination_path)
+    result['status'] = STATUS_RESIZED if in_place and source_format == 'JPEG' else STATUS_CONVERTED
+    result['path'] = destination_path
+    result['bytes_after'] = os.path.getsize(destination_path)
+    return result
+
+
+def _normalize_entry(args):
+    return normalize_file(*args)
+
+
+def manifest_path_for(dataset_root):
+    dataset_root = os.path.abspath(dataset_root)
+    return os.path.join(os.path.dirname(dataset_root), f".normalized_{os.path.basename(dataset_root)}.json")
+
+
+def load_manifest(path, max_side, quality):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"WARNING: Ignoring unreadable manifest '{path}': {e}")
+        return {}
+    # A different size bound or quality means every file has to be looked at again.
+    if (manifest.get('version') != MANIFEST_VERSION or manifest.get('max_side') != max_side
+            or manifest.get('quality') != quality):
+        return {}
+    return manifest.get('files', {})
+
+
+def save_manifest(path, files, max_side, quality):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': MANIFEST_VERSION, 'max_side': max_side, 'quality': quality, 'files': files}, f)
+    os.replace(tmp_path, path)
+
+
+def plan_destination(path, taken):
+    """
+    Picks the .jpg path that path will be normalized to. JPEG files are
+    rewritten in place; other files get '<name>.jpg', or '<name>_<ext>.jpg'
+    if that name is already taken by another file.
     """
-    Scans through the dataset directory, converts all .webp files found
-    to .jpg format, and optionally deletes the original .webp files.
+    folder, filename = os.path.split(path)
+    stem, extension = os.path.splitext(filename)
+    if extension.lower() in JPEG_EXTENSIONS:
+        return path
+    candidates = [f"{stem}.jpg", f"{stem}_{extension.lstrip('.').lower()}.jpg"]
+    n = 1
+    while True:
+        for candidate in candidates:
+            if candidate.lower() not in taken:
+                taken.add(candidate.lower())
+                return os.path.join(folder, candidate)
+        candidates = [f"{stem}_{extension.lstrip('.').lower()}_{n}.jpg"]
+        n += 1
+
+
+def normalize_dataset(dataset_root=DATASET_DIR, max_side=MAX_SIDE, quality=JPEG_QUALITY, delete_original=True,
+                      workers=None, use_manifest=True):
     """
-    print(f"\n--- Starting WEBP to JPG conversion in: {dataset_root_dir} ---")
-    files_converted = 0
+    Normalizes every image under dataset_root.
 
-    absolute_dataset_path = os.path.abspath(dataset_root_dir)
+    Args:
+        dataset_root (str): The dataset folder (e.g. '../Dataset/Train').
+        max_side (int): Longest side, in pixels, of a normalized image.
+        quality (int): JPEG quality of rewritten files.
+        delete_original (bool): Delete sources that were converted to a new .jpg file.
+        workers (int): Number of processes (default: core count).
+        use_manifest (bool): Skip files recorded as canonical by a previous run.
 
-    if not os.path.exists(absolute_dataset_path):
+    Returns:
+        dict: Counts per status, plus the total seconds and bytes saved.
+    """
+    absolute_dataset_path = os.path.abspath(dataset_root)
+    if not os.path.isdir(absolute_dataset_path):
         print(f"Error: Dataset directory '{absolute_dataset_path}' not found. Please check your DATASET_DIR path.")
-        return
-
-    for root, _, files in os.walk(absolute_dataset_path):
-        for filename in files:
-            # Check if the file is a .webp file (case-insensitive)
-            if filename.lower().endswith('.webp'):
-                webp_path = os.path.join(root, filename)
-                # Create the new filename with .jpg extension
-                jpg_filename = os.path.splitext(filename)[0] + '.jpg'
-                jpg_path = os.path.join(root, jpg_filename)
-
-                print(f"  Converting {webp_path} to {jpg_path}...")
-                try:
-                    with Image.open(webp_path) as img:
-                       
-                        img.convert('RGB').save(jpg_path, "jpeg") 
-                    files_converted += 1
-                    if delete_original:
-                        os.remove(webp_path) # Delete the original .webp file
-                        print(f"  Deleted original .webp file: {webp_path}")
-                except Exception as e:
-                    print(f"    ERROR converting {webp_path}: {e}")
-
-    print(f"\n--- Conversion complete. {files_converted} .webp files converted to .jpg ---")
-    if files_converted == 0:
-        print("No .webp files were found for conversion.")
+        return None
+
+    started_at = time.perf_counter()
+    manifest_path = manifest_path_for(absolute_dataset_path)
+    previous = load_manifest(manifest_path, max_side, quality) if use_manifest else {}
+    print(f"\n--- Normalizing images in {absolute_dataset_path} (JPEG, longest side <= {max_side}px) ---")
+
+    canonical = {}
+    reused = 0
+    jobs = []
+    for root, dirs, filenames in os.walk(absolute_dataset_path):
+        dirs.sort()
+        taken = {filename.lower() for filename in filenames}
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            path = os.path.join(root, filename)
+            relpath = os.path.relpath(path, absolute_dataset_path)
+            st = os.stat(path)
+            old = previous.get(relpath)
+            if old is not None and old['size'] == st.st_size and old['mtime_ns'] == st.st_mtime_ns:
+                canonical[relpath] = old
+                reused += 1
+                continue
+            jobs.append((path, plan_destination(path, taken), max_side, quality, delete_original))
+
+    counts = {STATUS_KEPT: 0, STATUS_CONVERTED: 0, STATUS_RESIZED: 0, STATUS_ERROR: 0}
+    bytes_saved = 0
+    if jobs:
+        print(f"  {reused} files unchanged since last run, checking {len(jobs)} files...")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for (path, _, _, _, _), result in zip(jobs, executor.map(_normalize_entry, jobs, chunksize=4)):
+                counts[result['status']] += 1
+                if result['status'] == STATUS_ERROR:
+                    print(f"    ERROR normalizing {path}: {result['error']}")
+                    continue
+                if result['status'] != STATUS_KEPT:
+                    bytes_saved += result['bytes_before'] - result['bytes_after']
+                    print(f"  {result['status'].capitalize()} {os.path.relpath(path, absolute_dataset_path)} "
+                          f"{result['original_size'][0]}x{result['original_size'][1]} -> "
+                          f"{os.path.relpath(result['path'], absolute_dataset_path)} "
+                          f"{result['new_size'][0]}x{result['new_size'][1]}")
+                # Kept originals are recorded too, so they are not converted again next run.
+                for handled_path in {path, result['path']}:
+                    if os.path.exists(handled_path):
+                        st = os.stat(handled_path)
+                        canonical[os.path.relpath(handled_path, absolute_dataset_path)] = {
+                            'size': st.st_size, 'mtime_ns': st.st_mtime_ns
+                        }
     else:
-        print("Original .webp files have been deleted. You now have .jpg versions.")
+        print(f"  All {reused} files unchanged since last run.")
+
+    if use_manifest:
+        save_manifest(manifest_path, canonical, max_side, quality)
+
+    summary = dict(counts, reused=reused, bytes_saved=bytes_saved,
+                   seconds=round(time.perf_counter() - started_at, 2))
+    print(f"\n--- Normalization complete in {summary['seconds']}s: {counts[STATUS_CONVERTED]} converted, "
+          f"{counts[STATUS_RESIZED]} downscaled, {counts[STATUS_KEPT] + summary['reused']} already canonical, "
+          f"{counts[STATUS_ERROR]} errors, {bytes_saved / 1e6:.1f} MB saved ---")
+    if counts[STATUS_ERROR]:
+        print("Files that failed were left untouched. Run validate_dataset.py to inspect or quarantine them.")
+    return summary
+
+
+def convert_webp_to_jpg_in_dataset(dataset_root_dir, delete_original=True):
+    """
+    Kept for existing callers; converts .webp (and the other non-canonical
+    formats) through normalize_dataset().
+    """
+    return normalize_dataset(dataset_root_dir, delete_original=delete_original)
 
 
 if __name__ == "__main__":
-   
-    DATASET_PATH_FOR_SCRIPT = '../Dataset/Train' 
+    parser = argparse.ArgumentParser(description="Convert dataset images to canonical, bounded-size JPEG files.")
+    parser.add_argument('dataset', nargs='?', default=DATASET_DIR, help=f"Dataset root (default: {DATASET_DIR}).")
+    parser.add_argument('--max-side', type=int, default=MAX_SIDE,
+                        help=f"Longest side in pixels after normalizing (default: {MAX_SIDE}).")
+    parser.add_argument('--quality', type=int, default=JPEG_QUALITY,
+                        help=f"JPEG quality of rewritten files (default: {JPEG_QUALITY}).")
+    parser.add_argument('--keep-originals', action='store_true', help="Do not delete converted source files.")
+    parser.add_argument('--full', action='store_true', help="Ignore the manifest and re-check every file.")
+    parser.add_argument('--workers', type=int, default=None, help="Number of processes (default: core count).")
+    args = parser.parse_args()
 
-    convert_webp_to_jpg_in_dataset(DATASET_PATH_FOR_SCRIPT, delete_original=True)
+    normalize_dataset(
+        args.dataset,
+        max_side=args.max_side,
+        quality=args.quality,
+        delete_original=not args.keep_originals,
+        workers=args.workers,
+        use_manifest=not args.full
+    )
 
-    print("\nPart 1 (WEBP Conversion) is complete.")
-    print("Now proceed to Part 2 to address other problematic files, then rerun the debugger.")
\ No newline at end of file
+    print("\nNext, run validate_dataset.py to check the normalized dataset.")
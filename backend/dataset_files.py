@@ -0,0 +1,99 @@
+import hashlib
+import os
+import random
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'}
+
+
+def is_image_file(filename):
+    return os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+
+
+def iter_image_files(root_dir):
+    """
+    Yields the path of every image file under root_dir, in a stable order.
+    """
+    for root, dirs, files in os.walk(root_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if is_image_file(filename):
+                yield os.path.join(root, filename)
+
+
+def load_class_names(class_names_path):
+    with open(class_names_path, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def list_labeled_images(dataset_dir, class_names=None):
+    """
+    Lists images in a class-folder dataset layout (dataset_dir/<class>/<image>).
+
+    Args:
+        dataset_dir (str): Dataset root, e.g. '../Dataset/test'.
+        class_names (list): Class order used for the integer labels. Defaults
+                            to the sorted sub-folder names, which is what
+                            image_dataset_from_directory uses.
+
+    Returns:
+        tuple: (paths, labels, class_names). Folders that are not in
+               class_names are skipped.
+    """
+    if class_names is None:
+        class_names = sorted(
+            name for name in os.listdir(dataset_dir)
+            if os.path.isdir(os.path.join(dataset_dir, name))
+        )
+    paths = []
+    labels = []
+    for label, class_name in enumerate(class_names):
+        class_dir = os.path.join(dataset_dir, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        for path in iter_image_files(class_dir):
+            paths.append(path)
+            labels.append(label)
+    return paths, labels, list(class_names)
+
+
+def sample_images(dataset_dir, count, seed=123):
+    """
+    Returns a reproducible random sample of up to count image paths.
+    """
+    paths = list(iter_image_files(dataset_dir))
+    random.Random(seed).shuffle(paths)
+    return paths[:count]
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_files(paths, known):
+    """
+    Returns the SHA-256 of every file, reusing known hashes of files whose
+    size and modification time have not changed.
+
+    Args:
+        paths (list): File paths.
+        known (dict): path -> (size, mtime_ns, hash) from an earlier run.
+
+    Returns:
+        tuple: (hashes, updates) where updates lists (path, size, mtime_ns,
+               hash) for the files that had to be read.
+    """
+    hashes = []
+    updates = []
+    for path in paths:
+        st = os.stat(path)
+        entry = known.get(path)
+        if entry is not None and tuple(entry[:2]) == (st.st_size, st.st_mtime_ns):
+            hashes.append(entry[2])
+            continue
+        hashes.append(sha256_file(path))
+        updates.append((path, st.st_size, st.st_mtime_ns, hashes[-1]))
+    return hashes, updates
@@ -0,0 +1,393 @@
+"""
+Finds exact and near-duplicate images across dataset folders (by default
+Dataset/Train and Dataset/test), so copies do not inflate training time or
+leak between the training and test sets.
+
+Each image gets a SHA-256 of its bytes (exact duplicates) and a 64-bit
+difference hash (dHash) of its content (near duplicates: resized, recompressed
+or lightly edited copies). Hashes are computed on a process pool and stored in
+a SQLite index next to the dataset (.dedup_index.sqlite3), so re-runs only
+hash new or changed files.
+
+Near duplicates are found with multi-index hashing instead of comparing every
+pair: each hash is split into max_distance + 1 chunks, and by the pigeonhole
+principle two hashes within max_distance bits must agree exactly on at least
+one chunk. Only hashes sharing a chunk are compared, which keeps the search
+close to linear in the number of images.
+
+Usage (from the 'backend' folder):
+
+    python dedup_dataset.py                                   # report only
+    python dedup_dataset.py --max-distance 6 --report dups.json
+    python dedup_dataset.py --quarantine                      # keep one image per cluster
+
+With --quarantine, one image per cluster is kept (preferring the first
+dataset folder, then names without 'copy') and its duplicates are moved to
+<dataset parent>/quarantine_duplicates/<folder name>/, mirroring
+clean_dataset.py. Clusters are connected components, so A~B~C can group C with
+an A it does not resemble; only members identical to or within max_distance
+of the kept image are moved, the rest are reported as 'chained'. Clusters
+whose members sit in different class folders are reported as label
+conflicts and nothing in them is moved, since keeping one copy would silently
+pick a label.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dataset_files import iter_image_files
+from image_preprocessing import open_image
+from validate_dataset import quarantine_file
+
+DATASET_DIRS = ['../Dataset/Train', '../Dataset/test']
+INDEX_FILENAME = '.dedup_index.sqlite3'
+QUARANTINE_DIR_NAME = 'quarantine_duplicates'
+MAX_DISTANCE = 4
+HASH_SIZE = 8  # dHash grid; 8 gives a 64-bit hash
+COMPARE_BLOCK_ELEMENTS = 4_000_000
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def dhash(img):
+    """
+    Returns the 64-bit difference hash of a PIL image: the image is shrunk to
+    9x8 grayscale and each bit records whether a pixel is brighter than its
+    right-hand neighbour.
+    """
+    if img.format == 'JPEG':
+        img.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+    pixels = np.asarray(img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), resample=3), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hash_file(path):
+    try:
+        with open(path, 'rb') as f:
+            img_bytes = f.read()
+        sha256 = hashlib.sha256(img_bytes).hexdigest()
+        with open_image(img_bytes) as img:
+            return sha256, dhash(img), None
+    except Exception as e:
+        return None, None, str(e)
+
+
+def hamming_distance(a, b):
+    """
+    Bit differences between uint64 arrays a and b (broadcasting).
+    """
+    x = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64))
+    return _POPCOUNT_TABLE[x[..., None].view(np.uint8)].sum(axis=-1)
+
+
+class DedupIndex:
+    """
+    Persistent per-file hash index stored in SQLite.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "sha256 TEXT, dhash INTEGER, error TEXT)"
+        )
+        self._db.commit()
+
+    def load(self):
+        rows = self._db.execute("SELECT path, size, mtime_ns, sha256, dhash, error FROM images")
+        return {row[0]: row[1:] for row in rows}
+
+    def update(self, entries, removed):
+        # SQLite integers are signed 64-bit, so hashes are stored two's-complement.
+        self._db.executemany(
+            "INSERT OR REPLACE INTO images (path, size, mtime_ns, sha256, dhash, error) VALUES (?, ?, ?, ?, ?, ?)",
+            [(path, size, mtime_ns, sha256, None if h is None else int(np.uint64(h).astype(np.int64)), error)
+             for path, (size, mtime_ns, sha256, h, error) in entries.items()]
+        )
+        self._db.executemany("DELETE FROM images WHERE path = ?", [(path,) for path in removed])
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+
+def update_index(index, dataset_dirs, workers=None):
+    """
+    Hashes new or changed files under dataset_dirs and returns
+    {absolute path: (sha256, dhash)} for every hashable image.
+    """
+    stored = index.load()
+    current = {}
+    for dataset_dir in dataset_dirs:
+        for path in iter_image_files(dataset_dir):
+            st = os.stat(path)
+            current[os.path.abspath(path)] = (st.st_size, st.st_mtime_ns)
+
+    to_hash = [
+        path for path, (size, mtime_ns) in current.items()
+        if path not in stored or stored[path][0] != size or stored[path][1] != mtime_ns
+    ]
+    removed = [path for path in stored if path not in current]
+    print(f"  {len(current)} images, {len(current) - len(to_hash)} already indexed, "
+          f"hashing {len(to_hash)}, {len(removed)} removed.")
+
+    updates = {}
+    if to_hash:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for path, (sha256, h, error) in zip(to_hash, executor.map(hash_file, to_hash, chunksize=32)):
+                size, mtime_ns = current[path]
+                updates[path] = (size, mtime_ns, sha256, h, error)
+                if error is not None:
+                    print(f"  Could not hash {path}: {error}")
+    index.update(updates, removed)
+
+    hashes = {}
+    for path, (size, mtime_ns, sha256, h, error) in index.load().items():
+        if path in current and sha256 is not None and h is not None:
+            hashes[path] = (sha256, int(np.int64(h).astype(np.uint64)))
+    return hashes
+
+
+class _UnionFind:
+    def __init__(self, n):
+        self.parent = np.arange(n)
+
+    def find(self, i):
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, i, j):
+        ri, rj = self.find(i), self.find(j)
+        if ri != rj:
+            self.parent[max(ri, rj)] = min(ri, rj)
+
+
+def _chunk_keys(hashes, chunks):
+    """
+    Splits each 64-bit hash into `chunks` nearly equal bit ranges and returns
+    one integer key array per chunk.
+    """
+    bounds = np.linspace(0, 64, chunks + 1).astype(int)
+    keys = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        mask = np.uint64((1 << (end - start)) - 1)
+        keys.append((hashes >> np.uint64(start)) & mask)
+    return keys
+
+
+def find_clusters(paths, sha256s, hashes, max_distance=MAX_DISTANCE):
+    """
+    Groups images whose bytes are identical or whose dHashes differ by at most
+    max_distance bits.
+
+    Returns:
+        list: Clusters as lists of indices into paths, largest first. Each
+              cluster only contains connected near/exact duplicates.
+    """
+    n = len(paths)
+    uf = _UnionFind(n)
+
+    # Exact duplicates (same bytes or same dHash) are merged first and only
+    # their representatives take part in the near-duplicate search.
+    for keys in (sha256s, hashes):
+        first_seen = {}
+        for i, key in enumerate(keys):
+            if key in first_seen:
+                uf.union(first_seen[key], i)
+            else:
+                first_seen[key] = i
+
+    unique_hashes, representatives = np.unique(hashes, return_index=True)
+    if max_distance > 0 and len(unique_hashes) > 1:
+        for keys in _chunk_keys(unique_hashes, max_distance + 1):
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            boundaries = np.flatnonzero(np.diff(sorted_keys)) + 1
+            for group in np.split(order, boundaries):
+                if len(group) < 2:
+                    continue
+                group_hashes = unique_hashes[group]
+                # Compare in row blocks so a large bucket never needs a full g x g matrix.
+                block = max(1, COMPARE_BLOCK_ELEMENTS // len(group))
+                for start in range(0, len(group), block):
+                    distances = hamming_distance(group_hashes[start:start + block, None], group_hashes[None, start:])
+                    rows, cols = np.nonzero(distances <= max_distance)
+                    for a, b in zip(rows + start, cols + start):
+                        if a < b:
+                            uf.union(representatives[group[a]], representatives[group[b]])
+
+    clusters = {}
+    for i in range(n):
+        clusters.setdefault(uf.find(i), []).append(i)
+    return sorted((members for members in clusters.values() if len(members) > 1), key=len, reverse=True)
+
+
+def split_cluster(members, keep, sha256s, hashes, max_distance=MAX_DISTANCE):
+    """
+    Splits the other members of a cluster into duplicates of the kept image
+    (same bytes, or dHash within max_distance bits of it) and members that are
+    only connected to it through a chain of other near duplicates.
+
+    Returns:
+        tuple: (duplicates, chained) as lists of indices, in members order.
+    """
+    duplicates, chained = [], []
+    for i in members:
+        if i == keep:
+            continue
+        close = sha256s[i] == sha256s[keep] or int(hamming_distance(hashes[i], hashes[keep])) <= max_distance
+        (duplicates if close else chained).append(i)
+    return duplicates, chained
+
+
+def _keep_priority(path, dataset_dirs):
+    for rank, dataset_dir in enumerate(dataset_dirs):
+        if path.startswith(os.path.abspath(dataset_dir) + os.sep):
+            break
+    else:
+        rank = len(dataset_dirs)
+    name = os.path.basename(path).lower()
+    return rank, 'copy' in name, len(name), path
+
+
+def _dataset_root_for(path, dataset_dirs):
+    for dataset_dir in dataset_dirs:
+        root = os.path.abspath(dataset_dir)
+        if path.startswith(root + os.sep):
+            return root
+    return os.path.dirname(path)
+
+
+def _class_of(path, dataset_dirs):
+    """
+    Returns the class folder of path: its first directory below the dataset root.
+    """
+    parts = os.path.relpath(path, _dataset_root_for(path, dataset_dirs)).split(os.sep)
+    return parts[0] if len(parts) > 1 else ''
+
+
+def dedup_dataset(dataset_dirs=DATASET_DIRS, max_distance=MAX_DISTANCE, quarantine=False, workers=None,
+                  report_path=None, quarantine_dir_name=QUARANTINE_DIR_NAME, index_path=None):
+    """
+    Indexes dataset_dirs, finds duplicate clusters and reports or quarantines them.
+
+    Args:
+        dataset_dirs (list): Dataset folders to scan together; earlier folders
+                             win when choosing which copy to keep.
+        max_distance (int): Maximum dHash bit difference for near duplicates.
+        quarantine (bool): Move the duplicates of the kept image in each
+                           cluster to quarantine.
+        workers (int): Hashing processes (default: core count).
+        report_path (str): Optional path for a JSON report.
+        quarantine_dir_name (str): Quarantine folder name next to each dataset.
+        index_path (str): SQLite index location (default: next to the first folder).
+    """
+    started_at = time.perf_counter()
+    dataset_dirs = [d for d in dataset_dirs if os.path.isdir(d)]
+    if not dataset_dirs:
+        print("Error: none of the dataset directories exist.")
+        return None
+    if index_path is None:
+        index_path = os.path.join(os.path.dirname(os.path.abspath(dataset_dirs[0])), INDEX_FILENAME)
+
+    print(f"--- Looking for duplicates in {', '.join(dataset_dirs)} ---")
+    index = DedupIndex(index_path)
+    try:
+        hashed = update_index(index, dataset_dirs, workers)
+    finally:
+        index.close()
+
+    paths = sorted(hashed)
+    sha256s = [hashed[path][0] for path in paths]
+    hashes = np.array([hashed[path][1] for path in paths], dtype=np.uint64)
+    clusters = find_clusters(paths, sha256s, hashes, max_distance)
+
+    report_clusters = []
+    to_quarantine = []
+    for members in clusters:
+        members = sorted(members, key=lambda i: _keep_priority(paths[i], dataset_dirs))
+        duplicates, chained = split_cluster(members, members[0], sha256s, hashes, max_distance)
+        exact = len({sha256s[i] for i in members}) == 1
+        roots = {_dataset_root_for(paths[i], dataset_dirs) for i in members}
+        classes = sorted({_class_of(paths[i], dataset_dirs) for i in members})
+        report_clusters.append({
+            'kind': 'exact' if exact else 'near',
+            'cross_split': len(roots) > 1,
+            'label_conflict': len(classes) > 1,
+            'classes': classes,
+            'keep': paths[members[0]],
+            'duplicates': [paths[i] for i in duplicates],
+            'chained': [paths[i] for i in chained],
+        })
+        if len(classes) == 1:
+            to_quarantine.extend(paths[i] for i in duplicates)
+
+    cross_split = sum(1 for cluster in report_clusters if cluster['cross_split'])
+    conflicts = sum(1 for cluster in report_clusters if cluster['label_conflict'])
+    print(f"  {len(clusters)} duplicate clusters ({sum(c['kind'] == 'exact' for c in report_clusters)} exact), "
+          f"{len(to_quarantine)} redundant images, {cross_split} clusters span more than one folder, "
+          f"{conflicts} label conflicts.")
+    for cluster in report_clusters[:20]:
+        flags = ''.join([', cross-split' if cluster['cross_split'] else '',
+                         f", label conflict: {' / '.join(cluster['classes'])}" if cluster['label_conflict'] else ''])
+        print(f"  [{cluster['kind']}{flags}] keep {cluster['keep']}")
+        for duplicate in cluster['duplicates']:
+            print(f"      duplicate {duplicate}")
+        for member in cluster['chained']:
+            print(f"      chained   {member}")
+    if len(report_clusters) > 20:
+        print(f"  ... {len(report_clusters) - 20} more clusters (see --report for the full list)")
+
+    moved = 0
+    if quarantine:
+        for path in to_quarantine:
+            if quarantine_file(path, _dataset_root_for(path, dataset_dirs), quarantine_dir_name) is not None:
+                moved += 1
+        print(f"  Moved {moved} duplicates to the '{quarantine_dir_name}' folder.")
+        if conflicts:
+            print(f"  Left {conflicts} label-conflict clusters in place; resolve their labels by hand.")
+
+    report = {
+        'dataset_dirs': [os.path.abspath(d) for d in dataset_dirs],
+        'max_distance': max_distance,
+        'images': len(paths),
+        'clusters': report_clusters,
+        'redundant_images': len(to_quarantine),
+        'label_conflicts': conflicts,
+        'quarantined': moved,
+        'seconds': round(time.perf_counter() - started_at, 2),
+    }
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"  Report written to {report_path}")
+    print(f"\n--- Duplicate search complete in {report['seconds']}s ---")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find exact and near-duplicate images across dataset folders.")
+    parser.add_argument('datasets', nargs='*', default=DATASET_DIRS,
+                        help="Dataset folders to scan together (default: ../Dataset/Train ../Dataset/test).")
+    parser.add_argument('--max-distance', type=int, default=MAX_DISTANCE,
+                        help=f"Maximum dHash bit difference for near duplicates, 0 for exact only (default: {MAX_DISTANCE}).")
+    parser.add_argument('--quarantine', action='store_true', help="Move the duplicates of the kept image in each cluster to quarantine.")
+    parser.add_argument('--workers', type=int, default=None, help="Hashing processes (default: core count).")
+    parser.add_argument('--report', default=None, help="Write the clusters as JSON to this path.")
+    args = parser.parse_args()
+
+    dedup_dataset(args.datasets, max_distance=args.max_distance, quarantine=args.quarantine,
+                  workers=args.workers, report_path=args.report)
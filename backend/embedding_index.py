@@ -0,0 +1,499 @@
+"""
+Embeddings of soil samples and a nearest-neighbour index over them.
+
+The embedding is the output of the model's shared Dense(128) layer, the
+features both the soil type and the pH heads are computed from. Vectors are
+L2-normalized, so the dot product of two of them is their cosine similarity.
+
+Embeddings from different model versions are not comparable, so each
+version gets its own folder:
+
+    embeddings/<model version>/
+        vectors.f16         row-major float16 (or .f32) matrix, one row per sample
+        samples.sqlite3     per row: key (image SHA-256), source ('analysis',
+                            'train', ...), label, pH, info (JSON, e.g. lab
+                            results) and creation time
+        ivf.npz             optional coarse index (see build_ivf())
+
+The server appends the embedding of every analyzed image; the training set
+(and any lab results) are added with `python embedding_index.py --add-dataset`.
+
+Search is exact by default: the matrix is memory-mapped and scanned in
+blocks with one matrix-vector product each, which takes tens of
+milliseconds per million float16 vectors. For larger stores, build_ivf()
+clusters the vectors (k-means) and search then only scores the nprobe
+clusters closest to the query, plus the rows added since the index was built.
+
+Usage (from the 'backend' folder):
+
+    python embedding_index.py --add-dataset ../Dataset/Train
+    python embedding_index.py --add-dataset ../Dataset/Train --lab-results lab_results.csv
+    python embedding_index.py --build-ivf
+    python embedding_index.py --stats
+"""
+import argparse
+import csv
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: only one server process appends at a time.
+    fcntl = None
+
+EMBEDDINGS_DIR = 'embeddings'
+EMBEDDING_LAYER = 'embedding'
+VECTOR_DTYPES = {'float16': '.f16', 'float32': '.f32'}
+SEARCH_BLOCK_ROWS = 65536
+WRITE_QUEUE_SIZE = 4096
+NPROBE = 32
+# The default cluster count grows as 4 * sqrt(samples) up to this cap, so
+# k-means stays tractable at millions of vectors.
+MAX_NLIST = 2048
+# Vector-to-centroid similarities are computed in row blocks of at most this
+# many bytes, whatever the number of vectors and clusters.
+ASSIGN_BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def embedding_model(model):
+    """
+    Returns a Keras model with the same input and outputs as model plus the
+    embedding as a third output. The embedding layer is the one named
+    'embedding' (train_model.py) or, for older models, the input of the
+    soil type head.
+    """
+    from tensorflow import keras
+    try:
+        embedding = model.get_layer(EMBEDDING_LAYER).output
+    except ValueError:
+        embedding = model.get_layer('soil_type_output').input
+    return keras.Model(model.inputs, list(model.outputs) + [embedding])
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def version_directory(version, embeddings_dir=EMBEDDINGS_DIR):
+    return os.path.join(embeddings_dir, version.replace(os.sep, '_'))
+
+
+class EmbeddingStore:
+    """
+    Append-only on-disk matrix of normalized embeddings with SQLite metadata.
+    Several processes may append to the same store; appends are serialized
+    with a file lock. Row i of the matrix belongs to the sample with row i in
+    SQLite, and the matrix is only trusted up to the number of SQLite rows,
+    so a crash between the two writes leaves no half-registered sample.
+
+    Args:
+        directory (str): The store's folder.
+        dim (int): Embedding size.
+        dtype (str): 'float16' (half the disk and memory) or 'float32'.
+    """
+
+    def __init__(self, directory, dim, dtype='float16'):
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype '{dtype}'. Use one of: {', '.join(VECTOR_DTYPES)}.")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.vectors_path = os.path.join(directory, 'vectors' + VECTOR_DTYPES[dtype])
+        self.ivf_path = os.path.join(directory, 'ivf.npz')
+        self._lock_path = os.path.join(directory, '.lock')
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, 'samples.sqlite3'), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS samples (row INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, source TEXT, "
+            "label TEXT, pH REAL, info TEXT, created REAL NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        for name, value in (('dim', str(dim)), ('dtype', dtype)):
+            self._db.execute("INSERT OR IGNORE INTO settings (name, value) VALUES (?, ?)", (name, value))
+            stored = self._db.execute("SELECT value FROM settings WHERE name = ?", (name,)).fetchone()[0]
+            if stored != value:
+                raise ValueError(f"Embedding store '{directory}' has {name} {stored}, not {value}.")
+        self._db.commit()
+
+        self._vectors = None
+        self._queue = None
+        self.writes = 0
+        self.dropped = 0
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+
+    def add(self, items):
+        """
+        Appends samples whose key is not in the store yet.
+
+        Args:
+            items (list): (key, vector, source, label, pH, info) tuples; info
+                          is a JSON-serializable dict or None.
+
+        Returns:
+            int: The number of samples added.
+        """
+        if not items:
+            return 0
+        with self._lock, open(self._lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            keys = list(dict.fromkeys(item[0] for item in items))
+            existing = set()
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                existing.update(key for (key,) in self._db.execute(
+                    f"SELECT key FROM samples WHERE key IN ({','.join('?' * len(part))})", part
+                ))
+            new_items = []
+            for item in items:
+                if item[0] not in existing:
+                    existing.add(item[0])
+                    new_items.append(item)
+            if not new_items:
+                return 0
+
+            row = self._db.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+            vectors = normalize([item[1] for item in new_items]).astype(self.dtype)
+            with open(self.vectors_path, 'ab+') as f:
+                # Drop vectors left behind by an append that never reached SQLite.
+                f.truncate(row * self.dim * self.dtype.itemsize)
+                f.write(vectors.tobytes())
+            now = time.time()
+            self._db.executemany(
+                "INSERT INTO samples (row, key, source, label, pH, info, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (row + i, key, source, label, pH, json.dumps(info) if info is not None else None, now)
+                    for i, (key, _, source, label, pH, info) in enumerate(new_items)
+                ]
+            )
+            self._db.commit()
+            self.writes += len(new_items)
+            return len(new_items)
+
+    def put(self, key, vector, source, label=None, pH=None, info=None):
+        """
+        Queues one sample to be appended by a background thread, so requests
+        never wait for the disk. Samples are dropped if the queue is full.
+        """
+        if self._queue is None:
+            with self._lock:
+                if self._queue is None:
+                    self._queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+                    threading.Thread(target=self._run, name='embedding-writer', daemon=True).start()
+        try:
+            self._queue.put_nowait((key, np.asarray(vector, dtype=np.float32), source, label, pH, info))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            while len(items) < 256:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.add(items)
+            except Exception as e:
+                print(f"ERROR: Failed to store {len(items)} embeddings: {e}")
+
+    def vectors(self):
+        """
+        Returns the stored vectors as a read-only memory map.
+        """
+        n = self.count()
+        if n == 0:
+            return np.empty((0, self.dim), dtype=self.dtype)
+        if self._vectors is None or len(self._vectors) != n:
+            self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode='r', shape=(n, self.dim))
+        return self._vectors
+
+    def get(self, key):
+        """
+        Returns the stored (normalized) vector of key, or None.
+        """
+        with self._lock:
+            found = self._db.execute("SELECT row FROM samples WHERE key = ?", (key,)).fetchone()
+        if found is None:
+            return None
+        return np.asarray(self.vectors()[found[0]], dtype=np.float32)
+
+    def samples(self, rows):
+        """
+        Returns {row: sample dict} for the given rows.
+        """
+        rows = [int(row) for row in rows]
+        if not rows:
+            return {}
+        with self._lock:
+            found = self._db.execute(
+                f"SELECT row, key, source, label, pH, info, created FROM samples "
+                f"WHERE row IN ({','.join('?' * len(rows))})", rows
+            ).fetchall()
+        return {
+            row: {"key": key, "source": source, "label": label, "pH": pH,
+                  "info": json.loads(info) if info else None, "created": created}
+            for row, key, source, label, pH, info, created in found
+        }
+
+    def stats(self):
+        with self._lock:
+            by_source = dict(self._db.execute("SELECT source, COUNT(*) FROM samples GROUP BY source").fetchall())
+        return {
+            "directory": self.directory,
+            "samples": sum(by_source.values()),
+            "by_source": by_source,
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "ivf": os.path.exists(self.ivf_path),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "dropped": self.dropped,
+        }
+
+
+def _top_k(similarities, rows, k):
+    if len(similarities) > k:
+        best = np.argpartition(-similarities, k - 1)[:k]
+        similarities, rows = similarities[best], rows[best]
+    order = np.argsort(-similarities, kind='stable')
+    return similarities[order], rows[order]
+
+
+class EmbeddingIndex:
+    """
+    k-nearest-neighbour search over an EmbeddingStore. Uses the store's IVF
+    index when one has been built (reloaded when the file changes) and an
+    exact blocked scan otherwise.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._ivf = None
+        self._ivf_mtime = None
+
+    def _load_ivf(self):
+        try:
+            mtime = os.stat(self.store.ivf_path).st_mtime_ns
+        except OSError:
+            self._ivf = self._ivf_mtime = None
+            return None
+        if mtime != self._ivf_mtime:
+            with np.load(self.store.ivf_path) as data:
+                self._ivf = {name: data[name] for name in ('centroids', 'order', 'offsets', 'built_rows')}
+            self._ivf_mtime = mtime
+        return self._ivf
+
+    def search(self, query, k=5, nprobe=NPROBE, sources=None, exclude_key=None):
+        """
+        Returns the k stored samples most similar to query, most similar
+        first, as sample dicts with a 'similarity' (cosine) entry.
+
+        Args:
+            query (np.ndarray): An embedding (normalized here).
+            k (int): Number of neighbours.
+            nprobe (int): IVF clusters to scan; ignored without an IVF index.
+            sources (list): Only return samples from these sources. Applied
+                            to an oversampled candidate list, so fewer than k
+                            may come back if matches are rare.
+            exclude_key (str): Leave out this sample (the query itself).
+        """
+        query = normalize(query).reshape(-1)
+        vectors = self.store.vectors()
+        n = len(vectors)
+        if n == 0:
+            return []
+        wanted = min(n, (k + 1) * (10 if sources else 1))
+
+        ivf = self._load_ivf()
+        if ivf is not None and nprobe < len(ivf['centroids']):
+            probe = np.argsort(-(ivf['centroids'] @ query))[:nprobe]
+            offsets, built_rows = ivf['offsets'], int(ivf['built_rows'])
+            candidates = np.concatenate(
+                [ivf['order'][offsets[c]:offsets[c + 1]] for c in probe] + [np.arange(built_rows, n)]
+            )
+            candidates = np.sort(candidates[candidates < n])
+            similarities = np.asarray(vectors[candidates], dtype=np.float32) @ query
+            similarities, rows = _top_k(similarities, candidates, wanted)
+        else:
+            best_similarities, best_rows = [], []
+            for start in range(0, n, SEARCH_BLOCK_ROWS):
+                block = np.asarray(vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+                block_similarities, block_rows = _top_k(block @ query, np.arange(start, start + len(block)), wanted)
+                best_similarities.append(block_similarities)
+                best_rows.append(block_rows)
+            similarities, rows = _top_k(np.concatenate(best_similarities), np.concatenate(best_rows), wanted)
+
+        samples = self.store.samples(rows)
+        results = []
+        for similarity, row in zip(similarities.tolist(), rows.tolist()):
+            sample = samples.get(row)
+            if sample is None or sample["key"] == exclude_key:
+                continue
+            if sources and sample["source"] not in sources:
+                continue
+            results.append(dict(sample, similarity=round(similarity, 4)))
+            if len(results) == k:
+                break
+        return results
+
+
+def default_nlist(n):
+    return max(1, min(MAX_NLIST, int(4 * np.sqrt(n))))
+
+
+def assign_clusters(vectors, centroids, block_bytes=ASSIGN_BLOCK_BYTES):
+    """
+    Returns the index of the most similar centroid for every vector, working
+    through the vectors in blocks so the similarity matrix never exceeds
+    block_bytes.
+    """
+    block_rows = max(1, block_bytes // (4 * len(centroids)))
+    return np.concatenate([
+        np.argmax(np.asarray(vectors[start:start + block_rows], dtype=np.float32) @ centroids.T, axis=1)
+        for start in range(0, len(vectors), block_rows)
+    ])
+
+
+def build_ivf(store, nlist=None, iterations=10, sample_size=100000, seed=123, block_bytes=ASSIGN_BLOCK_BYTES):
+    """
+    Clusters the stored vectors with spherical k-means and writes the IVF
+    index (centroids and the rows of each cluster) next to the store.
+    Samples added later are searched exactly until the index is rebuilt.
+    Memory use is bounded by the k-means sample and block_bytes, not by the
+    store size.
+
+    Returns:
+        int: The number of clusters.
+    """
+    vectors = store.vectors()
+    n = len(vectors)
+    if n == 0:
+        raise ValueError("The embedding store is empty.")
+    nlist = min(n, nlist or default_nlist(n))
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(vectors[np.sort(rng.choice(n, min(n, sample_size), replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+    for _ in range(iterations):
+        assignment = assign_clusters(sample, centroids, block_bytes)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = np.bincount(assignment, minlength=nlist) == 0
+        # Empty clusters are reseeded from random sample vectors.
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize(sums)
+
+    assignment = assign_clusters(vectors, centroids, block_bytes)
+    order = np.argsort(assignment, kind='stable').astype(np.int64)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))]).astype(np.int64)
+
+    tmp_path = store.ivf_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, centroids=centroids, order=order, offsets=offsets, built_rows=np.int64(n))
+    os.replace(tmp_path, store.ivf_path)
+    return nlist
+
+
+def read_lab_results(path):
+    """
+    Reads a CSV with a 'path' column (relative to the dataset folder), an
+    optional 'pH' column and any other lab measurements.
+
+    Returns:
+        dict: path -> row dict.
+    """
+    with open(path, 'r', newline='') as f:
+        return {os.path.normpath(row.pop('path')): row for row in csv.DictReader(f)}
+
+
+def add_dataset(store, model, dataset_dir, lab_results=None, batch_size=32, source='train'):
+    """
+    Embeds every image of a class-folder dataset into the store, labelled
+    with its class and, when given, its lab results.
+
+    Returns:
+        int: The number of samples added.
+    """
+    from dataset_files import list_labeled_images
+    from image_preprocessing import decode_batch
+    from prediction_cache import hash_image_bytes
+
+    paths, labels, class_names = list_labeled_images(dataset_dir)
+    lab_results = lab_results or {}
+    added = 0
+    for start in range(0, len(paths), batch_size):
+        images = []
+        for path in paths[start:start + batch_size]:
+            with open(path, 'rb') as f:
+                images.append(f.read())
+        batch, errors = decode_batch(images)
+        embeddings = model.predict_on_batch(batch)[-1]
+        items = []
+        for i, (image, error) in enumerate(zip(images, errors)):
+            if error is not None:
+                print(f"  Skipping {paths[start + i]}: {error}")
+                continue
+            relative_path = os.path.normpath(os.path.relpath(paths[start + i], dataset_dir))
+            lab = lab_results.get(relative_path)
+            pH = lab.get('pH') if lab else None
+            info = {"path": relative_path}
+            if lab:
+                info["lab"] = lab
+            items.append((hash_image_bytes(image), embeddings[i], source, class_names[labels[start + i]],
+                          float(pH) if pH not in (None, '') else None, info))
+        added += store.add(items)
+        print(f"  Embedded {min(start + batch_size, len(paths))}/{len(paths)} images.")
+    return added
+
+
+if __name__ == "__main__":
+    from bulk_score import load_scoring_model
+    from model_registry import REGISTRY_DIR
+
+    parser = argparse.ArgumentParser(description="Manage the similar-sample embedding store of a model version.")
+    parser.add_argument('--add-dataset', default=None, metavar='DIR',
+                        help="Embed a class-folder dataset (e.g. ../Dataset/Train) into the store.")
+    parser.add_argument('--lab-results', default=None,
+                        help="CSV of lab results for --add-dataset: a 'path' column relative to DIR, "
+                             "an optional 'pH' column and any other measurements.")
+    parser.add_argument('--source', default='train', help="Source name recorded for --add-dataset (default: train).")
+    parser.add_argument('--build-ivf', action='store_true', help="(Re)build the approximate IVF index.")
+    parser.add_argument('--nlist', type=int, default=None, help=f"IVF clusters (default: 4 * sqrt(samples), at most {MAX_NLIST}).")
+    parser.add_argument('--stats', action='store_true', help="Print store statistics.")
+    parser.add_argument('--embeddings-dir', default=EMBEDDINGS_DIR)
+    parser.add_argument('--dtype', choices=sorted(VECTOR_DTYPES), default='float16')
+    parser.add_argument('--registry', default=REGISTRY_DIR)
+    parser.add_argument('--version', default=None, help="Registry version (default: CURRENT).")
+    parser.add_argument('--model', default=None, help="Use this model file instead of the registry.")
+    parser.add_argument('--classes', default=None, help="Class names file for --model.")
+    args = parser.parse_args()
+
+    model, _, version = load_scoring_model(args.registry, args.version, 'keras', args.model, args.classes)
+    model = embedding_model(model)
+    store = EmbeddingStore(version_directory(version, args.embeddings_dir), int(model.outputs[-1].shape[-1]),
+                           args.dtype)
+
+    if args.add_dataset:
+        lab_results = read_lab_results(args.lab_results) if args.lab_results else None
+        added = add_dataset(store, model, args.add_dataset, lab_results, source=args.source)
+        print(f"Added {added} samples to '{store.directory}'.")
+    if args.build_ivf:
+        started_at = time.perf_counter()
+        nlist = build_ivf(store, args.nlist)
+        print(f"Built an IVF index with {nlist} clusters over {store.count()} samples "
+              f"in {time.perf_counter() - started_at:.1f} s.")
+    if args.stats or not (args.add_dataset or args.build_ivf):
+        print(json.dumps(store.stats(), indent=2))
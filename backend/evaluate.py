@@ -0,0 +1,342 @@
+"""
+Evaluates one or two models on the held-out Dataset/test folder and writes a
+JSON report: accuracy, confusion matrix, per-class precision/recall/F1,
+calibration (reliability bins, expected calibration error, Brier score) and
+inference latency. With two models both are scored in the same pass over
+the data (each image is decoded once) and the report adds a side-by-side
+comparison.
+
+Per-image predictions are cached in SQLite, keyed by the file's SHA-256 and
+the model version, so re-running after adding or relabelling a few images
+only scores the new files. File hashes are cached by path, size and
+modification time, so unchanged files are not re-read either.
+
+Usage (from the 'backend' folder):
+
+    python evaluate.py                                    # the registry's CURRENT model
+    python evaluate.py --models 20261018-103000 current   # two registry versions
+    python evaluate.py --models multi_task_soil_model.h5 multi_task_soil_model_int8.tflite
+
+A model is a registry version name, 'current', or a .h5/.keras/.tflite file
+(class names from --classes).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from benchmark import percentiles
+from bulk_score import load_scoring_model, decode_chunk, IMG_HEIGHT, IMG_WIDTH
+from dataset_files import list_labeled_images, hash_files
+from image_preprocessing import to_array
+from model_registry import REGISTRY_DIR
+
+TEST_DIR = '../Dataset/test'
+CACHE_PATH = 'eval_cache.sqlite3'
+REPORT_PATH = 'eval_report.json'
+BATCH_SIZE = 64
+PREFETCH_BATCHES = 3
+CALIBRATION_BINS = 10
+
+
+class EvalCache:
+    """
+    SQLite cache of file hashes and of each model version's raw outputs per
+    image.
+    """
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS file_hashes (path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, hash TEXT NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS predictions (version TEXT NOT NULL, hash TEXT NOT NULL, scores BLOB NOT NULL, "
+            "pH REAL NOT NULL, PRIMARY KEY (version, hash))"
+        )
+        self._db.commit()
+
+    def file_hashes(self, paths):
+        known = {
+            path: (size, mtime_ns, file_hash)
+            for path, size, mtime_ns, file_hash in self._db.execute("SELECT path, size, mtime_ns, hash FROM file_hashes")
+        }
+        hashes, updates = hash_files(paths, known)
+        self._db.executemany("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)", updates)
+        self._db.commit()
+        return hashes, len(updates)
+
+    def predictions(self, version):
+        return {
+            file_hash: (np.frombuffer(scores, dtype=np.float32), pH)
+            for file_hash, scores, pH in self._db.execute(
+                "SELECT hash, scores, pH FROM predictions WHERE version = ?", (version,)
+            )
+        }
+
+    def put_predictions(self, version, rows):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)",
+            [(version, file_hash, np.asarray(scores, dtype=np.float32).tobytes(), float(pH))
+             for file_hash, scores, pH in rows]
+        )
+        self._db.commit()
+
+
+def load_eval_model(spec, registry_dir, classes_path):
+    """
+    Loads a model given as a registry version, 'current' or a model file.
+
+    Returns:
+        dict: name, model, classes and version.
+    """
+    if os.path.isfile(spec):
+        backend = 'tflite' if spec.endswith('.tflite') else 'keras'
+        model, rules, version = load_scoring_model(registry_dir, None, backend, spec, classes_path)
+    else:
+        model, rules, version = load_scoring_model(registry_dir, None if spec == 'current' else spec)
+    return {"name": spec, "model": model, "classes": rules.classes, "version": version}
+
+
+def score_missing(models, paths, hashes, cache, batch_size=BATCH_SIZE, workers=None, prefetch=PREFETCH_BATCHES):
+    """
+    Runs every image that some model has no cached prediction for through
+    the models that lack it. Each such image is decoded once, on a process
+    pool, while the previous batch is in the models.
+
+    Returns:
+        tuple: (predictions, latencies, decode_errors) where predictions maps
+               version -> {hash: (scores, pH)}, latencies maps version ->
+               [(seconds, images)] per batch, and decode_errors maps hash ->
+               message.
+    """
+    predictions = {m["version"]: cache.predictions(m["version"]) for m in models}
+    latencies = {m["version"]: [] for m in models}
+    decode_errors = {}
+
+    first_path = {}
+    for path, file_hash in zip(paths, hashes):
+        first_path.setdefault(file_hash, path)
+    todo = [file_hash for file_hash in first_path if any(file_hash not in predictions[v] for v in predictions)]
+    if not todo:
+        return predictions, latencies, decode_errors
+    print(f"Scoring {len(todo)} images without cached predictions ({len(first_path) - len(todo)} cached).")
+
+    target_size = (IMG_WIDTH, IMG_HEIGHT)
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    pending = deque()
+    chunks = iter([todo[start:start + batch_size] for start in range(0, len(todo), batch_size)])
+
+    def submit_next():
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        pending.append((chunk, pool.submit(decode_chunk, [first_path[h] for h in chunk], target_size)))
+        return True
+
+    try:
+        while len(pending) < prefetch and submit_next():
+            pass
+        done = 0
+        while pending:
+            chunk, future = pending.popleft()
+            submit_next()
+            pixels, errors = future.result()
+            for file_hash, error in zip(chunk, errors):
+                if error is not None:
+                    decode_errors[file_hash] = error
+
+            for m in models:
+                version = m["version"]
+                rows = [i for i, (h, error) in enumerate(zip(chunk, errors))
+                        if error is None and h not in predictions[version]]
+                if not rows:
+                    continue
+                batch = to_array(pixels[rows], np.empty((len(rows), IMG_HEIGHT, IMG_WIDTH, 3), dtype='float32'))
+                started_at = time.perf_counter()
+                soil_type_predictions, pH_predictions = m["model"].predict_on_batch(batch)[:2]
+                latencies[version].append((time.perf_counter() - started_at, len(rows)))
+                soil_type_predictions = np.asarray(soil_type_predictions)
+                pH_predictions = np.asarray(pH_predictions).reshape(-1)
+                new_rows = [(chunk[i], soil_type_predictions[j], pH_predictions[j]) for j, i in enumerate(rows)]
+                cache.put_predictions(version, new_rows)
+                for file_hash, scores, pH in new_rows:
+                    predictions[version][file_hash] = (np.asarray(scores, dtype=np.float32), float(pH))
+            done += len(chunk)
+            print(f"  {done}/{len(todo)} images scored.")
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return predictions, latencies, decode_errors
+
+
+def classification_metrics(true_names, scores, model_classes, bins=CALIBRATION_BINS):
+    """
+    Confusion matrix, per-class precision/recall/F1 and calibration for one
+    model. Dataset classes the model does not know are added to the matrix
+    (they can only be misclassified).
+    """
+    labels = list(model_classes) + sorted(set(true_names) - set(model_classes))
+    index = {name: i for i, name in enumerate(labels)}
+    y_true = np.array([index[name] for name in true_names])
+    y_pred = scores.argmax(axis=1)
+    n_labels = len(labels)
+
+    confusion = np.zeros((n_labels, n_labels), dtype=np.int64)
+    np.add.at(confusion, (y_true, y_pred), 1)
+    true_positives = np.diag(confusion).astype(np.float64)
+    support = confusion.sum(axis=1)
+    predicted = confusion.sum(axis=0)
+    precision = np.divide(true_positives, predicted, out=np.zeros(n_labels), where=predicted > 0)
+    recall = np.divide(true_positives, support, out=np.zeros(n_labels), where=support > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(n_labels), where=precision + recall > 0)
+
+    confidence = scores.max(axis=1)
+    correct = y_pred == y_true
+    bin_index = np.minimum((confidence * bins).astype(int), bins - 1)
+    counts = np.bincount(bin_index, minlength=bins)
+    confidence_sums = np.bincount(bin_index, weights=confidence, minlength=bins)
+    correct_sums = np.bincount(bin_index, weights=correct, minlength=bins)
+    filled = counts > 0
+    bin_confidence = np.divide(confidence_sums, counts, out=np.zeros(bins), where=filled)
+    bin_accuracy = np.divide(correct_sums, counts, out=np.zeros(bins), where=filled)
+    one_hot = np.zeros_like(scores)
+    known = y_true < scores.shape[1]
+    one_hot[np.flatnonzero(known), y_true[known]] = 1.0
+
+    present = support > 0
+    return {
+        "images": int(len(y_true)),
+        "accuracy": round(float(correct.mean()), 4),
+        "macro_f1": round(float(f1[present].mean()), 4) if present.any() else 0.0,
+        "labels": labels,
+        "confusion_matrix": confusion.tolist(),
+        "per_class": {
+            name: {"precision": round(float(precision[i]), 4), "recall": round(float(recall[i]), 4),
+                   "f1": round(float(f1[i]), 4), "support": int(support[i])}
+            for i, name in enumerate(labels)
+        },
+        "calibration": {
+            "ece": round(float(np.sum(counts / len(y_true) * np.abs(bin_accuracy - bin_confidence))), 4),
+            "brier": round(float(np.mean(np.sum((scores - one_hot) ** 2, axis=1))), 4),
+            "mean_confidence": round(float(confidence.mean()), 4),
+            "bins": [
+                {"range": [round(b / bins, 2), round((b + 1) / bins, 2)], "count": int(counts[b]),
+                 "confidence": round(float(bin_confidence[b]), 4), "accuracy": round(float(bin_accuracy[b]), 4)}
+                for b in range(bins) if counts[b]
+            ],
+        },
+    }
+
+
+def latency_stats(batches):
+    if not batches:
+        return {"images_scored": 0}
+    seconds = np.array([s for s, _ in batches])
+    images = np.array([n for _, n in batches])
+    return {
+        "images_scored": int(images.sum()),
+        "batches": len(batches),
+        "images_per_sec": round(float(images.sum() / seconds.sum()), 2),
+        "ms_per_image": round(float(seconds.sum() / images.sum() * 1000.0), 3),
+        "batch": percentiles(seconds * 1000.0),
+    }
+
+
+def evaluate(model_specs, test_dir=TEST_DIR, cache_path=CACHE_PATH, registry_dir=REGISTRY_DIR,
+             classes_path=None, batch_size=BATCH_SIZE, workers=None):
+    """
+    Evaluates the models on test_dir and returns the report dict.
+    """
+    started_at = time.perf_counter()
+    models = [load_eval_model(spec, registry_dir, classes_path) for spec in model_specs]
+    if len({m["version"] for m in models}) != len(models):
+        raise SystemExit("ERROR: The same model was given twice.")
+
+    paths, labels, dataset_classes = list_labeled_images(test_dir)
+    if not paths:
+        raise SystemExit(f"ERROR: No images found in '{test_dir}'.")
+    cache = EvalCache(cache_path)
+    hashes, rehashed = cache.file_hashes(paths)
+    predictions, latencies, decode_errors = score_missing(models, paths, hashes, cache, batch_size, workers)
+
+    usable = [i for i, file_hash in enumerate(hashes) if file_hash not in decode_errors
+              and all(file_hash in predictions[m["version"]] for m in models)]
+    true_names = [dataset_classes[labels[i]] for i in usable]
+    report = {
+        "dataset": test_dir,
+        "images": len(paths),
+        "evaluated": len(usable),
+        "decode_errors": {paths[i]: decode_errors[h] for i, h in enumerate(hashes) if h in decode_errors},
+        "dataset_classes": dataset_classes,
+        "models": {},
+    }
+    correct = {}
+    for m in models:
+        version = m["version"]
+        scores = np.stack([predictions[version][hashes[i]][0] for i in usable])
+        pH = np.array([predictions[version][hashes[i]][1] for i in usable])
+        metrics = classification_metrics(true_names, scores, m["classes"])
+        metrics["version"] = version
+        metrics["predicted_pH"] = {"mean": round(float(pH.mean()), 3), "std": round(float(pH.std()), 3)}
+        metrics["latency"] = latency_stats(latencies[version])
+        report["models"][m["name"]] = metrics
+        predicted_names = np.array(m["classes"])[scores.argmax(axis=1)]
+        correct[m["name"]] = (predicted_names == np.array(true_names), predicted_names)
+
+    if len(models) == 2:
+        (name_a, (right_a, pred_a)), (name_b, (right_b, pred_b)) = correct.items()
+        report["comparison"] = {
+            "models": [name_a, name_b],
+            "accuracy_delta": round(report["models"][name_b]["accuracy"] - report["models"][name_a]["accuracy"], 4),
+            "agreement": round(float(np.mean(pred_a == pred_b)), 4),
+            # Images only one of the models gets right (the inputs of a McNemar test).
+            "only_first_correct": int(np.sum(right_a & ~right_b)),
+            "only_second_correct": int(np.sum(right_b & ~right_a)),
+        }
+
+    report["run"] = {
+        "seconds": round(time.perf_counter() - started_at, 2),
+        "files_rehashed": rehashed,
+        "images_scored": {m["name"]: latency_stats(latencies[m["version"]])["images_scored"] for m in models},
+    }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate one or two soil models on the test set.")
+    parser.add_argument('--models', nargs='+', default=['current'],
+                        help="One or two models: registry versions, 'current' or model files (default: current).")
+    parser.add_argument('--test-dir', default=TEST_DIR, help=f"Class-folder test set (default: {TEST_DIR}).")
+    parser.add_argument('--output', default=REPORT_PATH, help=f"JSON report path (default: {REPORT_PATH}).")
+    parser.add_argument('--cache', default=CACHE_PATH, help=f"Prediction cache (default: {CACHE_PATH}).")
+    parser.add_argument('--registry', default=REGISTRY_DIR)
+    parser.add_argument('--classes', default=None, help="Class names file for model files (default: soil_classes.txt).")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=None, help="Decode processes (default: one per CPU).")
+    args = parser.parse_args()
+    if len(args.models) > 2:
+        parser.error("Compare at most two models.")
+
+    report = evaluate(args.models, args.test_dir, args.cache, args.registry, args.classes, args.batch_size,
+                      args.workers)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\nEvaluated {report['evaluated']} of {report['images']} images in '{args.test_dir}'.")
+    for name, metrics in report["models"].items():
+        latency = metrics["latency"]
+        speed = f", {latency['images_per_sec']} images/sec" if latency["images_scored"] else ", all cached"
+        print(f"  {name} ({metrics['version']}): accuracy {metrics['accuracy']:.4f}, macro F1 {metrics['macro_f1']:.4f}, "
+              f"ECE {metrics['calibration']['ece']:.4f}{speed}")
+    if "comparison" in report:
+        comparison = report["comparison"]
+        print(f"  Accuracy change: {comparison['accuracy_delta']:+.4f}, agreement {comparison['agreement']:.4f}")
+    print(f"Report written to '{args.output}'.")
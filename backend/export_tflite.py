@@ -0,0 +1,216 @@
+"""
+Exports the trained multi-task model to TFLite for faster CPU serving, and
+compares each export with the Keras model on Dataset/test.
+
+Two artifacts are written next to the .h5 model:
+    multi_task_soil_model_fp16.tflite  float16 weights, float compute
+    multi_task_soil_model_int8.tflite  int8 post-training quantization, calibrated
+                                       on a sample of Dataset/Train
+
+Usage (from the 'backend' folder):
+
+    python export_tflite.py
+    python export_tflite.py --calibration-samples 300 --report tflite_report.json
+
+Serve an export with:
+
+    MODEL_BACKEND=tflite TFLITE_MODEL_PATH=multi_task_soil_model_int8.tflite python app.py
+
+For a published registry version, the exports are written into the
+version's folder and one of them (--registry-variant) becomes its
+model.tflite, which MODEL_BACKEND=tflite servers then hot-load like any
+new version:
+
+    python export_tflite.py --registry-version current
+    python export_tflite.py --registry-version 20261018-103000 --registry-variant int8
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+from dataset_files import list_labeled_images, load_class_names, sample_images
+from image_preprocessing import TARGET_SIZE, decode_batch, decode_image
+from model_registry import REGISTRY_DIR, add_model_file, current_version, version_files
+from tflite_model import TFLiteModel
+
+MODEL_PATH = 'multi_task_soil_model.h5'
+CLASS_NAMES_PATH = 'soil_classes.txt'
+TRAIN_DIR = '../Dataset/Train'
+TEST_DIR = '../Dataset/test'
+EVAL_BATCH_SIZE = 32
+
+
+def export_float16(model, output_path):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.target_spec.supported_types = [tf.float16]
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    print(f"Saved float16 model to '{output_path}'.")
+
+
+def export_int8(model, output_path, calibration_paths):
+    def representative_dataset():
+        for path in calibration_paths:
+            try:
+                yield [np.expand_dims(decode_image(path, TARGET_SIZE), axis=0)]
+            except Exception as e:
+                print(f"  Skipping calibration image {path}: {e}")
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    # Keep float inputs/outputs so the serving code does not need to change.
+    converter.target_spec.supported_ops = [
+        tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+        tf.lite.OpsSet.TFLITE_BUILTINS
+    ]
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    print(f"Saved int8 model to '{output_path}' (calibrated on {len(calibration_paths)} images).")
+
+
+def run_model(model, batch):
+    start = time.perf_counter()
+    soil_type_predictions, pH_predictions = model.predict_on_batch(batch)
+    return np.asarray(soil_type_predictions), np.asarray(pH_predictions).reshape(-1), time.perf_counter() - start
+
+
+def compare_models(models, test_dir, class_names):
+    """
+    Runs every model over test_dir and reports accuracy, agreement with the
+    Keras model, pH difference from the Keras model and per-image latency.
+
+    Args:
+        models (dict): name -> model with predict_on_batch(); must include 'keras'.
+        test_dir (str): Class-folder test set.
+        class_names (list): Class order of the model outputs.
+    """
+    paths, labels, _ = list_labeled_images(test_dir, class_names)
+    if not paths:
+        print(f"No test images found in '{test_dir}'.")
+        return {}
+    labels = np.array(labels)
+
+    predictions = {name: [] for name in models}
+    pH_values = {name: [] for name in models}
+    seconds = {name: 0.0 for name in models}
+    kept = []
+
+    print(f"Comparing {len(models)} models on {len(paths)} test images...")
+    for start in range(0, len(paths), EVAL_BATCH_SIZE):
+        chunk = paths[start:start + EVAL_BATCH_SIZE]
+        batch, errors = decode_batch(chunk, target_size=TARGET_SIZE)
+        ok = [i for i, error in enumerate(errors) if error is None]
+        if not ok:
+            continue
+        batch = batch[ok]
+        kept.extend(start + i for i in ok)
+        for name, model in models.items():
+            soil_type_predictions, pH_predictions, elapsed = run_model(model, batch)
+            predictions[name].append(np.argmax(soil_type_predictions, axis=1))
+            pH_values[name].append(pH_predictions)
+            seconds[name] += elapsed
+
+    labels = labels[kept]
+    keras_predictions = np.concatenate(predictions['keras'])
+    keras_pH = np.concatenate(pH_values['keras'])
+
+    report = {}
+    for name in models:
+        predicted = np.concatenate(predictions[name])
+        pH = np.concatenate(pH_values[name])
+        report[name] = {
+            "accuracy": round(float(np.mean(predicted == labels)), 4),
+            "agreement_with_keras": round(float(np.mean(predicted == keras_predictions)), 4),
+            "pH_mean_abs_diff_vs_keras": round(float(np.mean(np.abs(pH - keras_pH))), 4),
+            "pH_max_abs_diff_vs_keras": round(float(np.max(np.abs(pH - keras_pH))), 4),
+            "ms_per_image": round(seconds[name] * 1000.0 / len(labels), 3),
+        }
+    report["images"] = int(len(labels))
+    return report
+
+
+def print_report(report, sizes):
+    print(f"\n--- Comparison on {report.get('images', 0)} test images ---")
+    print(f"{'model':<8} {'size MB':>8} {'accuracy':>9} {'agree':>7} {'pH MAE':>8} {'pH max':>8} {'ms/img':>8}")
+    for name, row in report.items():
+        if name == "images":
+            continue
+        print(f"{name:<8} {sizes[name] / 1e6:>8.2f} {row['accuracy']:>9.4f} {row['agreement_with_keras']:>7.4f} "
+              f"{row['pH_mean_abs_diff_vs_keras']:>8.4f} {row['pH_max_abs_diff_vs_keras']:>8.4f} {row['ms_per_image']:>8.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the soil model to TFLite and compare it with the Keras model.")
+    parser.add_argument('--model', default=MODEL_PATH, help=f"Keras model to export (default: {MODEL_PATH}).")
+    parser.add_argument('--train-dir', default=TRAIN_DIR, help="Images used for int8 calibration.")
+    parser.add_argument('--test-dir', default=TEST_DIR, help="Class-folder test set used for the comparison.")
+    parser.add_argument('--calibration-samples', type=int, default=200,
+                        help="Number of training images used to calibrate int8 quantization (default: 200).")
+    parser.add_argument('--skip-compare', action='store_true', help="Only export, do not run the comparison.")
+    parser.add_argument('--report', default=None, help="Optional path to write the comparison as JSON.")
+    parser.add_argument('--registry', default=REGISTRY_DIR, help=f"Model registry folder (default: {REGISTRY_DIR}).")
+    parser.add_argument('--registry-version', default=None, metavar='VERSION',
+                        help="Export this published version ('current' for the registry's CURRENT one) instead of "
+                             "--model, and add the --registry-variant export to it as model.tflite.")
+    parser.add_argument('--registry-variant', choices=('fp16', 'int8'), default='fp16',
+                        help="Export that TFLite servers of the registry version load (default: fp16).")
+    args = parser.parse_args()
+
+    class_names_path = CLASS_NAMES_PATH
+    if args.registry_version:
+        version = current_version(args.registry) if args.registry_version == 'current' else args.registry_version
+        if version is None:
+            parser.error(f"No model versions in '{args.registry}'.")
+        args.model, class_names_path, _ = version_files(version, args.registry)
+
+    model = keras.models.load_model(args.model)
+    print(f"Loaded Keras model '{args.model}'.")
+
+    base_path = os.path.splitext(args.model)[0]
+    fp16_path = f"{base_path}_fp16.tflite"
+    int8_path = f"{base_path}_int8.tflite"
+
+    export_float16(model, fp16_path)
+    export_int8(model, int8_path, sample_images(args.train_dir, args.calibration_samples))
+
+    if args.registry_version:
+        variant_path = fp16_path if args.registry_variant == 'fp16' else int8_path
+        add_model_file(version, 'tflite', variant_path, {"variant": args.registry_variant}, args.registry)
+        print(f"Added the {args.registry_variant} export to model version '{version}' as its TFLite model.")
+
+    if args.skip_compare:
+        return
+
+    class_names = load_class_names(class_names_path)
+    models = {
+        'keras': model,
+        'fp16': TFLiteModel(fp16_path),
+        'int8': TFLiteModel(int8_path),
+    }
+    sizes = {
+        'keras': os.path.getsize(args.model),
+        'fp16': os.path.getsize(fp16_path),
+        'int8': os.path.getsize(int8_path),
+    }
+    report = compare_models(models, args.test_dir, class_names)
+    if not report:
+        return
+    print_report(report, sizes)
+
+    if args.report:
+        for name, size in sizes.items():
+            report[name]["size_bytes"] = size
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nComparison saved to '{args.report}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Pretrained backbones and a persistent store of their features, for training
+only the soil type and pH heads (train_model.py --backbone).
+
+A backbone is an ImageNet-pretrained convolutional network without its
+classifier, loaded from a local weights file (no network access). Its
+globally pooled output for a dataset image never changes, so it is computed
+once and kept in SQLite, keyed by the backbone (name plus a hash of the
+weights file) and the SHA-256 of the image file. Retraining after adding a
+few images only runs the backbone on those images; the heads then train on
+cached vectors, which takes seconds on a CPU.
+
+File hashes are cached by path, size and modification time, so unchanged
+files are not re-read either.
+
+Weights files are the Keras 'no top' ImageNet weights. On a machine with
+internet access, for example:
+
+    python -c "import tensorflow as tf; tf.keras.applications.MobileNetV2(include_top=False, pooling='avg').save_weights('mobilenet_v2_no_top.weights.h5')"
+
+and copy the file to backbones/ on the training machine.
+
+Usage (from the 'backend' folder):
+
+    python feature_store.py --stats
+    python feature_store.py --prune ../Dataset/Train    # drop features of images no longer in the dataset
+"""
+import argparse
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from dataset_files import hash_files, iter_image_files, sha256_file
+from image_preprocessing import allocate_batch, decode_batch, TARGET_SIZE
+
+FEATURE_STORE_PATH = 'features.sqlite3'
+BACKBONE_DIR = 'backbones'
+BATCH_SIZE = 32
+PROGRESS_BATCHES = 20
+
+# name -> (keras.applications constructor, default weights file, input scale, input offset).
+# The model gets [0, 1] images like every other model here; scale and offset map
+# them to the range the backbone was trained on.
+BACKBONES = {
+    'mobilenet_v2': ('MobileNetV2', 'mobilenet_v2_no_top.weights.h5', 2.0, -1.0),
+    'efficientnet_b0': ('EfficientNetB0', 'efficientnet_b0_no_top.weights.h5', 255.0, 0.0),
+}
+
+
+def default_weights_path(name, backbone_dir=BACKBONE_DIR):
+    return os.path.join(backbone_dir, BACKBONES[name][1])
+
+
+def backbone_id(name, weights_path):
+    """
+    Identifies a backbone by name and weights, so replacing the weights file
+    does not mix features from two different networks.
+    """
+    return f"{name}-{sha256_file(weights_path)[:12]}"
+
+
+def load_backbone(name, weights_path, input_shape=(TARGET_SIZE[1], TARGET_SIZE[0], 3)):
+    """
+    Builds a frozen backbone that maps [0, 1] images to pooled feature vectors.
+
+    Raises:
+        ValueError: If the backbone name is unknown.
+        FileNotFoundError: If the weights file does not exist.
+    """
+    if name not in BACKBONES:
+        raise ValueError(f"Unknown backbone '{name}'. Use one of {', '.join(BACKBONES)}.")
+    if not os.path.isfile(weights_path):
+        raise FileNotFoundError(
+            f"Backbone weights '{weights_path}' not found. See 'python feature_store.py --help' for how to get them."
+        )
+    from tensorflow import keras
+
+    constructor, _, scale, offset = BACKBONES[name]
+    network = getattr(keras.applications, constructor)(
+        input_shape=input_shape, include_top=False, weights=None, pooling='avg'
+    )
+    network.load_weights(weights_path)
+    network.trainable = False
+
+    inputs = keras.Input(shape=input_shape)
+    x = keras.layers.Rescaling(scale, offset=offset, name='backbone_preprocessing')(inputs)
+    features = network(x, training=False)
+    return keras.Model(inputs, features, name=f"{name}_backbone")
+
+
+class FeatureStore:
+    """
+    SQLite store of backbone feature vectors keyed by (backbone id, file
+    SHA-256), plus the file hash cache.
+    """
+
+    def __init__(self, path=FEATURE_STORE_PATH):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS file_hashes (path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, hash TEXT NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS features (backbone TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "created_at REAL NOT NULL, PRIMARY KEY (backbone, hash))"
+        )
+        self._db.commit()
+
+    def file_hashes(self, paths):
+        known = {
+            path: (size, mtime_ns, file_hash)
+            for path, size, mtime_ns, file_hash in self._db.execute("SELECT path, size, mtime_ns, hash FROM file_hashes")
+        }
+        hashes, updates = hash_files(paths, known)
+        self._db.executemany("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)", updates)
+        self._db.commit()
+        return hashes, len(updates)
+
+    def features(self, backbone):
+        return {
+            file_hash: np.frombuffer(vector, dtype=np.float32)
+            for file_hash, vector in self._db.execute(
+                "SELECT hash, vector FROM features WHERE backbone = ?", (backbone,)
+            )
+        }
+
+    def put_features(self, backbone, rows):
+        now = time.time()
+        self._db.executemany(
+            "INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?)",
+            [(backbone, file_hash, np.asarray(vector, dtype=np.float32).tobytes(), now) for file_hash, vector in rows]
+        )
+        self._db.commit()
+
+    def stats(self):
+        return [
+            {"backbone": backbone, "images": count, "dimensions": size // 4}
+            for backbone, count, size in self._db.execute(
+                "SELECT backbone, COUNT(*), MAX(LENGTH(vector)) FROM features GROUP BY backbone ORDER BY backbone"
+            )
+        ]
+
+    def prune(self, keep_hashes):
+        """
+        Deletes features and cached file hashes of images that are not in
+        keep_hashes. Returns the number of feature rows deleted.
+        """
+        self._db.execute("CREATE TEMP TABLE IF NOT EXISTS keep (hash TEXT PRIMARY KEY)")
+        self._db.execute("DELETE FROM keep")
+        self._db.executemany("INSERT OR IGNORE INTO keep VALUES (?)", [(h,) for h in keep_hashes])
+        deleted = self._db.execute("DELETE FROM features WHERE hash NOT IN (SELECT hash FROM keep)").rowcount
+        self._db.execute("DELETE FROM file_hashes WHERE hash NOT IN (SELECT hash FROM keep)")
+        self._db.commit()
+        self._db.execute("VACUUM")
+        return deleted
+
+    def close(self):
+        self._db.close()
+
+
+def dataset_features(store, backbone, backbone_name, paths, batch_size=BATCH_SIZE, workers=None):
+    """
+    Returns the backbone features of every image, running the backbone only
+    on images whose features are not in the store yet.
+
+    Args:
+        store (FeatureStore): The feature store.
+        backbone: Model returned by load_backbone().
+        backbone_name (str): Its backbone_id().
+        paths (list): Image file paths.
+        batch_size (int): Images per backbone call.
+        workers (int): Decoding threads.
+
+    Returns:
+        tuple: (features, keep, computed) where features is a float32 matrix
+               with one row per readable image, keep the indices into paths
+               of those images, and computed the number of images that went
+               through the backbone in this call.
+    """
+    hashes, rehashed = store.file_hashes(paths)
+    if rehashed:
+        print(f"Hashed {rehashed} new or changed files.")
+    cached = store.features(backbone_name)
+
+    first_path = {}
+    for path, file_hash in zip(paths, hashes):
+        first_path.setdefault(file_hash, path)
+    todo = [file_hash for file_hash in first_path if file_hash not in cached]
+    print(f"{len(first_path) - len(todo)} images have cached '{backbone_name}' features; computing {len(todo)}.")
+
+    unreadable = set()
+    if todo:
+        started_at = time.perf_counter()
+        buffer = allocate_batch(batch_size)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for start in range(0, len(todo), batch_size):
+                chunk = todo[start:start + batch_size]
+                batch, errors = decode_batch([first_path[h] for h in chunk], buffer, executor=executor)
+                vectors = np.asarray(backbone.predict_on_batch(batch))
+                rows = []
+                for file_hash, vector, error in zip(chunk, vectors, errors):
+                    if error is not None:
+                        print(f"  Skipping {first_path[file_hash]}: {error}")
+                        unreadable.add(file_hash)
+                        continue
+                    rows.append((file_hash, vector))
+                    cached[file_hash] = vector
+                store.put_features(backbone_name, rows)
+                done = min(start + batch_size, len(todo))
+                if done == len(todo) or (start // batch_size) % PROGRESS_BATCHES == PROGRESS_BATCHES - 1:
+                    print(f"  {done}/{len(todo)} images")
+        elapsed = time.perf_counter() - started_at
+        print(f"Computed features for {len(todo)} images in {elapsed:.1f}s ({len(todo) / elapsed:.1f} images/sec).")
+
+    keep = [i for i, file_hash in enumerate(hashes) if file_hash not in unreadable]
+    features = np.stack([cached[hashes[i]] for i in keep]) if keep else np.empty((0, 0), dtype=np.float32)
+    return features, np.array(keep, dtype='int64'), len(todo)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Inspect or prune the backbone feature store used by train_model.py --backbone.",
+        epilog="Backbone weights are read from a local file. To get them, run on a machine with internet "
+               "access: python -c \"import tensorflow as tf; tf.keras.applications.MobileNetV2("
+               "include_top=False, pooling='avg').save_weights('mobilenet_v2_no_top.weights.h5')\" "
+               f"and copy the file to {BACKBONE_DIR}/."
+    )
+    parser.add_argument('--store', default=FEATURE_STORE_PATH, help=f"Feature store (default: {FEATURE_STORE_PATH}).")
+    parser.add_argument('--stats', action='store_true', help="Print the number of images stored per backbone.")
+    parser.add_argument('--prune', nargs='+', metavar='DATASET_DIR',
+                        help="Delete features of images that are in none of these dataset folders.")
+    args = parser.parse_args()
+
+    store = FeatureStore(args.store)
+    if args.prune:
+        paths = [path for dataset_dir in args.prune for path in iter_image_files(dataset_dir)]
+        hashes, _ = store.file_hashes(paths)
+        print(f"Deleted {store.prune(set(hashes))} feature vectors of images no longer in {args.prune}.")
+    if args.stats or not args.prune:
+        for entry in store.stats():
+            print(f"{entry['backbone']}: {entry['images']} images, {entry['dimensions']} dimensions")
+    store.close()
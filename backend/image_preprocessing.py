@@ -0,0 +1,215 @@
+import io
+import os
+import warnings
+
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+IMG_HEIGHT = 224
+IMG_WIDTH = 224
+TARGET_SIZE = (IMG_WIDTH, IMG_HEIGHT)  # PIL order: (width, height)
+
+# JPEGs are DCT-downscaled at decode time to no less than this multiple of the
+# target size, which leaves the final resize enough pixels to average over.
+DRAFT_OVERSAMPLE = 2
+
+# Antialiased bilinear. Training (train_model.py, packed_dataset.py) decodes
+# through this module too, so the model sees the same resize it was trained on.
+RESAMPLE = Image.BILINEAR
+REDUCING_GAP = 3.0
+
+EXIF_ORIENTATION = 0x0112
+
+# Uploads with more pixels than this are refused before decoding. A 40 MP
+# image already decodes to 120 MB of RGB; anything larger is most likely a
+# decompression bomb.
+MAX_IMAGE_PIXELS = 40_000_000
+
+_SCALE = np.float32(1.0 / 255.0)
+
+
+def open_image(source):
+    """
+    Opens an image from raw bytes, a path or a binary file object.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    elif isinstance(source, os.PathLike):
+        source = os.fspath(source)
+    return Image.open(source)
+
+
+class ImageRejected(ValueError):
+    """
+    Raised by sniff_image() for uploads that must not be decoded. reason is
+    a short machine-readable code: 'not_an_image', 'unsupported_format' or
+    'too_many_pixels'.
+    """
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+def sniff_image(source, allowed_formats=None, max_pixels=MAX_IMAGE_PIXELS):
+    """
+    Identifies an image from its header bytes only, without decoding pixels.
+    File objects are returned to their original position.
+
+    Args:
+        source: Raw bytes, a path or a seekable binary file object.
+        allowed_formats (set): Pillow format names to accept (e.g. {'JPEG',
+                               'PNG'}); None accepts any format.
+        max_pixels (int): Largest width * height accepted.
+
+    Returns:
+        tuple: (format, width, height).
+
+    Raises:
+        ImageRejected: If the bytes are not an image, the format is not
+                       allowed, or the image has more than max_pixels pixels.
+    """
+    position = source.tell() if hasattr(source, 'seek') else None
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            try:
+                img = open_image(source)
+            except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+                raise ImageRejected("Image has too many pixels to process", 'too_many_pixels')
+            except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+                raise ImageRejected("File is not a readable image", 'not_an_image')
+        image_format, (width, height) = img.format, img.size
+    finally:
+        if position is not None:
+            source.seek(position)
+
+    if allowed_formats is not None and image_format not in allowed_formats:
+        raise ImageRejected(f"Unsupported image format '{image_format}'", 'unsupported_format')
+    if width * height > max_pixels:
+        raise ImageRejected(
+            f"Image is too large to process ({width}x{height} pixels, limit is {max_pixels} pixels)",
+            'too_many_pixels'
+        )
+    return image_format, width, height
+
+
+def decode_rgb(source, target_size=TARGET_SIZE):
+    """
+    Decodes an image into an RGB PIL image, without the final resize.
+
+    Large JPEGs are decoded at a reduced resolution (draft mode) instead of
+    full size. EXIF orientation is applied, and palette, grayscale, CMYK and
+    RGBA images are all converted to plain RGB (alpha is dropped, as
+    tf.image.decode_image(channels=3) does). For animated GIFs only the first
+    frame is used.
+
+    Args:
+        source: Raw bytes, a path or a binary file object.
+        target_size (tuple): The (width, height) the image will be resized to,
+                             used to pick the JPEG draft scale.
+
+    Returns:
+        PIL.Image.Image: A fully loaded RGB image.
+    """
+    img = open_image(source)
+    if img.format == 'JPEG':
+        img.draft('RGB', (target_size[0] * DRAFT_OVERSAMPLE, target_size[1] * DRAFT_OVERSAMPLE))
+    if img.getexif().get(EXIF_ORIENTATION, 1) != 1:
+        img = ImageOps.exif_transpose(img)
+
+    if img.mode != 'RGB':
+        if img.mode in ('P', 'PA', 'LA'):
+            img = img.convert('RGBA')
+        img = img.convert('RGB')
+    img.load()
+    return img
+
+
+def resize_rgb(img, target_size=TARGET_SIZE):
+    if img.size != tuple(target_size):
+        img = img.resize(target_size, resample=RESAMPLE, reducing_gap=REDUCING_GAP)
+    return img
+
+
+def load_rgb(source, target_size=TARGET_SIZE):
+    """
+    Decodes an image into an RGB PIL image of exactly target_size. See
+    decode_rgb() for how formats, modes and orientation are handled.
+
+    Args:
+        source: Raw bytes, a path or a binary file object.
+        target_size (tuple): Output (width, height).
+
+    Returns:
+        PIL.Image.Image: An RGB image of exactly target_size.
+    """
+    return resize_rgb(decode_rgb(source, target_size), target_size)
+
+
+def to_array(img, out=None):
+    """
+    Scales an RGB image to [0, 1] float32, writing into out if given.
+    """
+    if out is None:
+        out = np.empty((img.size[1], img.size[0], 3), dtype='float32')
+    np.multiply(np.asarray(img), _SCALE, out=out, casting='unsafe')
+    return out
+
+
+def decode_into(source, out, target_size=None):
+    """
+    Decodes an image and writes it, scaled to [0, 1], straight into out.
+
+    Args:
+        source: Raw bytes, a path or a binary file object.
+        out (np.ndarray): float32 array of shape (height, width, 3), usually a
+                          row of a preallocated batch buffer.
+        target_size (tuple): Output (width, height); defaults to out's shape.
+    """
+    if target_size is None:
+        target_size = (out.shape[1], out.shape[0])
+    return to_array(load_rgb(source, target_size), out)
+
+
+def decode_image(source, target_size=TARGET_SIZE):
+    """
+    Returns a new float32 array of shape (height, width, 3) scaled to [0, 1].
+    """
+    out = np.empty((target_size[1], target_size[0], 3), dtype='float32')
+    return decode_into(source, out, target_size)
+
+
+def allocate_batch(batch_size, target_size=TARGET_SIZE):
+    return np.empty((batch_size, target_size[1], target_size[0], 3), dtype='float32')
+
+
+def decode_batch(sources, out=None, target_size=TARGET_SIZE, executor=None):
+    """
+    Decodes many images into one float32 batch buffer.
+
+    Args:
+        sources (list): Raw bytes, paths or binary file objects.
+        out (np.ndarray): Optional preallocated buffer with at least
+                          len(sources) rows; allocated if not given.
+        target_size (tuple): Output (width, height).
+        executor: Optional concurrent.futures executor to decode in parallel.
+
+    Returns:
+        tuple: (batch, errors) where errors[i] is None for rows that decoded
+               and an error message for rows that did not (those rows are zeroed).
+    """
+    if out is None:
+        out = allocate_batch(len(sources), target_size)
+
+    def decode_row(i):
+        try:
+            decode_into(sources[i], out[i], target_size)
+            return None
+        except Exception as e:
+            out[i] = 0.0
+            return f"Could not decode image ({e})"
+
+    rows = range(len(sources))
+    errors = list(executor.map(decode_row, rows)) if executor is not None else [decode_row(i) for i in rows]
+    return out[:len(sources)], errors
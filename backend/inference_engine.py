@@ -0,0 +1,256 @@
+import threading
+import queue
+import time
+from collections import deque
+
+import numpy as np
+
+
+class _PendingRequest:
+    __slots__ = ('images', 'enqueued_at', 'done', 'outputs', 'error')
+
+    def __init__(self, images):
+        self.images = images
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.outputs = None
+        self.error = None
+
+
+class BatchingInferenceEngine:
+    """
+    Coalesces concurrent inference requests into batched forward passes of the
+    multi-task soil model.
+
+    Callers block in predict() while a single worker thread groups queued
+    requests until either max_batch_size images are waiting or the oldest
+    request has waited max_wait_ms. The batch is run through the model once
+    and the soil-type and pH outputs are split back to each caller. A
+    request that finds the engine idle and nothing else queued runs at once,
+    so batching only adds latency when there is load to batch.
+
+    Batches are padded up to the next power of two (capped at max_batch_size)
+    so the model only ever sees a small, fixed set of input shapes.
+
+    Args:
+        model: A loaded Keras model returning [soil_type_output, pH_output],
+               optionally followed by extra outputs such as the embedding.
+        max_batch_size (int): Maximum number of images per forward pass.
+        max_wait_ms (float): How long the oldest queued request may wait for
+                             more requests to join its batch.
+        input_shape (tuple): Shape of a single preprocessed image.
+        wait_samples (int): Number of recent queue-wait samples kept for
+                            percentile reporting.
+    """
+
+    def __init__(self, model, max_batch_size=16, max_wait_ms=10, input_shape=(224, 224, 3), wait_samples=2048):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.input_shape = tuple(input_shape)
+        self.batch_sizes = self._bucket_sizes(max_batch_size)
+
+        self._queue = queue.Queue()
+        self._buffer = np.zeros((max_batch_size,) + self.input_shape, dtype='float32')
+        self._thread = None
+        self._running = False
+        # When the last forward pass finished; requests queued after it found the engine idle.
+        self._idle_since = 0.0
+
+        self._stats_lock = threading.Lock()
+        self._batch_histogram = {}
+        self._requests_served = 0
+        self._images_served = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._recent_waits = deque(maxlen=wait_samples)
+
+    @staticmethod
+    def _bucket_sizes(max_batch_size):
+        sizes = []
+        size = 1
+        while size < max_batch_size:
+            sizes.append(size)
+            size *= 2
+        sizes.append(max_batch_size)
+        return sizes
+
+    def _bucket_for(self, n):
+        for size in self.batch_sizes:
+            if size >= n:
+                return size
+        return self.max_batch_size
+
+    def warmup(self):
+        """
+        Runs one synthetic batch through the model for every batch size the
+        engine can produce, so graph tracing happens before real requests
+        arrive. Must be called before start().
+        """
+        for size in self.batch_sizes:
+            started_at = time.perf_counter()
+            self.model.predict_on_batch(np.zeros((size,) + self.input_shape, dtype='float32'))
+            print(f"  Warmup batch of {size}: {(time.perf_counter() - started_at) * 1000:.1f} ms")
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='inference-engine', daemon=True)
+        self._thread.start()
+        print(f"Inference engine started (max batch {self.max_batch_size}, max wait {self.max_wait * 1000:.1f} ms).")
+        return self
+
+    def stop(self, timeout=None):
+        if not self._running:
+            return
+        self._running = False
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def predict(self, images, timeout=None):
+        """
+        Runs a batch of preprocessed images through the model, sharing the
+        forward pass with any other requests queued at the same time.
+
+        Args:
+            images (np.ndarray): float32 array of shape (n, *input_shape).
+            timeout (float): Optional number of seconds to wait for a result.
+
+        Returns:
+            tuple: One array per model output, one row per image:
+                   (soil_type_predictions, pH_predictions) for the plain
+                   model, followed by any extra outputs such as embeddings.
+        """
+        if not self._running:
+            raise RuntimeError("Inference engine is not running.")
+        images = np.asarray(images, dtype='float32')
+        if images.ndim == len(self.input_shape):
+            images = np.expand_dims(images, axis=0)
+
+        pending = _PendingRequest(images)
+        self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            raise TimeoutError("Timed out waiting for model inference.")
+        if pending.error is not None:
+            raise pending.error
+        return pending.outputs
+
+    def _run(self):
+        while self._running:
+            first = self._queue.get()
+            if first is None:
+                break
+
+            batch = [first]
+            queued_images = len(first.images)
+            if first.enqueued_at >= self._idle_since and self._queue.empty():
+                # Nothing to batch with: waiting would only add latency.
+                self._process(batch)
+                continue
+            deadline = first.enqueued_at + self.max_wait
+            while queued_images < self.max_batch_size:
+                # Requests already queued always join, even once the deadline has passed.
+                remaining = deadline - time.perf_counter()
+                try:
+                    pending = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if pending is None:
+                    self._running = False
+                    break
+                batch.append(pending)
+                queued_images += len(pending.images)
+
+            self._process(batch)
+
+        # Fail anything still queued so no caller blocks forever after stop().
+        while True:
+            try:
+                pending = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if pending is not None:
+                pending.error = RuntimeError("Inference engine stopped.")
+                pending.done.set()
+
+    def _process(self, batch):
+        started_at = time.perf_counter()
+        try:
+            images = batch[0].images if len(batch) == 1 else np.concatenate([p.images for p in batch])
+            chunks = [
+                self._forward(images[start:start + self.max_batch_size])
+                for start in range(0, len(images), self.max_batch_size)
+            ]
+            outputs = chunks[0] if len(chunks) == 1 else tuple(np.concatenate(parts) for parts in zip(*chunks))
+
+            offset = 0
+            for pending in batch:
+                n = len(pending.images)
+                pending.outputs = tuple(output[offset:offset + n] for output in outputs)
+                offset += n
+        except Exception as e:
+            for pending in batch:
+                pending.error = e
+
+        with self._stats_lock:
+            for pending in batch:
+                wait = started_at - pending.enqueued_at
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+                self._recent_waits.append(wait)
+                self._requests_served += 1
+                self._images_served += len(pending.images)
+
+        self._idle_since = time.perf_counter()
+        for pending in batch:
+            pending.done.set()
+
+    def _forward(self, chunk):
+        n = len(chunk)
+        bucket = self._bucket_for(n)
+        batch_input = self._buffer[:bucket]
+        batch_input[:n] = chunk
+        if bucket > n:
+            batch_input[n:] = 0.0
+
+        outputs = self.model.predict_on_batch(batch_input)
+
+        with self._stats_lock:
+            self._batch_histogram[n] = self._batch_histogram.get(n, 0) + 1
+        return tuple(np.asarray(output)[:n].copy() for output in outputs)
+
+    def stats(self):
+        """
+        Returns a JSON-serializable snapshot of batch sizes and queue waits.
+        """
+        with self._stats_lock:
+            waits = np.array(self._recent_waits, dtype='float64') * 1000.0
+            histogram = dict(sorted(self._batch_histogram.items()))
+            requests_served = self._requests_served
+            images_served = self._images_served
+            wait_total = self._wait_total
+            wait_max = self._wait_max
+
+        forward_passes = sum(histogram.values())
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self._queue.qsize(),
+            "requests_served": requests_served,
+            "images_served": images_served,
+            "forward_passes": forward_passes,
+            "mean_batch_size": round(images_served / forward_passes, 2) if forward_passes else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in histogram.items()},
+            "queue_wait_ms": {
+                "mean": round(wait_total * 1000.0 / requests_served, 3) if requests_served else 0.0,
+                "max": round(wait_max * 1000.0, 3),
+                "p50": round(float(np.percentile(waits, 50)), 3) if waits.size else 0.0,
+                "p95": round(float(np.percentile(waits, 95)), 3) if waits.size else 0.0,
+                "p99": round(float(np.percentile(waits, 99)), 3) if waits.size else 0.0,
+            },
+        }
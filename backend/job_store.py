@@ -0,0 +1,204 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+FINISHED_STATES = (JOB_DONE, JOB_FAILED)
+
+
+# Version of the tables below; older job databases are recreated on open.
+SCHEMA_VERSION = 2
+
+
+class JobStore:
+    """
+    SQLite-backed store of analysis jobs and their results, so clients can
+    poll for them from any worker process and results survive a restart.
+
+    Every store instance (one per worker process) has a random owner token
+    and records a heartbeat for it every heartbeat_seconds on a background
+    thread. Jobs are owned by the instance that created them; queued or
+    running jobs whose owner has not sent a heartbeat for stale_seconds
+    (a crash or restart) are marked failed. Process IDs are not used, since
+    they are reused after a restart.
+
+    Results are stored one row per image as chunks finish. Jobs of any state
+    are deleted ttl_seconds after their last update.
+
+    Args:
+        db_path (str): SQLite file holding the jobs.
+        ttl_seconds (float): How long jobs are kept after their last update.
+        heartbeat_seconds (float): Heartbeat interval; 0 disables the thread.
+        stale_seconds (float): Heartbeat age after which an owner is
+                               considered gone (default: 4 heartbeats).
+    """
+
+    def __init__(self, db_path, ttl_seconds=24 * 3600, heartbeat_seconds=30, stale_seconds=None):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_seconds = stale_seconds if stale_seconds is not None else 4 * heartbeat_seconds
+        self.owner = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        if self._db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self._db.execute("DROP TABLE IF EXISTS jobs")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, state TEXT NOT NULL, total INTEGER NOT NULL, processed INTEGER NOT NULL, "
+            "failed INTEGER NOT NULL, chart_mode TEXT NOT NULL, error TEXT, owner TEXT NOT NULL, "
+            "created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS job_results ("
+            "job_id TEXT NOT NULL, position INTEGER NOT NULL, result TEXT NOT NULL, PRIMARY KEY (job_id, position))"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS job_owners (owner TEXT PRIMARY KEY, heartbeat REAL NOT NULL)")
+        self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._db.commit()
+        self.beat()
+        self.recover_orphaned()
+        self.delete_expired()
+        if heartbeat_seconds > 0:
+            threading.Thread(target=self._run, name='job-store-heartbeat', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.heartbeat_seconds)
+            try:
+                self.beat()
+                self.recover_orphaned()
+            except Exception as e:
+                print(f"ERROR: Job store heartbeat failed: {e}")
+
+    def beat(self):
+        """
+        Records that this instance is alive.
+        """
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO job_owners VALUES (?, ?)", (self.owner, time.time()))
+            self._db.commit()
+
+    def recover_orphaned(self):
+        """
+        Marks queued or running jobs of owners without a recent heartbeat as
+        failed, and forgets those owners. Returns the number of jobs failed.
+        """
+        cutoff = time.time() - self.stale_seconds
+        with self._lock:
+            orphaned = self._db.execute(
+                "UPDATE jobs SET state = ?, error = ?, updated = ? WHERE state IN (?, ?) AND owner != ? "
+                "AND owner NOT IN (SELECT owner FROM job_owners WHERE heartbeat >= ?)",
+                (JOB_FAILED, "The server restarted before the job finished. Please resubmit.", time.time(),
+                 JOB_QUEUED, JOB_RUNNING, self.owner, cutoff)
+            ).rowcount
+            self._db.execute("DELETE FROM job_owners WHERE heartbeat < ? AND owner != ?", (cutoff, self.owner))
+            self._db.commit()
+        if orphaned:
+            print(f"Marked {orphaned} interrupted jobs as failed.")
+        return orphaned
+
+    def delete_expired(self):
+        """
+        Deletes jobs (finished or not) and their results ttl_seconds after
+        their last update. Returns the number of jobs deleted.
+        """
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM job_results WHERE job_id IN (SELECT id FROM jobs WHERE updated < ?)", (cutoff,)
+            )
+            deleted = self._db.execute("DELETE FROM jobs WHERE updated < ?", (cutoff,)).rowcount
+            self._db.commit()
+        return deleted
+
+    def create(self, total, chart_mode):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, state, total, processed, failed, chart_mode, error, owner, created, updated) "
+                "VALUES (?, ?, ?, 0, 0, ?, NULL, ?, ?, ?)",
+                (job_id, JOB_QUEUED, total, chart_mode, self.owner, now, now)
+            )
+            self._db.commit()
+        return job_id
+
+    def update(self, job_id, state, error=None):
+        """
+        Stores the job's state.
+        """
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = ?, error = ?, updated = ? WHERE id = ?", (state, error, time.time(), job_id)
+            )
+            self._db.commit()
+
+    def append_results(self, job_id, results):
+        """
+        Appends one chunk of results after those already stored and advances
+        the job's progress. Earlier results are not rewritten.
+        """
+        failed = sum(1 for result in results if "error" in result)
+        with self._lock:
+            row = self._db.execute("SELECT processed FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            self._db.executemany(
+                "INSERT OR REPLACE INTO job_results (job_id, position, result) VALUES (?, ?, ?)",
+                [(job_id, row[0] + i, json.dumps(result)) for i, result in enumerate(results)]
+            )
+            self._db.execute(
+                "UPDATE jobs SET processed = processed + ?, failed = failed + ?, updated = ? WHERE id = ?",
+                (len(results), failed, time.time(), job_id)
+            )
+            self._db.commit()
+
+    def get(self, job_id, include_results=True):
+        """
+        Returns the job as a dict, or None if it is unknown or has expired.
+        The results list is only read when include_results is set.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, state, total, processed, failed, chart_mode, error, created, updated "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is not None and include_results:
+                results = [
+                    json.loads(result) for (result,) in self._db.execute(
+                        "SELECT result FROM job_results WHERE job_id = ? ORDER BY position", (job_id,)
+                    )
+                ]
+        if row is None:
+            return None
+        job_id, state, total, processed, failed, chart_mode, error, created, updated = row
+        job = {
+            "job_id": job_id,
+            "state": state,
+            "total": total,
+            "processed": processed,
+            "succeeded": processed - failed,
+            "failed": failed,
+            "progress": round(processed / total, 4) if total else 1.0,
+            "chart_mode": chart_mode,
+            "created": created,
+            "updated": updated,
+            "error": error,
+        }
+        if include_results:
+            job["results"] = results
+        if state in FINISHED_STATES:
+            job["expires_at"] = updated + self.ttl_seconds
+        return job
+
+    def stats(self):
+        with self._lock:
+            rows = self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
@@ -0,0 +1,221 @@
+"""
+Low-overhead request metrics in the Prometheus text exposition format.
+
+Counters and histograms are plain dicts of numbers behind a lock, so
+recording a sample costs a dict lookup and a bisect; nothing is formatted
+until /metrics is scraped. Each process keeps its own metrics, so under
+serve.py every gunicorn worker reports only the requests it handled.
+
+RequestTimer collects the per-stage timings of one request. Requests can
+optionally be profiled with cProfile: a sampled fraction of them run under
+the profiler, and the profile is written to disk only if the request turned
+out to be slow.
+"""
+import bisect
+import cProfile
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds. Covers fast cached responses up to slow batch requests.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = []
+    for name, value in zip(labelnames, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # One count per bucket plus +Inf, then the sum.
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        with self._lock:
+            snapshot = sorted((key, list(series)) for key, series in self._series.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames + ('le',), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    Holds metrics and collector callbacks and renders them for /metrics.
+    Collectors return (name, type, documentation, {label tuple: value},
+    labelnames) tuples for values that are owned elsewhere, such as the
+    prediction cache's hit counts.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                collected = collector()
+            except Exception as e:
+                print(f"WARNING: Metrics collector {collector.__name__} failed: {e}")
+                continue
+            for name, metric_type, documentation, values, labelnames in collected:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for key, value in sorted(values.items()):
+                    lines.append(f"{name}{_format_labels(labelnames, key)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+class RequestTimer:
+    """
+    Times the stages of one request and, when sampled, profiles it.
+
+    Args:
+        stage_histogram (Histogram): Receives one observation per stage,
+                                     labelled with endpoint and stage.
+        endpoint (str): Label identifying the route.
+        profile (bool): Run the request under cProfile.
+    """
+
+    def __init__(self, stage_histogram, endpoint, profile=False):
+        self.stage_histogram = stage_histogram
+        self.endpoint = endpoint
+        self.started_at = time.perf_counter()
+        self.stages = {}
+        self.profiler = None
+        if profile:
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # Another profiler is active in this process.
+                self.profiler = None
+
+    @contextmanager
+    def stage(self, name):
+        stage_started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - stage_started_at)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.stage_histogram.observe(seconds, endpoint=self.endpoint, stage=name)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    def finish_profile(self, profile_dir, slow_seconds):
+        """
+        Stops the profiler and, if the request took at least slow_seconds,
+        writes the profile to profile_dir. Returns the file path or None.
+        """
+        if self.profiler is None:
+            return None
+        self.profiler.disable()
+        elapsed = self.elapsed()
+        if elapsed < slow_seconds:
+            return None
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(
+            profile_dir,
+            f"{time.strftime('%Y%m%d%H%M%S')}_{self.endpoint}_{elapsed * 1000.0:.0f}ms_{os.getpid()}.prof"
+        )
+        self.profiler.dump_stats(path)
+        return path
+
+
+class ProfileSampler:
+    """
+    Decides which requests run under cProfile. Only one request per process
+    is profiled at a time, since cProfile is per-thread and costly.
+    """
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return False
+        return self._lock.acquire(blocking=False)
+
+    def release(self):
+        self._lock.release()
@@ -0,0 +1,241 @@
+"""
+A directory of versioned model artifacts that the server can hot-reload.
+
+Layout:
+
+    model_registry/
+        CURRENT                     name of the version to serve
+        20261018-103000/
+            model.h5                Keras model
+            model.tflite            TFLite export for MODEL_BACKEND=tflite (added by export_tflite.py)
+            classes.txt             class names, one per line, in output order
+            metadata.json           version, creation time, training settings and metrics
+        20261019-091500/
+            ...
+
+train_model.py publishes a new version with publish_model(), and
+`python export_tflite.py --registry-version VERSION` adds its TFLite file. Each version is
+written to a temporary folder and renamed into place, and CURRENT is replaced
+atomically last, so a watching server never sees a partially written
+version. Rolling back is a matter of writing an older version name to
+CURRENT (see `python model_registry.py --help`).
+"""
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from collections import namedtuple
+
+REGISTRY_DIR = 'model_registry'
+CURRENT_FILE = 'CURRENT'
+MODEL_FILENAMES = {'keras': 'model.h5', 'tflite': 'model.tflite'}
+CLASSES_FILENAME = 'classes.txt'
+METADATA_FILENAME = 'metadata.json'
+
+# One loaded model version: everything a request needs, swapped as a unit.
+ServedModel = namedtuple('ServedModel', ['version', 'model', 'engine', 'classes', 'rules', 'embeddings', 'model_path', 'metadata'])
+
+
+def _write_atomic(path, text):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def list_versions(registry_dir=REGISTRY_DIR):
+    if not os.path.isdir(registry_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(registry_dir)
+        if not name.startswith('.') and os.path.isfile(os.path.join(registry_dir, name, METADATA_FILENAME))
+    )
+
+
+def current_version(registry_dir=REGISTRY_DIR):
+    """
+    Returns the version named in CURRENT, or the newest version if CURRENT is
+    missing, or None if the registry is empty.
+    """
+    try:
+        with open(os.path.join(registry_dir, CURRENT_FILE), 'r') as f:
+            version = f.read().strip()
+        if version:
+            return version
+    except OSError:
+        pass
+    versions = list_versions(registry_dir)
+    return versions[-1] if versions else None
+
+
+def set_current_version(version, registry_dir=REGISTRY_DIR):
+    if version not in list_versions(registry_dir):
+        raise ValueError(f"Unknown model version '{version}' in '{registry_dir}'.")
+    _write_atomic(os.path.join(registry_dir, CURRENT_FILE), version + '\n')
+
+
+def version_files(version, registry_dir=REGISTRY_DIR, backend='keras'):
+    """
+    Returns (model_path, classes_path, metadata) for a published version.
+    """
+    version_dir = os.path.join(registry_dir, version)
+    with open(os.path.join(version_dir, METADATA_FILENAME), 'r') as f:
+        metadata = json.load(f)
+    return (
+        os.path.join(version_dir, MODEL_FILENAMES[backend]),
+        os.path.join(version_dir, CLASSES_FILENAME),
+        metadata
+    )
+
+
+def has_model_file(version, registry_dir=REGISTRY_DIR, backend='keras'):
+    return os.path.isfile(os.path.join(registry_dir, version, MODEL_FILENAMES[backend]))
+
+
+def add_model_file(version, backend, source_path, details=None, registry_dir=REGISTRY_DIR):
+    """
+    Copies an exported model file (e.g. a TFLite conversion of the version's
+    Keras model) into a published version, so servers using that backend can
+    load the version, and records it under "exports" in its metadata.
+
+    Args:
+        version (str): A published version.
+        backend (str): Key of MODEL_FILENAMES the file is for.
+        source_path (str): The exported model file.
+        details (dict): Extra information to record (e.g. the quantization).
+        registry_dir (str): The registry folder.
+    """
+    if version not in list_versions(registry_dir):
+        raise ValueError(f"Unknown model version '{version}' in '{registry_dir}'.")
+    version_dir = os.path.join(registry_dir, version)
+    target_path = os.path.join(version_dir, MODEL_FILENAMES[backend])
+    tmp_path = f"{target_path}.{os.getpid()}.tmp"
+    shutil.copyfile(source_path, tmp_path)
+    os.replace(tmp_path, target_path)
+
+    metadata_path = os.path.join(version_dir, METADATA_FILENAME)
+    with open(metadata_path, 'r') as f:
+        metadata = json.load(f)
+    metadata.setdefault("exports", {})[backend] = dict(details or {}, created=time.time())
+    _write_atomic(metadata_path, json.dumps(metadata, indent=2))
+
+
+def publish_model(model, class_names, metadata=None, registry_dir=REGISTRY_DIR, make_current=True):
+    """
+    Saves a trained Keras model, its class names and metadata as a new
+    version and (by default) makes it the one servers load.
+
+    Args:
+        model: The trained Keras model.
+        class_names (list): Class names in the order of the soil type output.
+        metadata (dict): Extra information to record (training settings,
+                         metrics, dataset).
+        registry_dir (str): The registry folder.
+        make_current (bool): Point CURRENT at the new version.
+
+    Returns:
+        str: The new version name.
+    """
+    os.makedirs(registry_dir, exist_ok=True)
+    version = time.strftime('%Y%m%d-%H%M%S')
+    suffix = 1
+    while os.path.exists(os.path.join(registry_dir, version)):
+        version = f"{time.strftime('%Y%m%d-%H%M%S')}-{suffix}"
+        suffix += 1
+
+    tmp_dir = os.path.join(registry_dir, f".tmp-{version}")
+    os.makedirs(tmp_dir)
+    try:
+        model.save(os.path.join(tmp_dir, MODEL_FILENAMES['keras']))
+        with open(os.path.join(tmp_dir, CLASSES_FILENAME), 'w') as f:
+            for class_name in class_names:
+                f.write(f"{class_name}\n")
+        with open(os.path.join(tmp_dir, METADATA_FILENAME), 'w') as f:
+            json.dump(dict(metadata or {}, version=version, created=time.time(), class_names=list(class_names)),
+                      f, indent=2)
+        os.rename(tmp_dir, os.path.join(registry_dir, version))
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    if make_current:
+        set_current_version(version, registry_dir)
+    return version
+
+
+class RegistryWatcher:
+    """
+    Polls for the model version that should be served and calls
+    on_change(version) from a background thread whenever it differs from the
+    version being served. A version that fails to load is not retried until
+    the wanted version changes again.
+
+    Args:
+        get_wanted_version (callable): Returns the version to serve, e.g. the
+                                       registry's CURRENT version.
+        get_served_version (callable): Returns the version currently served.
+        on_change (callable): Loads and swaps in the given version; returns
+                              True on success.
+        interval (float): Seconds between polls.
+    """
+
+    def __init__(self, get_wanted_version, get_served_version, on_change, interval=10.0):
+        self.get_wanted_version = get_wanted_version
+        self.get_served_version = get_served_version
+        self.on_change = on_change
+        self.interval = interval
+        self._failed_version = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='model-registry-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def check(self):
+        version = self.get_wanted_version()
+        if version is None or version == self.get_served_version() or version == self._failed_version:
+            return False
+        if self.on_change(version):
+            self._failed_version = None
+            return True
+        self._failed_version = version
+        return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"ERROR: Model registry check failed: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List model versions or choose the one servers load.")
+    parser.add_argument('--registry', default=REGISTRY_DIR, help=f"Registry folder (default: {REGISTRY_DIR}).")
+    parser.add_argument('--set-current', default=None, metavar='VERSION',
+                        help="Serve this version (running servers switch to it on their next poll).")
+    args = parser.parse_args()
+
+    if args.set_current:
+        set_current_version(args.set_current, args.registry)
+        print(f"CURRENT is now '{args.set_current}'.")
+
+    current = current_version(args.registry)
+    versions = list_versions(args.registry)
+    if not versions:
+        print(f"No model versions in '{args.registry}'.")
+    for version in versions:
+        _, _, metadata = version_files(version, args.registry)
+        created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(metadata.get('created', 0)))
+        backends = ','.join(backend for backend in MODEL_FILENAMES if has_model_file(version, args.registry, backend))
+        print(f"{'*' if version == current else ' '} {version}  created {created}  backends {backends}  "
+              f"classes {len(metadata.get('class_names', []))}  metrics {metadata.get('metrics', {})}")
@@ -0,0 +1,364 @@
+"""
+Packs a class-folder image dataset (e.g. Dataset/Train) into pre-resized,
+memory-mapped NumPy shards, and reads them back for training.
+
+Layout of a packed directory:
+    manifest.json      class names, image size, generation, and the names of
+                       the index and shard files
+    index.npz          one row per packed image: path (relative to the dataset
+                       root), label, pH (NaN when unknown), file size, mtime,
+                       shard number, row in that shard and an 'active' flag
+    shard_00000.npy    uint8 array of shape (n, 224, 224, 3)
+
+Compaction and repacking write a new generation (index_g1.npz,
+shard_g1_00000.npy, ...) next to the current one. Replacing manifest.json is
+the commit point; files of older generations are deleted only after that, so
+an interrupted run always leaves a consistent manifest, index and shard set.
+
+Re-running the packer only decodes files that are new or changed since the
+last run. Files that were removed or quarantined are marked inactive instead
+of rewriting their shard; shards are compacted once too many rows are
+inactive, or when --compact is given.
+
+Usage (from the 'backend' folder):
+
+    python packed_dataset.py                                  # ../Dataset/Train -> ../Dataset/packed/Train
+    python packed_dataset.py --dataset ../Dataset/test --output ../Dataset/packed/test
+    python packed_dataset.py --compact
+
+Train from the packed copy with:
+
+    python train_model.py --packed ../Dataset/packed/Train
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dataset_files import iter_image_files
+from image_preprocessing import IMG_HEIGHT, IMG_WIDTH, load_rgb
+
+DATASET_DIR = '../Dataset/Train'
+PACKED_DIR = '../Dataset/packed/Train'
+MANIFEST_FILENAME = 'manifest.json'
+INDEX_FILENAME = 'index.npz'
+SHARD_SIZE = 512
+COMPACT_THRESHOLD = 0.3  # compact once this fraction of packed rows is inactive
+FORMAT_VERSION = 1
+
+INDEX_FIELDS = {
+    'path': str,
+    'label': 'int32',
+    'pH': 'float32',
+    'size': 'int64',
+    'mtime_ns': 'int64',
+    'shard': 'int32',
+    'row': 'int32',
+    'active': bool,
+}
+
+
+def _empty_index():
+    return {name: np.array([], dtype=dtype) for name, dtype in INDEX_FIELDS.items()}
+
+
+def _shard_filename(shard_number, generation=0):
+    if generation == 0:
+        return f"shard_{shard_number:05d}.npy"
+    return f"shard_g{generation}_{shard_number:05d}.npy"
+
+
+def _index_filename(generation=0):
+    if generation == 0:
+        return INDEX_FILENAME
+    return f"index_g{generation}.npz"
+
+
+def _new_manifest(dataset_dir, class_names, generation=0):
+    return {
+        'format_version': FORMAT_VERSION,
+        'dataset_dir': os.path.abspath(dataset_dir),
+        'class_names': class_names,
+        'image_size': [IMG_HEIGHT, IMG_WIDTH],
+        'generation': generation,
+        'index_file': _index_filename(generation),
+        'shards': [],
+    }
+
+
+def _decode_for_pack(path):
+    try:
+        return np.asarray(load_rgb(path, (IMG_WIDTH, IMG_HEIGHT)), dtype=np.uint8), None
+    except Exception as e:
+        return None, str(e)
+
+
+def scan_dataset(dataset_dir):
+    """
+    Returns (class_names, {relative path: (label, size, mtime_ns)}) for every
+    image in the class-folder layout under dataset_dir.
+    """
+    class_names = sorted(
+        name for name in os.listdir(dataset_dir)
+        if os.path.isdir(os.path.join(dataset_dir, name))
+    )
+    files = {}
+    for label, class_name in enumerate(class_names):
+        for path in iter_image_files(os.path.join(dataset_dir, class_name)):
+            st = os.stat(path)
+            files[os.path.relpath(path, dataset_dir)] = (label, st.st_size, st.st_mtime_ns)
+    return class_names, files
+
+
+def _write_shard(output_dir, shard_number, images, generation=0):
+    final_path = os.path.join(output_dir, _shard_filename(shard_number, generation))
+    tmp_path = final_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, images)
+    os.replace(tmp_path, final_path)
+
+
+def _save_index(output_dir, manifest, index):
+    """
+    Writes the index, then the manifest that names it. The manifest is
+    replaced last, so a reader never sees a manifest without its index.
+    """
+    index_file = manifest.get('index_file', INDEX_FILENAME)
+    tmp_index = os.path.join(output_dir, index_file + '.tmp')
+    with open(tmp_index, 'wb') as f:
+        np.savez(f, **index)
+    os.replace(tmp_index, os.path.join(output_dir, index_file))
+
+    tmp_manifest = os.path.join(output_dir, MANIFEST_FILENAME + '.tmp')
+    with open(tmp_manifest, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_manifest, os.path.join(output_dir, MANIFEST_FILENAME))
+
+
+def _load_index(output_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None, None
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    index_path = os.path.join(output_dir, manifest.get('index_file', INDEX_FILENAME))
+    if not os.path.exists(index_path):
+        return None, None
+    with np.load(index_path) as data:
+        index = {name: data[name] for name in INDEX_FIELDS}
+    # Rows of a shard the manifest does not list yet (a run stopped between
+    # saving the index and the manifest) are dropped; that shard is repacked.
+    listed = index['shard'] < len(manifest['shards'])
+    if not listed.all():
+        index = {name: values[listed] for name, values in index.items()}
+    return manifest, index
+
+
+def _remove_unreferenced(output_dir, manifest):
+    """
+    Deletes index and shard files the manifest does not name: older
+    generations, and leftovers of an interrupted compaction.
+    """
+    keep = {manifest.get('index_file', INDEX_FILENAME)} | {shard['file'] for shard in manifest['shards']}
+    for filename in os.listdir(output_dir):
+        is_packed_file = (
+            (filename.startswith('shard_') and filename.endswith('.npy'))
+            or (filename.startswith('index') and filename.endswith('.npz'))
+        )
+        if is_packed_file and filename not in keep:
+            os.remove(os.path.join(output_dir, filename))
+
+
+def _append_rows(index, rows):
+    for name, dtype in INDEX_FIELDS.items():
+        index[name] = np.concatenate([index[name], np.array([row[name] for row in rows], dtype=dtype)])
+
+
+def _pack_files(dataset_dir, output_dir, manifest, index, relpaths, files, workers):
+    """
+    Decodes relpaths in parallel and appends them to the packed set in new shards.
+    """
+    failed = 0
+    generation = manifest.get('generation', 0)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for start in range(0, len(relpaths), SHARD_SIZE):
+            chunk = relpaths[start:start + SHARD_SIZE]
+            full_paths = [os.path.join(dataset_dir, relpath) for relpath in chunk]
+            images = []
+            rows = []
+            shard_number = len(manifest['shards'])
+            for relpath, (img, error) in zip(chunk, executor.map(_decode_for_pack, full_paths, chunksize=16)):
+                if error is not None:
+                    print(f"  Skipping unreadable file {relpath}: {error}")
+                    failed += 1
+                    continue
+                label, size, mtime_ns = files[relpath]
+                rows.append({
+                    'path': relpath, 'label': label, 'pH': np.nan, 'size': size, 'mtime_ns': mtime_ns,
+                    'shard': shard_number, 'row': len(images), 'active': True,
+                })
+                images.append(img)
+            if not images:
+                continue
+            _write_shard(output_dir, shard_number, np.stack(images), generation)
+            manifest['shards'].append({'file': _shard_filename(shard_number, generation), 'count': len(images)})
+            _append_rows(index, rows)
+            # Save after every shard so an interrupted run keeps what it packed.
+            _save_index(output_dir, manifest, index)
+            print(f"  Wrote {_shard_filename(shard_number, generation)} ({len(images)} images, {start + len(chunk)}/{len(relpaths)})")
+    finally:
+        executor.shutdown()
+    return failed
+
+
+def compact(output_dir):
+    """
+    Rewrites the shards so they only contain active rows. The compacted shards
+    and index are written as a new generation and the manifest is switched to
+    them before the old files are deleted.
+    """
+    manifest, index = _load_index(output_dir)
+    if manifest is None:
+        print(f"Nothing to compact in '{output_dir}'.")
+        return
+    active = np.flatnonzero(index['active'])
+    old_shards = [np.load(os.path.join(output_dir, shard['file']), mmap_mode='r') for shard in manifest['shards']]
+
+    generation = manifest.get('generation', 0) + 1
+    new_index = {name: index[name][active] for name in INDEX_FIELDS}
+    new_shards = []
+    for shard_number, start in enumerate(range(0, len(active), SHARD_SIZE)):
+        rows = active[start:start + SHARD_SIZE]
+        images = np.stack([old_shards[index['shard'][i]][index['row'][i]] for i in rows])
+        _write_shard(output_dir, shard_number, images, generation)
+        new_shards.append({'file': _shard_filename(shard_number, generation), 'count': len(rows)})
+        new_index['shard'][start:start + len(rows)] = shard_number
+        new_index['row'][start:start + len(rows)] = np.arange(len(rows))
+    del old_shards
+
+    manifest['generation'] = generation
+    manifest['index_file'] = _index_filename(generation)
+    manifest['shards'] = new_shards
+    _save_index(output_dir, manifest, new_index)
+    _remove_unreferenced(output_dir, manifest)
+    print(f"Compacted '{output_dir}': {len(active)} active images in {len(new_shards)} shards.")
+
+
+def pack_dataset(dataset_dir=DATASET_DIR, output_dir=PACKED_DIR, workers=None, force_compact=False):
+    """
+    Creates or incrementally updates the packed copy of dataset_dir in output_dir.
+
+    Args:
+        dataset_dir (str): Class-folder dataset root.
+        output_dir (str): Directory for the manifest, index and shards.
+        workers (int): Decode processes (default: core count).
+        force_compact (bool): Compact the shards even below COMPACT_THRESHOLD.
+    """
+    if not os.path.isdir(dataset_dir):
+        print(f"Error: Dataset directory '{dataset_dir}' not found.")
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    started_at = time.perf_counter()
+
+    class_names, files = scan_dataset(dataset_dir)
+    manifest, index = _load_index(output_dir)
+    if manifest is not None and manifest['class_names'] != class_names:
+        print(f"Class folders changed ({manifest['class_names']} -> {class_names}). Repacking from scratch.")
+        # The old generation stays readable until the new manifest replaces it.
+        manifest = _new_manifest(dataset_dir, class_names, manifest.get('generation', 0) + 1)
+        index = _empty_index()
+    if manifest is None:
+        manifest = _new_manifest(dataset_dir, class_names)
+        index = _empty_index()
+
+    # Deactivate rows whose file was removed, quarantined or modified.
+    packed = {}
+    removed = 0
+    for i in np.flatnonzero(index['active']):
+        relpath = str(index['path'][i])
+        current = files.get(relpath)
+        if current is None or current[1] != index['size'][i] or current[2] != index['mtime_ns'][i]:
+            index['active'][i] = False
+            removed += 1
+        else:
+            packed[relpath] = i
+    to_add = [relpath for relpath in sorted(files) if relpath not in packed]
+
+    print(f"--- Packing {dataset_dir} into {output_dir} ---")
+    print(f"  {len(packed)} images already packed, {len(to_add)} to add, {removed} removed or changed.")
+    failed = 0
+    if to_add:
+        failed = _pack_files(dataset_dir, output_dir, manifest, index, to_add, files, workers)
+    _save_index(output_dir, manifest, index)
+    _remove_unreferenced(output_dir, manifest)
+
+    inactive_share = 1.0 - index['active'].mean() if len(index['active']) else 0.0
+    if force_compact or inactive_share > COMPACT_THRESHOLD:
+        compact(output_dir)
+
+    print(f"--- Packing complete in {time.perf_counter() - started_at:.1f}s: "
+          f"{int(index['active'].sum())} active images, {failed} unreadable files skipped ---")
+
+
+class PackedDataset:
+    """
+    Read access to a packed dataset. Shards are memory-mapped, so opening is
+    cheap and only the rows actually read are paged in.
+
+    Attributes:
+        class_names (list): Class names in label order.
+        paths (np.ndarray): Relative paths of the active images.
+        labels (np.ndarray): Integer labels of the active images.
+        pH (np.ndarray): pH values of the active images (NaN when unknown).
+    """
+
+    def __init__(self, packed_dir=PACKED_DIR):
+        manifest, index = _load_index(packed_dir)
+        if manifest is None:
+            raise FileNotFoundError(f"No packed dataset found in '{packed_dir}'. Run packed_dataset.py first.")
+        self.packed_dir = packed_dir
+        self.class_names = manifest['class_names']
+        self.image_size = tuple(manifest['image_size'])
+        self._shards = [np.load(os.path.join(packed_dir, shard['file']), mmap_mode='r') for shard in manifest['shards']]
+
+        active = index['active']
+        self.paths = index['path'][active]
+        self.labels = index['label'][active]
+        self.pH = index['pH'][active]
+        self._shard_of = index['shard'][active]
+        self._row_of = index['row'][active]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def get_batch(self, indices):
+        """
+        Returns the uint8 images for the given active-row indices, shape
+        (len(indices), height, width, 3). Rows are gathered shard by shard.
+        """
+        indices = np.asarray(indices)
+        out = np.empty((len(indices),) + self.image_size + (3,), dtype=np.uint8)
+        shard_of = self._shard_of[indices]
+        row_of = self._row_of[indices]
+        for shard_number in np.unique(shard_of):
+            positions = np.flatnonzero(shard_of == shard_number)
+            rows = row_of[positions]
+            # Sorted reads keep memory-mapped access sequential.
+            order = np.argsort(rows)
+            out[positions[order]] = self._shards[shard_number][rows[order]]
+        return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack a class-folder image dataset into memory-mapped shards.")
+    parser.add_argument('--dataset', default=DATASET_DIR, help=f"Dataset root (default: {DATASET_DIR}).")
+    parser.add_argument('--output', default=PACKED_DIR, help=f"Packed output directory (default: {PACKED_DIR}).")
+    parser.add_argument('--workers', type=int, default=None, help="Decode processes (default: core count).")
+    parser.add_argument('--compact', action='store_true', help="Rewrite shards to drop inactive rows.")
+    args = parser.parse_args()
+
+    pack_dataset(args.dataset, args.output, workers=args.workers, force_compact=args.compact)
@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def hash_image_bytes(img_bytes):
+    return hashlib.sha256(img_bytes).hexdigest()
+
+
+def hash_image_stream(stream, chunk_size=1024 * 1024):
+    """
+    Hashes a seekable upload stream in chunks, without holding a copy of the
+    whole upload, and rewinds it. Gives the same key as hash_image_bytes().
+    """
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def file_fingerprint(*paths):
+    """
+    Returns a short fingerprint of the given files based on their size,
+    modification time, inode and status-change time. The last two change
+    whenever a file is replaced, even by a copy that keeps the old size and
+    mtime (cp -p, rsync -t). Missing files contribute a fixed marker, so
+    creating or deleting one also changes the fingerprint.
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            st = os.stat(path)
+            digest.update(f"{path}:{st.st_size}:{st.st_mtime_ns}:{st.st_ino}:{st.st_ctime_ns};".encode())
+        except OSError:
+            digest.update(f"{path}:missing;".encode())
+    return digest.hexdigest()[:16]
+
+
+class PredictionCache:
+    """
+    Content-addressed cache of prediction results keyed by the hash of the
+    uploaded bytes and the model version.
+
+    Entries live in an in-memory LRU bounded by both entry count and the
+    approximate size of their JSON encoding. When db_path is given, entries are
+    also written to a SQLite file so they survive restarts; a memory miss then
+    falls back to disk and promotes the entry.
+
+    Entries are keyed by model version, so workers serving different versions
+    can share one SQLite file without seeing each other's results. Changing
+    the version (see set_version) only empties the in-memory LRU; rows of
+    other versions stay on disk until retire_versions() removes them or the
+    max_disk_entries limit evicts them.
+
+    Args:
+        max_entries (int): Maximum number of entries kept in memory.
+        max_bytes (int): Maximum total size of the in-memory entries.
+        db_path (str): Optional SQLite file used for persistence.
+        max_disk_entries (int): Maximum number of rows kept in the SQLite file.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024, db_path=None, max_disk_entries=100000):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_disk_entries = max_disk_entries
+        self.version = None
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._puts_since_prune = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "key TEXT PRIMARY KEY, version TEXT NOT NULL, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.commit()
+            print(f"Prediction cache persisting to '{db_path}'.")
+
+    def set_version(self, version):
+        """
+        Sets the model version new entries are stored under. If it differs from
+        the current one, the in-memory entries are dropped. Disk rows of other
+        versions are kept, since other workers may still be serving them.
+        """
+        with self._lock:
+            if version == self.version:
+                return
+            if self.version is not None:
+                print(f"Model files changed ({self.version} -> {version}). Clearing in-memory prediction cache.")
+                self.invalidations += 1
+            self.version = version
+            self._entries.clear()
+            self._bytes = 0
+
+    def versions(self):
+        """
+        Returns the model versions that have rows on disk.
+        """
+        if self._db is None:
+            return []
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT DISTINCT version FROM predictions ORDER BY version")]
+
+    def retire_versions(self, versions):
+        """
+        Deletes the disk rows of versions no worker can serve any more (e.g.
+        removed from the registry). The current version is never deleted.
+        Returns the number of rows deleted.
+        """
+        versions = [version for version in versions if version != self.version]
+        if self._db is None or not versions:
+            return 0
+        with self._lock:
+            deleted = self._db.execute(
+                f"DELETE FROM predictions WHERE version IN ({','.join('?' * len(versions))})", versions
+            ).rowcount
+            self._db.commit()
+        if deleted:
+            print(f"Removed {deleted} cached predictions of retired model versions {', '.join(versions)}.")
+        return deleted
+
+    def make_key(self, image_hash, version=None):
+        return f"{self.version if version is None else version}:{image_hash}"
+
+    def get(self, image_hash, version=None):
+        key = self.make_key(image_hash, version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(entry)
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM predictions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self.disk_hits += 1
+                    self._store(key, row[0])
+                    return json.loads(row[0])
+
+            self.misses += 1
+            return None
+
+    def put(self, image_hash, result, version=None):
+        """
+        Stores result for image_hash. If version is given and is no longer the
+        current version (the model was swapped while the request ran), the
+        result is dropped.
+        """
+        key = self.make_key(image_hash, version)
+        value = json.dumps(result)
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._store(key, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO predictions (key, version, value, created) VALUES (?, ?, ?, ?)",
+                    (key, self.version, value, time.time())
+                )
+                self._puts_since_prune += 1
+                if self._puts_since_prune >= 1000:
+                    self._prune_disk()
+                self._db.commit()
+
+    def _store(self, key, value):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = value
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def _prune_disk(self):
+        self._puts_since_prune = 0
+        self._db.execute(
+            "DELETE FROM predictions WHERE key IN ("
+            "SELECT key FROM predictions ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM predictions")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            stats = {
+                "version": self.version,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "persistent": self._db is not None,
+            }
+            if self._db is not None:
+                stats["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+        return stats
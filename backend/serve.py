@@ -0,0 +1,109 @@
+"""
+Production serving mode for the Soil Quality Monitoring backend.
+
+`python app.py` starts Flask's single-process debug server. This script
+instead runs the same Flask app under gunicorn with N worker processes. Each
+worker imports app.py, and therefore loads the model, once at startup.
+gunicorn only hands new connections to workers that are free to accept them
+and restarts any worker that crashes or stops responding.
+
+State that clients fetch in a later request (jobs, stored and lazy charts)
+is kept in SQLite or on disk in the backend folder, so whichever worker gets
+the follow-up request can answer it.
+
+TensorFlow's thread pools are sized per worker (via TF_INTRA_OP_THREADS and
+TF_INTER_OP_THREADS, read by app.py) so that N workers together do not
+oversubscribe the CPU.
+
+Usage (from the 'backend' folder, on Linux/macOS):
+
+    pip install -r requirements.txt
+    python serve.py                          # one worker per core on 0.0.0.0:5000
+    python serve.py --workers 4 --threads 8 --bind 127.0.0.1:8000
+    python serve.py --intra-op-threads 2 --inter-op-threads 1
+
+gunicorn does not run on Windows; use `python app.py` there.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args():
+    cpu_count = multiprocessing.cpu_count()
+    parser = argparse.ArgumentParser(description="Run the soil analysis backend with a pool of worker processes.")
+    parser.add_argument('--bind', default='0.0.0.0:5000', help="Address to listen on (default: 0.0.0.0:5000).")
+    parser.add_argument('--workers', type=int, default=cpu_count,
+                        help=f"Number of worker processes (default: core count, {cpu_count}).")
+    parser.add_argument('--threads', type=int, default=4,
+                        help="Request threads per worker. Concurrent requests in one worker share "
+                             "forward passes through the batching inference engine (default: 4).")
+    parser.add_argument('--intra-op-threads', type=int, default=None,
+                        help="TensorFlow intra-op threads per worker (default: cores / workers).")
+    parser.add_argument('--inter-op-threads', type=int, default=1,
+                        help="TensorFlow inter-op threads per worker (default: 1).")
+    parser.add_argument('--timeout', type=int, default=120,
+                        help="Seconds before a silent worker is killed and restarted. Must cover model "
+                             "loading when LOAD_MODEL_IN_BACKGROUND=false (default: 120).")
+    parser.add_argument('--max-requests', type=int, default=0,
+                        help="Recycle a worker after this many requests, 0 to disable (default: 0).")
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.intra_op_threads is None:
+        args.intra_op_threads = max(1, cpu_count // args.workers)
+    return args
+
+
+def main():
+    args = parse_args()
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("ERROR: gunicorn is not installed. Run 'pip install -r requirements.txt' first.")
+        sys.exit(1)
+
+    # Workers inherit these before TensorFlow is imported in each of them.
+    os.environ['TF_INTRA_OP_THREADS'] = str(args.intra_op_threads)
+    os.environ['TF_INTER_OP_THREADS'] = str(args.inter_op_threads)
+    os.environ.setdefault('OMP_NUM_THREADS', str(args.intra_op_threads))
+
+    # app.py resolves the model and class files relative to the backend folder.
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+
+    class SoilAnalysisServer(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # Runs inside each worker after the fork, so every worker loads its own model.
+            from app import app
+            return app
+
+    print(f"Starting {args.workers} workers on {args.bind} "
+          f"({args.threads} threads each, TensorFlow intra-op {args.intra_op_threads} / inter-op {args.inter_op_threads}).")
+    SoilAnalysisServer({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'timeout': args.timeout,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests // 10,
+        'preload_app': False,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
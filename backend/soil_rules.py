@@ -0,0 +1,198 @@
+"""
+Soil quality and recommendation rules, loaded from a table instead of code.
+
+soil_rules.json has one entry per soil class:
+
+    "Clay soil": {
+        "quality": "Okay",                  quality when the pH is in the ideal range
+        "quality_pH_off": "Challenging",    quality otherwise (default: same as quality)
+        "recommendations": "...",           base recommendation text
+        "pH_advice": " ... {pH} ...",       appended when the pH is off (default: the top-level pH_advice)
+        "ideal_pH": [6.0, 6.8],             optional per-class override of the top-level range
+        "is_soil": true                     false for classes such as 'Not soil' (no pH is reported)
+    }
+
+pH_advice templates may use {pH}, {low} and {high}. Adding a soil class means
+adding an entry here; compile_rules() refuses a class list with classes the
+table does not cover, so a model and its rules cannot silently disagree.
+
+The compiled rules are arrays aligned with the model's output order, so a
+whole batch of predictions is evaluated with a few numpy operations; only
+the rows whose pH is off need a string formatted.
+"""
+import argparse
+import json
+from functools import partial
+
+import numpy as np
+
+RULES_PATH = 'soil_rules.json'
+DEFAULT_IDEAL_PH = (6.0, 6.8)
+DEFAULT_PH_ADVICE = " The pH level of {pH} is outside the ideal range ({low}-{high}), which may require adjustment."
+RULE_KEYS = {'quality', 'quality_pH_off', 'recommendations', 'pH_advice', 'ideal_pH', 'is_soil'}
+
+
+def _check_range(value, where):
+    if (not isinstance(value, (list, tuple)) or len(value) != 2
+            or not all(isinstance(v, (int, float)) for v in value) or value[0] > value[1]):
+        raise ValueError(f"{where}: ideal_pH must be [low, high] with low <= high, got {value!r}.")
+    return float(value[0]), float(value[1])
+
+
+def _check_template(template, where):
+    if not isinstance(template, str):
+        raise ValueError(f"{where}: pH_advice must be a string.")
+    try:
+        template.format(pH=7.0, low=6.0, high=6.8)
+    except (KeyError, IndexError, ValueError) as e:
+        raise ValueError(f"{where}: invalid pH_advice template ({e}). Use only {{pH}}, {{low}} and {{high}}.")
+    return template
+
+
+def load_rules(path=RULES_PATH):
+    """
+    Reads and validates a rules table.
+
+    Returns:
+        dict: {"ideal_pH": (low, high), "pH_advice": str, "classes": {name: rule}}.
+
+    Raises:
+        ValueError: If the table is malformed.
+    """
+    with open(path, 'r') as f:
+        table = json.load(f)
+    if not isinstance(table, dict) or not isinstance(table.get('classes'), dict) or not table['classes']:
+        raise ValueError(f"{path}: expected an object with a non-empty 'classes' object.")
+
+    ideal_pH = _check_range(table.get('ideal_pH', DEFAULT_IDEAL_PH), path)
+    pH_advice = _check_template(table.get('pH_advice', DEFAULT_PH_ADVICE), path)
+    classes = {}
+    for name, rule in table['classes'].items():
+        where = f"{path}: class '{name}'"
+        if not isinstance(rule, dict):
+            raise ValueError(f"{where}: expected an object.")
+        unknown = set(rule) - RULE_KEYS
+        if unknown:
+            raise ValueError(f"{where}: unknown keys {sorted(unknown)}.")
+        for key in ('quality', 'recommendations'):
+            if not isinstance(rule.get(key), str):
+                raise ValueError(f"{where}: '{key}' is required and must be a string.")
+        classes[name] = {
+            'quality': rule['quality'],
+            'quality_pH_off': str(rule.get('quality_pH_off', rule['quality'])),
+            'recommendations': rule['recommendations'],
+            'pH_advice': _check_template(rule.get('pH_advice', pH_advice), where),
+            'ideal_pH': _check_range(rule['ideal_pH'], where) if 'ideal_pH' in rule else ideal_pH,
+            'is_soil': bool(rule.get('is_soil', True)),
+        }
+    return {'ideal_pH': ideal_pH, 'pH_advice': pH_advice, 'classes': classes}
+
+
+class SoilRules:
+    """
+    A rules table compiled for one model's class list. Build it with
+    compile_rules().
+    """
+
+    def __init__(self, class_names, rules):
+        self.classes = list(class_names)
+        self.quality = np.array([rule['quality'] for rule in rules], dtype=object)
+        self.quality_pH_off = np.array([rule['quality_pH_off'] for rule in rules], dtype=object)
+        self.recommendations = np.array([rule['recommendations'] for rule in rules], dtype=object)
+        self.is_soil = np.array([rule['is_soil'] for rule in rules], dtype=bool)
+        self.pH_low = np.array([rule['ideal_pH'][0] for rule in rules], dtype=np.float64)
+        self.pH_high = np.array([rule['ideal_pH'][1] for rule in rules], dtype=np.float64)
+        # The range is fixed per class, so only {pH} is left to fill in per prediction.
+        self.pH_advice = [
+            partial(rule['pH_advice'].format, low=rule['ideal_pH'][0], high=rule['ideal_pH'][1]) for rule in rules
+        ]
+
+    def evaluate(self, class_indices, pH_values):
+        """
+        Applies the rules to a batch of predictions.
+
+        Args:
+            class_indices (array-like): Predicted class index per row.
+            pH_values (array-like): Predicted pH per row.
+
+        Returns:
+            tuple: (soil_quality, recommendations, is_soil) arrays, one entry per row.
+        """
+        class_indices = np.asarray(class_indices, dtype=np.intp)
+        pH_values = np.asarray(pH_values, dtype=np.float64)
+        pH_good = (pH_values >= self.pH_low[class_indices]) & (pH_values <= self.pH_high[class_indices])
+        is_soil = self.is_soil[class_indices]
+
+        soil_quality = np.where(pH_good | ~is_soil, self.quality[class_indices], self.quality_pH_off[class_indices])
+        recommendations = self.recommendations[class_indices]
+        for row in np.flatnonzero(is_soil & ~pH_good):
+            advice = self.pH_advice[class_indices[row]](pH=round(float(pH_values[row]), 2))
+            recommendations[row] = recommendations[row] + advice
+        return soil_quality, recommendations, is_soil
+
+
+def compile_rules(table, class_names):
+    """
+    Compiles a table loaded by load_rules() for a model's class list.
+
+    Raises:
+        ValueError: If a class has no rule in the table.
+    """
+    missing = [name for name in class_names if name not in table['classes']]
+    if missing:
+        raise ValueError(f"No soil rules for classes {missing}. Add them to the rules table.")
+    return SoilRules(class_names, [table['classes'][name] for name in class_names])
+
+
+def interpret_predictions(soil_type_scores, pH_values, rules):
+    """
+    Turns a batch of model outputs into the soil analyses returned to clients.
+
+    Args:
+        soil_type_scores (np.ndarray): Softmax scores, one row per image, one
+                                       column per entry in rules.classes.
+        pH_values (np.ndarray): The model's pH regression output per image.
+        rules (SoilRules): The soil rules compiled for the model's classes.
+
+    Returns:
+        list: One dict per row with predicted_soil_type, confidence,
+              predicted_pH, soil_quality, recommendations and the per-class
+              confidence_scores (in %).
+    """
+    soil_type_scores = np.asarray(soil_type_scores)
+    pH_values = np.asarray(pH_values).reshape(-1)
+    predicted_class_idx = np.argmax(soil_type_scores, axis=1)
+    confidences = soil_type_scores[np.arange(len(predicted_class_idx)), predicted_class_idx]
+    soil_quality, recommendations, is_soil = rules.evaluate(predicted_class_idx, pH_values)
+    percentages = (soil_type_scores.astype(np.float64) * 100).tolist()
+
+    return [
+        {
+            "predicted_soil_type": rules.classes[class_idx],
+            "confidence": round(float(confidence) * 100, 2),
+            # No pH is reported for images that are not soil.
+            "predicted_pH": round(float(pH_value), 2) if soil else "N/A",
+            "soil_quality": quality,
+            "recommendations": recommendation,
+            "confidence_scores": dict(zip(rules.classes, row_percentages))
+        }
+        for class_idx, confidence, pH_value, soil, quality, recommendation, row_percentages in zip(
+            predicted_class_idx.tolist(), confidences, pH_values, is_soil, soil_quality, recommendations, percentages
+        )
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check a soil rules table against a class names file.")
+    parser.add_argument('--rules', default=RULES_PATH, help=f"Rules table (default: {RULES_PATH}).")
+    parser.add_argument('--classes', default='soil_classes.txt', help="Class names file, one per line.")
+    args = parser.parse_args()
+
+    with open(args.classes, 'r') as f:
+        class_names = [line.strip() for line in f if line.strip()]
+    table = load_rules(args.rules)
+    compile_rules(table, class_names)
+    unused = sorted(set(table['classes']) - set(class_names))
+    print(f"'{args.rules}' covers all {len(class_names)} classes in '{args.classes}'.")
+    if unused:
+        print(f"Rules not used by this class list: {unused}")
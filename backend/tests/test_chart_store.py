@@ -0,0 +1,52 @@
+"""
+Chart store: a reused chart stays fresh across a directory rescan, and a
+reused chart whose file is gone is written again.
+
+Run from the 'backend' folder:  python -m pytest tests
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chart_store import ChartArtifactStore
+
+PNG_A = b'\x89PNG\r\n\x1a\n' + b'a' * 100
+PNG_B = b'\x89PNG\r\n\x1a\n' + b'b' * 100
+
+
+def _age(store, chart_id, seconds):
+    old = time.time() - seconds
+    os.utime(store._path(chart_id), (old, old))
+
+
+def test_reused_chart_survives_rescan(tmp_path):
+    store = ChartArtifactStore(str(tmp_path), max_age_seconds=3600, evict_seconds=3600)
+    reused = store.put(PNG_A)
+    untouched = store.put(PNG_B)
+    assert store.flush()
+    _age(store, reused, 7200)
+    _age(store, untouched, 7200)
+
+    assert store.put(PNG_A) == reused
+    # A rescan rebuilds the index from file mtimes, as another worker's store would.
+    store._scan()
+    store._evict()
+
+    assert store.get_png(reused) == PNG_A
+    assert store.get_png(untouched) is None
+    assert not os.path.exists(store._path(untouched))
+
+
+def test_reused_chart_removed_elsewhere_is_written_again(tmp_path):
+    store = ChartArtifactStore(str(tmp_path), evict_seconds=3600)
+    chart_id = store.put(PNG_A)
+    assert store.flush()
+    os.remove(store._path(chart_id))
+
+    assert store.put(PNG_A) == chart_id
+    assert store.flush()
+    assert os.path.exists(store._path(chart_id))
+    assert store.stats()["charts"] == 1
+    assert store.stats()["bytes"] == len(PNG_A)
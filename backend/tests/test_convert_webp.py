@@ -0,0 +1,87 @@
+"""
+Dataset normalization: destination names never collide with existing files,
+non-JPEG or oversized images are rewritten as upright JPEGs, and canonical
+files are left untouched.
+
+Run from the 'backend' folder:  python -m pytest tests
+"""
+import os
+import sys
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from convert_webp import STATUS_CONVERTED, STATUS_ERROR, STATUS_KEPT, STATUS_RESIZED, normalize_file, plan_destination
+from image_preprocessing import EXIF_ORIENTATION
+
+
+def test_plan_destination_keeps_jpegs_in_place():
+    assert plan_destination(os.path.join('Clay', 'a.JPEG'), {'a.jpeg'}) == os.path.join('Clay', 'a.JPEG')
+
+
+def test_plan_destination_avoids_taken_names():
+    taken = {'a.webp', 'a.png', 'a.jpg', 'a_png.jpg'}
+    assert plan_destination(os.path.join('Clay', 'a.webp'), taken) == os.path.join('Clay', 'a_webp.jpg')
+    assert plan_destination(os.path.join('Clay', 'a.png'), taken) == os.path.join('Clay', 'a_png_1.jpg')
+    # Names handed out are taken too, and the check ignores case.
+    assert {'a_webp.jpg', 'a_png_1.jpg'} <= taken
+    assert plan_destination(os.path.join('Clay', 'B.gif'), {'b.jpg'}) == os.path.join('Clay', 'B_gif.jpg')
+
+
+def _save(path, size=(40, 20), fmt=None, **kwargs):
+    Image.new('RGB', size, (120, 80, 40)).save(str(path), fmt, **kwargs)
+
+
+def test_webp_is_converted_and_original_removed(tmp_path):
+    source = tmp_path / 'a.webp'
+    _save(source)
+    result = normalize_file(str(source), str(tmp_path / 'a.jpg'))
+
+    assert result['status'] == STATUS_CONVERTED
+    assert result['path'] == str(tmp_path / 'a.jpg')
+    assert not source.exists()
+    with Image.open(result['path']) as img:
+        assert (img.format, img.size) == ('JPEG', (40, 20))
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def test_keep_originals(tmp_path):
+    source = tmp_path / 'a.bmp'
+    _save(source)
+    result = normalize_file(str(source), str(tmp_path / 'a.jpg'), delete_original=False)
+    assert result['status'] == STATUS_CONVERTED
+    assert source.exists() and (tmp_path / 'a.jpg').exists()
+
+
+def test_small_png_and_jpeg_are_kept(tmp_path):
+    for name in ('a.png', 'b.jpg'):
+        path = tmp_path / name
+        _save(path)
+        before = path.read_bytes()
+        result = normalize_file(str(path), str(path))
+        assert result['status'] == STATUS_KEPT
+        assert path.read_bytes() == before
+
+
+def test_oversized_jpeg_is_resized_in_place_and_made_upright(tmp_path):
+    path = tmp_path / 'big.jpg'
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = 6  # stored sideways: rotate 90 degrees to display
+    _save(path, size=(400, 200), exif=exif)
+
+    result = normalize_file(str(path), str(path), max_side=100)
+
+    assert result['status'] == STATUS_RESIZED
+    with Image.open(str(path)) as img:
+        assert img.size == (50, 100)
+        assert img.getexif().get(EXIF_ORIENTATION, 1) == 1
+
+
+def test_unreadable_file_is_reported_and_left_alone(tmp_path):
+    path = tmp_path / 'broken.webp'
+    path.write_bytes(b'not an image')
+    result = normalize_file(str(path), str(tmp_path / 'broken.jpg'))
+    assert result['status'] == STATUS_ERROR
+    assert path.exists()
+    assert not (tmp_path / 'broken.jpg').exists()
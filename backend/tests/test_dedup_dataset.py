@@ -0,0 +1,78 @@
+"""
+Duplicate clustering: exact and near duplicates are grouped, chained near
+matches are not treated as duplicates of the kept image, and clusters
+spanning class folders are flagged as label conflicts.
+
+Run from the 'backend' folder:  python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dedup_dataset import dedup_dataset, find_clusters, split_cluster
+
+# Hashes 3 bits apart along a chain: A~B and B~C are within 4 bits, A and C are 6 apart.
+HASH_A = 0
+HASH_B = 0b111
+HASH_C = 0b111111
+HASH_FAR = (1 << 64) - 1
+
+
+def _as_sets(clusters):
+    return sorted(sorted(members) for members in clusters)
+
+
+def test_exact_and_near_duplicates_are_clustered():
+    paths = ['a', 'a_copy', 'b', 'far']
+    sha256s = ['s1', 's1', 's2', 's3']
+    hashes = np.array([HASH_A, HASH_A, 0b11, HASH_FAR], dtype=np.uint64)
+
+    assert _as_sets(find_clusters(paths, sha256s, hashes, max_distance=4)) == [[0, 1, 2]]
+    # Exact only: the near match drops out.
+    assert _as_sets(find_clusters(paths, sha256s, hashes, max_distance=0)) == [[0, 1]]
+
+
+def test_chained_members_are_not_duplicates_of_the_kept_image():
+    paths = ['a', 'b', 'c']
+    sha256s = ['s1', 's2', 's3']
+    hashes = np.array([HASH_A, HASH_B, HASH_C], dtype=np.uint64)
+
+    clusters = find_clusters(paths, sha256s, hashes, max_distance=4)
+    assert _as_sets(clusters) == [[0, 1, 2]]
+
+    duplicates, chained = split_cluster([0, 1, 2], 0, sha256s, hashes, max_distance=4)
+    assert duplicates == [1]
+    assert chained == [2]
+
+
+def _save(path, pattern):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.fromarray(pattern).save(path)
+
+
+def test_cross_class_clusters_are_label_conflicts_and_not_moved(tmp_path):
+    gradient = np.tile(np.arange(0, 256, 4, dtype=np.uint8), (64, 1))
+    stripes = np.zeros((64, 64), dtype=np.uint8)
+    stripes[:, ::8] = 255
+    dataset = tmp_path / 'Train'
+    _save(str(dataset / 'Clay' / 'one.png'), gradient)
+    _save(str(dataset / 'Sandy' / 'one_again.png'), gradient)
+    _save(str(dataset / 'Clay' / 'two.png'), stripes)
+    _save(str(dataset / 'Clay' / 'two copy.png'), stripes)
+
+    report = dedup_dataset([str(dataset)], max_distance=0, quarantine=True, workers=1,
+                           index_path=str(tmp_path / 'index.sqlite3'))
+
+    by_keep = {os.path.basename(cluster['keep']): cluster for cluster in report['clusters']}
+    conflict = by_keep['one.png']
+    assert conflict['label_conflict'] and conflict['classes'] == ['Clay', 'Sandy']
+    assert not by_keep['two.png']['label_conflict']
+
+    # Only the same-class duplicate is moved.
+    assert report['quarantined'] == 1
+    assert (dataset / 'Sandy' / 'one_again.png').exists()
+    assert not (dataset / 'Clay' / 'two copy.png').exists()
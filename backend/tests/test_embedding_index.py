@@ -0,0 +1,57 @@
+"""
+IVF index parameters at large sample counts: the default cluster count is
+capped and cluster assignment works in bounded row blocks.
+
+Run from the 'backend' folder:  python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import embedding_index
+from embedding_index import (ASSIGN_BLOCK_BYTES, MAX_NLIST, EmbeddingIndex, EmbeddingStore, assign_clusters,
+                             build_ivf, default_nlist, normalize)
+
+
+def test_default_nlist_is_capped_for_millions_of_vectors():
+    assert default_nlist(10_000) == 400
+    assert default_nlist(1_000_000) == MAX_NLIST
+    assert default_nlist(50_000_000) == MAX_NLIST
+
+
+def test_assignment_block_stays_within_budget_at_max_nlist():
+    block_rows = ASSIGN_BLOCK_BYTES // (4 * MAX_NLIST)
+    assert block_rows >= 1
+    assert block_rows * MAX_NLIST * 4 <= ASSIGN_BLOCK_BYTES
+
+
+def test_blocked_assignment_matches_full_assignment():
+    rng = np.random.default_rng(0)
+    vectors = normalize(rng.standard_normal((3000, 16)).astype(np.float32))
+    centroids = normalize(rng.standard_normal((50, 16)).astype(np.float32))
+    expected = np.argmax(vectors @ centroids.T, axis=1)
+    # 7 rows per block, so the last block is partial.
+    np.testing.assert_array_equal(assign_clusters(vectors, centroids, block_bytes=4 * 50 * 7), expected)
+
+
+def test_build_ivf_with_capped_nlist_and_small_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedding_index, 'MAX_NLIST', 16)
+    rng = np.random.default_rng(1)
+    n, dim = 5000, 32
+    vectors = normalize(rng.standard_normal((n, dim)).astype(np.float32))
+    store = EmbeddingStore(str(tmp_path / 'store'), dim, 'float32')
+    store.add([(f"key{i}", vectors[i], 'train', None, None, None) for i in range(n)])
+
+    nlist = build_ivf(store, block_bytes=4 * 16 * 100)
+    assert nlist == 16
+    with np.load(store.ivf_path) as data:
+        assert data['offsets'][-1] == n
+        assert sorted(data['order'].tolist()) == list(range(n))
+
+    # A stored vector is found through the IVF lists (nprobe below nlist) as its own nearest neighbour.
+    index = EmbeddingIndex(store)
+    for i in range(5):
+        assert index.search(vectors[i], k=1, nprobe=4)[0]["key"] == f"key{i}"
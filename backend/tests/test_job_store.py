@@ -0,0 +1,77 @@
+"""
+Job store: jobs of a worker that stopped sending heartbeats are failed
+(independent of process IDs), stuck jobs expire, and results are appended
+per chunk.
+
+Run from the 'backend' folder:  python -m pytest tests
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job_store import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JobStore
+
+
+def _store(tmp_path, **kwargs):
+    kwargs.setdefault('heartbeat_seconds', 0)
+    kwargs.setdefault('stale_seconds', 60)
+    return JobStore(str(tmp_path / 'jobs.sqlite3'), **kwargs)
+
+
+def test_jobs_of_a_live_worker_are_kept(tmp_path):
+    worker = _store(tmp_path)
+    job_id = worker.create(3, 'none')
+    worker.update(job_id, JOB_RUNNING)
+
+    # Another worker opening the same database (same PID here) must not fail the live job.
+    other = _store(tmp_path)
+    assert other.get(job_id)["state"] == JOB_RUNNING
+    assert other.recover_orphaned() == 0
+
+
+def test_jobs_of_a_silent_worker_are_failed(tmp_path):
+    crashed = _store(tmp_path)
+    running = crashed.create(3, 'none')
+    crashed.update(running, JOB_RUNNING)
+    queued = crashed.create(1, 'none')
+    finished = crashed.create(1, 'none')
+    crashed.update(finished, JOB_DONE)
+    # The worker stops beating: its last heartbeat is older than stale_seconds.
+    crashed._db.execute("UPDATE job_owners SET heartbeat = ?", (time.time() - 120,))
+    crashed._db.commit()
+
+    restarted = _store(tmp_path)
+    assert restarted.get(running)["state"] == JOB_FAILED
+    assert restarted.get(queued)["state"] == JOB_FAILED
+    assert restarted.get(finished)["state"] == JOB_DONE
+    assert "restarted" in restarted.get(running)["error"]
+
+
+def test_stuck_jobs_expire(tmp_path):
+    store = _store(tmp_path, ttl_seconds=3600)
+    stuck = store.create(2, 'none')
+    store.update(stuck, JOB_RUNNING)
+    store.append_results(stuck, [{"ok": 1}])
+    fresh = store.create(1, 'none')
+    store._db.execute("UPDATE jobs SET updated = ? WHERE id = ?", (time.time() - 7200, stuck))
+    store._db.commit()
+
+    assert store.delete_expired() == 1
+    assert store.get(stuck) is None
+    assert store.get(fresh)["state"] == JOB_QUEUED
+    assert store._db.execute("SELECT COUNT(*) FROM job_results").fetchone()[0] == 0
+
+
+def test_results_are_appended_in_order(tmp_path):
+    store = _store(tmp_path)
+    job_id = store.create(4, 'none')
+    store.append_results(job_id, [{"i": 0}, {"i": 1, "error": "bad"}])
+    store.append_results(job_id, [{"i": 2}, {"i": 3}])
+    store.update(job_id, JOB_DONE)
+
+    job = store.get(job_id)
+    assert [result["i"] for result in job["results"]] == [0, 1, 2, 3]
+    assert (job["processed"], job["failed"], job["succeeded"], job["progress"]) == (4, 1, 3, 1.0)
+    assert "results" not in store.get(job_id, include_results=False)
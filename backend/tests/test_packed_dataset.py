@@ -0,0 +1,98 @@
+"""
+Compaction of a packed dataset: the compacted shards are a new generation,
+the manifest switches to them before old files are deleted, and an
+interrupted compaction leaves the previous generation readable.
+
+Run from the 'backend' folder:  python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import packed_dataset
+from packed_dataset import PackedDataset, _append_rows, _empty_index, _new_manifest, _save_index, _write_shard, compact
+
+IMAGE_SHAPE = (4, 4, 3)
+
+
+def _image(value):
+    return np.full(IMAGE_SHAPE, value, dtype=np.uint8)
+
+
+def _make_packed(output_dir, values_per_shard, inactive=()):
+    """
+    Writes a generation-0 packed set where each image is filled with its own
+    value and its path is 'img<value>.jpg'.
+    """
+    manifest = _new_manifest(str(output_dir), ['a', 'b'])
+    manifest['image_size'] = list(IMAGE_SHAPE[:2])
+    index = _empty_index()
+    for shard_number, values in enumerate(values_per_shard):
+        _write_shard(str(output_dir), shard_number, np.stack([_image(v) for v in values]))
+        manifest['shards'].append({'file': packed_dataset._shard_filename(shard_number), 'count': len(values)})
+        _append_rows(index, [
+            {'path': f"img{v}.jpg", 'label': v % 2, 'pH': np.nan, 'size': 1, 'mtime_ns': 1,
+             'shard': shard_number, 'row': row, 'active': v not in inactive}
+            for row, v in enumerate(values)
+        ])
+    _save_index(str(output_dir), manifest, index)
+
+
+def _read_all(output_dir):
+    packed = PackedDataset(str(output_dir))
+    images = packed.get_batch(np.arange(len(packed)))
+    return {str(path): int(image[0, 0, 0]) for path, image in zip(packed.paths, images)}
+
+
+def test_compact_keeps_active_rows_and_removes_old_generation(tmp_path, monkeypatch):
+    monkeypatch.setattr(packed_dataset, 'SHARD_SIZE', 2)
+    _make_packed(tmp_path, [[1, 2, 3], [4, 5]], inactive={2, 4})
+
+    compact(str(tmp_path))
+
+    assert _read_all(tmp_path) == {'img1.jpg': 1, 'img3.jpg': 3, 'img5.jpg': 5}
+    assert sorted(os.listdir(tmp_path)) == ['index_g1.npz', 'manifest.json', 'shard_g1_00000.npy',
+                                            'shard_g1_00001.npy']
+
+    # A second compaction moves on to the next generation.
+    compact(str(tmp_path))
+    assert _read_all(tmp_path) == {'img1.jpg': 1, 'img3.jpg': 3, 'img5.jpg': 5}
+    assert 'index_g2.npz' in os.listdir(tmp_path)
+
+
+def test_interrupted_compaction_leaves_previous_generation_readable(tmp_path, monkeypatch):
+    _make_packed(tmp_path, [[1, 2, 3]], inactive={2})
+    before = _read_all(tmp_path)
+
+    def crash(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(packed_dataset, '_save_index', crash)
+    with pytest.raises(KeyboardInterrupt):
+        compact(str(tmp_path))
+    monkeypatch.undo()
+
+    # The new shard was written, but the manifest still names generation 0.
+    assert 'shard_g1_00000.npy' in os.listdir(tmp_path)
+    assert _read_all(tmp_path) == before
+
+    # The next compaction overwrites the leftover and cleans up.
+    compact(str(tmp_path))
+    assert _read_all(tmp_path) == before
+    assert sorted(os.listdir(tmp_path)) == ['index_g1.npz', 'manifest.json', 'shard_g1_00000.npy']
+
+
+def test_rows_of_an_unlisted_shard_are_ignored(tmp_path):
+    _make_packed(tmp_path, [[1, 2]])
+    # Simulate a run stopped after the index was saved but before the manifest was.
+    manifest, index = packed_dataset._load_index(str(tmp_path))
+    _append_rows(index, [{'path': 'img9.jpg', 'label': 1, 'pH': np.nan, 'size': 1, 'mtime_ns': 1,
+                          'shard': 1, 'row': 0, 'active': True}])
+    with open(tmp_path / 'index.npz', 'wb') as f:
+        np.savez(f, **index)
+
+    assert _read_all(tmp_path) == {'img1.jpg': 1, 'img2.jpg': 2}
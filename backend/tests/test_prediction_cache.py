@@ -0,0 +1,70 @@
+"""
+Prediction cache shared by several workers: switching versions does not
+delete another worker's rows, only retired versions are pruned, and a
+replaced model file changes its fingerprint even when size and mtime match.
+
+Run from the 'backend' folder:  python -m pytest tests
+"""
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prediction_cache import PredictionCache, file_fingerprint
+
+
+def test_set_version_keeps_other_versions_on_disk(tmp_path):
+    db_path = str(tmp_path / 'cache.sqlite3')
+    old_worker = PredictionCache(db_path=db_path)
+    old_worker.set_version('v1')
+    old_worker.put('img', {"soil_type": "Clay"})
+
+    new_worker = PredictionCache(db_path=db_path)
+    new_worker.set_version('v1')
+    new_worker.set_version('v2')
+    # The new version never sees v1's result...
+    assert new_worker.get('img') is None
+    new_worker.put('img', {"soil_type": "Sandy"})
+
+    # ...and the worker still on v1 keeps its rows.
+    old_worker._entries.clear()
+    assert old_worker.get('img') == {"soil_type": "Clay"}
+    assert new_worker.get('img') == {"soil_type": "Sandy"}
+    assert new_worker.versions() == ['v1', 'v2']
+
+
+def test_set_version_clears_memory_entries(tmp_path):
+    cache = PredictionCache()
+    cache.set_version('v1')
+    cache.put('img', {"soil_type": "Clay"})
+    cache.set_version('v2')
+    assert cache.stats()["entries"] == 0
+    assert cache.get('img', 'v1') is None
+    assert cache.invalidations == 1
+
+
+def test_retire_versions_keeps_the_current_version(tmp_path):
+    cache = PredictionCache(db_path=str(tmp_path / 'cache.sqlite3'))
+    for version in ('v1', 'v2', 'v3'):
+        cache.set_version(version)
+        cache.put('img', {"version": version})
+
+    assert cache.retire_versions(['v1', 'v3']) == 1
+    assert cache.versions() == ['v2', 'v3']
+    assert cache.get('img', 'v1') is None
+
+
+def test_fingerprint_changes_when_a_file_is_replaced_with_the_same_mtime(tmp_path):
+    model = tmp_path / 'model.h5'
+    model.write_bytes(b'a' * 100)
+    before = file_fingerprint(str(model))
+
+    replacement = tmp_path / 'new_model.h5'
+    replacement.write_bytes(b'b' * 100)
+    shutil.copystat(str(model), str(replacement))
+    os.replace(str(replacement), str(model))
+
+    assert os.stat(str(model)).st_size == 100
+    assert file_fingerprint(str(model)) != before
+    assert file_fingerprint(str(tmp_path / 'missing.h5')) == file_fingerprint(str(tmp_path / 'missing.h5'))
@@ -0,0 +1,53 @@
+"""
+Uploads are accepted by their header bytes, not their file name: WebP and
+TIFF photos saved under a .jpg name (common in the dataset) must still be
+analyzed.
+
+Run from the 'backend' folder:  python -m pytest tests
+"""
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    pytest.importorskip('tensorflow')
+    tmp_dir = tmp_path_factory.mktemp('app')
+    os.environ.setdefault('LOAD_MODEL_IN_BACKGROUND', 'false')
+    os.environ.setdefault('MODEL_RELOAD_INTERVAL', '0')
+    os.environ.setdefault('CHART_STORE_DIR', str(tmp_dir / 'charts'))
+    os.environ.setdefault('JOB_DB', str(tmp_dir / 'jobs.sqlite3'))
+    os.environ.setdefault('EMBEDDINGS_DIR', str(tmp_dir / 'embeddings'))
+    # app.py resolves the model and class files relative to the backend folder.
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+    import app
+    return app
+
+
+def encode(image_format):
+    buffer = io.BytesIO()
+    Image.new('RGB', (320, 240), (120, 80, 40)).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('image_format', ['WEBP', 'TIFF'])
+def test_header_check_accepts_format(app_module, image_format):
+    data = encode(image_format)
+    assert app_module.check_image_upload(io.BytesIO(data), len(data)) == (None, None)
+
+
+def test_predict_accepts_webp_named_jpg(app_module):
+    if app_module.served is None:
+        pytest.skip("No model is available to the server.")
+    response = app_module.app.test_client().post(
+        '/predict', data={'image': (io.BytesIO(encode('WEBP')), 'sample.jpg'), 'chart': 'none'}
+    )
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()["predicted_soil_type"] in app_module.served.classes
@@ -0,0 +1,79 @@
+import numpy as np
+
+try:
+    from tflite_runtime.interpreter import Interpreter
+except ImportError:
+    import tensorflow as tf
+    Interpreter = tf.lite.Interpreter
+
+
+class TFLiteModel:
+    """
+    Serves a .tflite export of the multi-task soil model behind the same
+    predict_on_batch() interface as the Keras model, so it can be dropped into
+    BatchingInferenceEngine unchanged.
+
+    TFLite interpreters have a fixed input shape once tensors are allocated,
+    so one interpreter is kept per batch size seen. The inference engine only
+    produces a handful of padded batch sizes, so this stays small. Like the
+    engine itself, an instance must only be used from one thread at a time.
+
+    Args:
+        model_path (str): Path to the .tflite file.
+        num_threads (int): Interpreter thread count, or None for the default.
+    """
+
+    def __init__(self, model_path, num_threads=None):
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self._interpreters = {}
+
+        # Load once up front so a bad file fails at startup, not on the first request.
+        interpreter = self._get_interpreter(1)
+        input_details = interpreter.get_input_details()[0]
+        self.input_shape = tuple(int(d) for d in input_details['shape'][1:])
+        self.input_dtype = input_details['dtype']
+        self._soil_type_index, self._pH_index = self._find_outputs(interpreter.get_output_details())
+
+    def _get_interpreter(self, batch_size):
+        interpreter = self._interpreters.get(batch_size)
+        if interpreter is None:
+            interpreter = Interpreter(model_path=self.model_path, num_threads=self.num_threads)
+            input_details = interpreter.get_input_details()[0]
+            if input_details['shape'][0] != batch_size:
+                shape = list(input_details['shape'])
+                shape[0] = batch_size
+                interpreter.resize_tensor_input(input_details['index'], shape)
+            interpreter.allocate_tensors()
+            self._interpreters[batch_size] = interpreter
+        return interpreter
+
+    @staticmethod
+    def _find_outputs(output_details):
+        soil_type_index = pH_index = None
+        for detail in output_details:
+            name = detail['name'].lower()
+            if 'soil_type' in name:
+                soil_type_index = detail['index']
+            elif 'ph' in name:
+                pH_index = detail['index']
+
+        # Exported signature names are not always preserved; fall back to shapes.
+        if soil_type_index is None or pH_index is None:
+            by_width = sorted(output_details, key=lambda detail: int(detail['shape'][-1]))
+            pH_index = by_width[0]['index']
+            soil_type_index = by_width[-1]['index']
+        return soil_type_index, pH_index
+
+    def predict_on_batch(self, images):
+        images = np.asarray(images, dtype=self.input_dtype)
+        interpreter = self._get_interpreter(len(images))
+        interpreter.set_tensor(interpreter.get_input_details()[0]['index'], images)
+        interpreter.invoke()
+        return (
+            interpreter.get_tensor(self._soil_type_index).copy(),
+            interpreter.get_tensor(self._pH_index).copy()
+        )
+
+    def predict(self, images, verbose=0):
+        return self.predict_on_batch(images)
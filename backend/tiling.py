@@ -0,0 +1,116 @@
+"""
+Multi-crop (tiled) inference for high-resolution photos.
+
+Instead of squashing a whole photo to 224x224, the photo is decoded once at
+the reduced resolution a grid of 224x224 tiles needs (JPEG draft mode does
+most of the downscaling), center-cropped to the grid's aspect ratio so the
+texture is not stretched, and cut into tiles. Optionally each tile is also
+added mirrored. All tiles go through the model as one batch, and the
+per-tile outputs are combined by aggregate_tiles().
+"""
+import numpy as np
+
+from image_preprocessing import decode_rgb, to_array, TARGET_SIZE, RESAMPLE, REDUCING_GAP
+
+AGGREGATIONS = ('mean', 'weighted')
+MAX_GRID_SIDE = 8
+
+
+def parse_grid(text):
+    """
+    Parses a 'ROWSxCOLS' grid such as '3x3' or '2x3'.
+
+    Raises:
+        ValueError: If the text is not a valid grid.
+    """
+    try:
+        rows, cols = (int(part) for part in text.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"Invalid tile grid '{text}'. Use ROWSxCOLS, e.g. 3x3.")
+    if not (1 <= rows <= MAX_GRID_SIDE and 1 <= cols <= MAX_GRID_SIDE):
+        raise ValueError(f"Tile grid sides must be between 1 and {MAX_GRID_SIDE}, got '{text}'.")
+    return rows, cols
+
+
+def center_box(size, aspect):
+    """
+    Returns the largest (left, top, right, bottom) box of the given
+    width/height aspect ratio centered in an image of size (width, height).
+    """
+    width, height = size
+    if width / height > aspect:
+        crop_width = height * aspect
+        left = (width - crop_width) / 2.0
+        return (left, 0.0, left + crop_width, float(height))
+    crop_height = width / aspect
+    top = (height - crop_height) / 2.0
+    return (0.0, top, float(width), top + crop_height)
+
+
+def decode_tiles(source, grid=(3, 3), tile_size=TARGET_SIZE, flips=False):
+    """
+    Decodes an image once and cuts it into a grid of model-sized tiles.
+
+    Args:
+        source: Raw bytes, a path or a binary file object.
+        grid (tuple): (rows, cols) of tiles.
+        tile_size (tuple): (width, height) of each tile.
+        flips (bool): Also add a horizontally mirrored copy of every tile.
+
+    Returns:
+        np.ndarray: float32 tiles of shape (n, height, width, 3) scaled to
+                    [0, 1], row by row, followed by their mirrored copies.
+    """
+    rows, cols = grid
+    tile_width, tile_height = tile_size
+    full_size = (cols * tile_width, rows * tile_height)
+
+    img = decode_rgb(source, full_size)
+    box = center_box(img.size, full_size[0] / full_size[1])
+    if img.size != full_size or box != (0.0, 0.0, float(img.size[0]), float(img.size[1])):
+        img = img.resize(full_size, resample=RESAMPLE, box=box, reducing_gap=REDUCING_GAP)
+
+    pixels = to_array(img)
+    tiles = (pixels.reshape(rows, tile_height, cols, tile_width, 3)
+             .swapaxes(1, 2)
+             .reshape(rows * cols, tile_height, tile_width, 3))
+    if flips:
+        tiles = np.concatenate([tiles, tiles[:, :, ::-1]])
+    return np.ascontiguousarray(tiles)
+
+
+def aggregate_tiles(soil_type_scores, pH_values, method='mean'):
+    """
+    Combines per-tile model outputs into one prediction.
+
+    Args:
+        soil_type_scores (np.ndarray): Softmax scores, one row per tile.
+        pH_values (np.ndarray): pH output per tile.
+        method (str): 'mean' weights every tile equally; 'weighted' weights
+                      each tile by its top class probability, so confident
+                      tiles count more than ambiguous ones (edges, shadows).
+
+    Returns:
+        tuple: (scores, pH, spread) where scores has shape (1, classes) and
+               pH shape (1, 1), ready for interpret_predictions(), and spread
+               describes how much the tiles disagreed: the standard deviation
+               across tiles of each class score (in %) and of pH, and the
+               fraction of tiles whose own top class matches the combined one.
+    """
+    if method not in AGGREGATIONS:
+        raise ValueError(f"Unknown tile aggregation '{method}'. Use one of {', '.join(AGGREGATIONS)}.")
+    soil_type_scores = np.asarray(soil_type_scores, dtype=np.float64)
+    pH_values = np.asarray(pH_values, dtype=np.float64).reshape(-1)
+
+    weights = soil_type_scores.max(axis=1) if method == 'weighted' else np.ones(len(soil_type_scores))
+    weights = weights / weights.sum()
+    scores = weights @ soil_type_scores
+    pH = float(weights @ pH_values)
+    spread = {
+        "count": len(soil_type_scores),
+        "aggregation": method,
+        "score_std": (soil_type_scores.std(axis=0) * 100).round(2).tolist(),
+        "pH_std": round(float(pH_values.std()), 3),
+        "agreement": round(float(np.mean(soil_type_scores.argmax(axis=1) == scores.argmax())), 3),
+    }
+    return scores[np.newaxis, :], np.array([[pH]]), spread
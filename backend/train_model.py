@@ -2,7 +2,16 @@ import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers, Model
 import numpy as np
+import argparse
 import os
+import time
+
+from dataset_files import IMAGE_EXTENSIONS, list_labeled_images
+from image_preprocessing import load_rgb
+from packed_dataset import PackedDataset
+from feature_store import (BACKBONES, FEATURE_STORE_PATH, FeatureStore, backbone_id, dataset_features,
+                           default_weights_path, load_backbone)
+from model_registry import publish_model, REGISTRY_DIR
 
 print("TensorFlow Version:", tf.__version__)
 
@@ -10,48 +19,214 @@ DATASET_DIR = '../Dataset/Train'
 IMG_HEIGHT = 224
 IMG_WIDTH = 224
 BATCH_SIZE = 32
+VALIDATION_SPLIT = 0.2
+SEED = 123
+
+# Input pipeline settings (all overridable from the command line)
+CACHE_MODE = 'memory'      # 'memory', 'none', or a file path prefix for an on-disk cache
+SHUFFLE_BUFFER = 1000
+AUGMENT = False
+DETERMINISTIC = True
+
+# Every format image_preprocessing decodes is trained on, the same set the server,
+# packed datasets, evaluation and validate_dataset.py accept.
+TRAINING_EXTENSIONS = tuple(sorted(IMAGE_EXTENSIONS))
+
+
+def _load_pixels(path):
+    return np.asarray(load_rgb(path.decode(), (IMG_WIDTH, IMG_HEIGHT)), dtype=np.uint8)
+
+
+def load_and_resize(path, label):
+    # Decoded and resized by image_preprocessing, exactly as the server and the
+    # packed shards do, so the model trains on the pixels it is served.
+    img = tf.numpy_function(_load_pixels, [path], tf.uint8)
+    img.set_shape([IMG_HEIGHT, IMG_WIDTH, 3])
+    # Normalize here rather than in a separate Rescaling map over every batch.
+    return tf.cast(img, tf.float32) / 255.0, label
+
+
+def augment_image(img, label):
+    img = tf.image.random_flip_left_right(img)
+    img = tf.image.random_brightness(img, 0.1)
+    return tf.clip_by_value(img, 0.0, 1.0), label
+
+
+def generate_dummy_pH(images, labels):
+    pH_labels = tf.random.uniform(shape=tf.shape(labels), minval=6.0, maxval=7.0)
+    return images, {'soil_type_output': labels, 'pH_output': pH_labels}
+
+
+def split_files(dataset_path, validation_split=VALIDATION_SPLIT, seed=SEED):
+    """
+    Lists the class-folder dataset and splits it into training and validation
+    file lists with a seeded shuffle, so the split is the same on every run.
+    """
+    paths, labels, class_names = list_labeled_images(dataset_path)
+    keep = [i for i, path in enumerate(paths) if path.lower().endswith(TRAINING_EXTENSIONS)]
+    paths = np.array(paths)[keep]
+    labels = np.array(labels, dtype='int32')[keep]
+
+    order = np.random.RandomState(seed).permutation(len(paths))
+    paths, labels = paths[order], labels[order]
+    split_at = len(paths) - int(len(paths) * validation_split)
+    print(f"Found {len(paths)} files belonging to {len(class_names)} classes. "
+          f"Using {split_at} for training and {len(paths) - split_at} for validation.")
+    return (paths[:split_at], labels[:split_at]), (paths[split_at:], labels[split_at:]), class_names
+
+
+def build_pipeline(paths, labels, training, cache=CACHE_MODE, shuffle_buffer=SHUFFLE_BUFFER,
+                   augment=AUGMENT, deterministic=DETERMINISTIC, cache_suffix=''):
+    """
+    Builds a tf.data pipeline that decodes and resizes images in parallel,
+    caches the decoded 224x224 tensors, shuffles with a fixed seed, batches,
+    and prefetches so the training step does not wait on I/O.
+
+    Args:
+        paths (np.ndarray): Image file paths.
+        labels (np.ndarray): Integer class labels.
+        training (bool): Whether to shuffle and (optionally) augment.
+        cache (str): 'memory', 'none', or a file path prefix for an on-disk cache.
+        shuffle_buffer (int): Shuffle buffer size for the training set.
+        augment (bool): Apply random flips/brightness to training images.
+        deterministic (bool): Keep element order fixed despite parallel maps.
+        cache_suffix (str): Appended to an on-disk cache path so the training
+                            and validation sets get separate cache files.
+    """
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+    ds = ds.map(load_and_resize, num_parallel_calls=tf.data.AUTOTUNE, deterministic=deterministic)
+
+    if cache == 'memory':
+        ds = ds.cache()
+    elif cache and cache != 'none':
+        os.makedirs(os.path.dirname(os.path.abspath(cache)), exist_ok=True)
+        ds = ds.cache(f"{cache}{cache_suffix}")
+
+    if training:
+        ds = ds.shuffle(shuffle_buffer, seed=SEED, reshuffle_each_iteration=True)
+        if augment:
+            ds = ds.map(augment_image, num_parallel_calls=tf.data.AUTOTUNE, deterministic=deterministic)
+
+    ds = ds.batch(BATCH_SIZE)
+    ds = ds.map(generate_dummy_pH, num_parallel_calls=tf.data.AUTOTUNE, deterministic=deterministic)
+
+    options = tf.data.Options()
+    options.deterministic = deterministic
+    return ds.with_options(options).prefetch(tf.data.AUTOTUNE)
+
+
+def split_packed(packed, validation_split=VALIDATION_SPLIT, seed=SEED):
+    """
+    Seeded 80/20 split over the rows of a packed dataset. It uses the same
+    seed and fraction as split_files(), but the packed rows are in a different
+    order, so the two splits do not put the same images in validation.
+    """
+    order = np.random.RandomState(seed).permutation(len(packed)).astype('int64')
+    labels = packed.labels[order].astype('int32')
+    split_at = len(order) - int(len(order) * validation_split)
+    print(f"Found {len(order)} packed images belonging to {len(packed.class_names)} classes. "
+          f"Using {split_at} for training and {len(order) - split_at} for validation.")
+    return (order[:split_at], labels[:split_at]), (order[split_at:], labels[split_at:])
+
+
+def build_packed_pipeline(packed, indices, labels, training, shuffle_buffer=SHUFFLE_BUFFER,
+                          augment=AUGMENT, deterministic=DETERMINISTIC):
+    """
+    Builds a tf.data pipeline over a PackedDataset. Only row indices are
+    shuffled and batched; each batch is then gathered from the memory-mapped
+    shards in one call, so there is no per-file open or decode at all.
+    """
+    ds = tf.data.Dataset.from_tensor_slices((indices, labels))
+    if training:
+        ds = ds.shuffle(max(shuffle_buffer, len(indices)), seed=SEED, reshuffle_each_iteration=True)
+    ds = ds.batch(BATCH_SIZE)
+
+    def gather(batch_indices, batch_labels):
+        images = tf.numpy_function(packed.get_batch, [batch_indices], tf.uint8)
+        images.set_shape([None, IMG_HEIGHT, IMG_WIDTH, 3])
+        return tf.cast(images, tf.float32) / 255.0, batch_labels
+
+    ds = ds.map(gather, num_parallel_calls=tf.data.AUTOTUNE, deterministic=deterministic)
+    if training and augment:
+        ds = ds.map(augment_image, num_parallel_calls=tf.data.AUTOTUNE, deterministic=deterministic)
+    ds = ds.map(generate_dummy_pH, num_parallel_calls=tf.data.AUTOTUNE, deterministic=deterministic)
+
+    options = tf.data.Options()
+    options.deterministic = deterministic
+    return ds.with_options(options).prefetch(tf.data.AUTOTUNE)
+
+
+def build_feature_pipeline(features, labels, training, shuffle_buffer=SHUFFLE_BUFFER):
+    """
+    Builds a tf.data pipeline over in-memory backbone features.
+    """
+    ds = tf.data.Dataset.from_tensor_slices((features, labels))
+    if training:
+        ds = ds.shuffle(max(shuffle_buffer, len(labels)), seed=SEED, reshuffle_each_iteration=True)
+    ds = ds.batch(BATCH_SIZE).map(generate_dummy_pH)
+    return ds.prefetch(tf.data.AUTOTUNE)
+
+
+class InputPipelineTimer(keras.callbacks.Callback):
+    """
+    Prints, per epoch, how much wall time went to waiting for the next batch
+    (input pipeline) versus running the training step (compute).
+    """
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.input_time = 0.0
+        self.compute_time = 0.0
+        self.last_batch_end = time.perf_counter()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.batch_start = time.perf_counter()
+        self.input_time += self.batch_start - self.last_batch_end
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.last_batch_end = time.perf_counter()
+        self.compute_time += self.last_batch_end - self.batch_start
+
+    def on_epoch_end(self, epoch, logs=None):
+        total = self.input_time + self.compute_time
+        share = self.input_time / total * 100 if total else 0.0
+        print(f"\nEpoch {epoch + 1}: input pipeline {self.input_time:.2f}s, "
+              f"compute {self.compute_time:.2f}s ({share:.1f}% waiting on input)")
+
+
+def compile_multi_task(model):
+    model.compile(optimizer='adam',
+                  loss={'soil_type_output': tf.keras.losses.SparseCategoricalCrossentropy(from_logits=False),
+                        'pH_output': tf.keras.losses.MeanSquaredError()},
+                  metrics={'soil_type_output': ['accuracy'],
+                           'pH_output': ['mse']})
 
 
 # Function to create and train the multi-task model
-def create_and_train_model(dataset_path, input_shape=(IMG_HEIGHT, IMG_WIDTH, 3), epochs=10):
-    if not os.path.exists(dataset_path):
+def create_and_train_model(dataset_path, input_shape=(IMG_HEIGHT, IMG_WIDTH, 3), epochs=10, cache=CACHE_MODE,
+                           shuffle_buffer=SHUFFLE_BUFFER, augment=AUGMENT, deterministic=DETERMINISTIC,
+                           time_pipeline=False, packed_dir=None):
+    if packed_dir is None and not os.path.exists(dataset_path):
         print(f"Error: Dataset directory '{dataset_path}' not found.")
         print("Creating a simple dummy model instead.")
-        return None, None
-
-    # Load dataset from directory
-    images_ds = tf.keras.utils.image_dataset_from_directory(
-        dataset_path,
-        validation_split=0.2,
-        subset="training",
-        seed=123,
-        image_size=(IMG_HEIGHT, IMG_WIDTH),
-        batch_size=BATCH_SIZE
-    )
-    val_ds = tf.keras.utils.image_dataset_from_directory(
-        dataset_path,
-        validation_split=0.2,
-        subset="validation",
-        seed=123,
-        image_size=(IMG_HEIGHT, IMG_WIDTH),
-        batch_size=BATCH_SIZE
-    )
-    
-   
-    def generate_dummy_pH(images, labels):
-        pH_labels = tf.random.uniform(shape=tf.shape(labels), minval=6.0, maxval=7.0)
-        return images, {'soil_type_output': labels, 'pH_output': pH_labels}
-    
-    train_ds = images_ds.map(generate_dummy_pH)
-    val_ds = val_ds.map(generate_dummy_pH)
-  
-    
-    class_names = images_ds.class_names
+        return None, None, None
+
+    if deterministic:
+        tf.keras.utils.set_random_seed(SEED)
+
+    if packed_dir is not None:
+        # Pre-resized shards from packed_dataset.py; the OS page cache replaces the tf.data cache.
+        packed = PackedDataset(packed_dir)
+        class_names = packed.class_names
+        (train_idx, train_labels), (val_idx, val_labels) = split_packed(packed)
+        pipeline_args = dict(shuffle_buffer=shuffle_buffer, augment=augment, deterministic=deterministic)
+        normalized_train_ds = build_packed_pipeline(packed, train_idx, train_labels, training=True, **pipeline_args)
+        normalized_val_ds = build_packed_pipeline(packed, val_idx, val_labels, training=False, **pipeline_args)
+    else:
+        (train_paths, train_labels), (val_paths, val_labels), class_names = split_files(dataset_path)
+        pipeline_args = dict(cache=cache, shuffle_buffer=shuffle_buffer, augment=augment, deterministic=deterministic)
+        normalized_train_ds = build_pipeline(train_paths, train_labels, training=True, cache_suffix='_train', **pipeline_args)
+        normalized_val_ds = build_pipeline(val_paths, val_labels, training=False, cache_suffix='_val', **pipeline_args)
     num_classes = len(class_names)
-    
-    normalization_layer = layers.Rescaling(1./255)
-    normalized_train_ds = train_ds.map(lambda x, y: (normalization_layer(x), y))
-    normalized_val_ds = val_ds.map(lambda x, y: (normalization_layer(x), y))
 
     input_tensor = keras.Input(shape=input_shape)
 
@@ -61,7 +236,8 @@ def create_and_train_model(dataset_path, input_shape=(IMG_HEIGHT, IMG_WIDTH, 3),
     x = layers.Conv2D(64, (3, 3), activation='relu')(x)
     x = layers.MaxPooling2D((2, 2))(x)
     x = layers.Flatten()(x)
-    x = layers.Dense(128, activation='relu')(x)
+    # Shared trunk; its output is also the embedding used for similar-sample search (embedding_index.py).
+    x = layers.Dense(128, activation='relu', name='embedding')(x)
 
     # Output for soil type classification
     soil_type_output = layers.Dense(num_classes, activation='softmax', name='soil_type_output')(x)
@@ -72,27 +248,142 @@ def create_and_train_model(dataset_path, input_shape=(IMG_HEIGHT, IMG_WIDTH, 3),
     # Combine the two outputs into a single model
     model = Model(inputs=input_tensor, outputs=[soil_type_output, pH_output])
 
-    model.compile(optimizer='adam',
-                  loss={'soil_type_output': tf.keras.losses.SparseCategoricalCrossentropy(from_logits=False),
-                        'pH_output': tf.keras.losses.MeanSquaredError()},
-                  metrics={'soil_type_output': ['accuracy'],
-                           'pH_output': ['mse']})
-  
+    compile_multi_task(model)
 
     model.summary()
     print(f"Starting multi-task model training for {epochs} epochs...")
     history = model.fit(
         normalized_train_ds,
         validation_data=normalized_val_ds,
-        epochs=epochs
+        epochs=epochs,
+        callbacks=[InputPipelineTimer()] if time_pipeline else None
     )
     print("\nMulti-task model training complete.")
-    return model, class_names
+    return model, class_names, history
+
+
+def create_and_train_heads(dataset_path, backbone_name, weights_path, store_path=FEATURE_STORE_PATH, epochs=10,
+                           shuffle_buffer=SHUFFLE_BUFFER, deterministic=DETERMINISTIC, time_pipeline=False):
+    """
+    Trains only the soil type and pH heads on top of a frozen pretrained
+    backbone. Backbone features come from the feature store, so only images
+    added since the last run go through the backbone.
+
+    Returns:
+        tuple: (model, class_names, history) like create_and_train_model().
+               The model takes images, as the server expects; its backbone
+               layers are frozen.
+    """
+    if not os.path.exists(dataset_path):
+        print(f"Error: Dataset directory '{dataset_path}' not found.")
+        return None, None, None
+
+    if deterministic:
+        tf.keras.utils.set_random_seed(SEED)
+
+    # Same split as create_and_train_model(), so validation metrics of both modes are comparable.
+    (train_paths, train_labels), (val_paths, val_labels), class_names = split_files(dataset_path)
+    num_classes = len(class_names)
+
+    backbone = load_backbone(backbone_name, weights_path)
+    store = FeatureStore(store_path)
+    try:
+        features, keep, _ = dataset_features(
+            store, backbone, backbone_id(backbone_name, weights_path),
+            np.concatenate([train_paths, val_paths]).tolist()
+        )
+    finally:
+        store.close()
+    labels = np.concatenate([train_labels, val_labels])[keep]
+    is_train = keep < len(train_paths)
+    train_ds = build_feature_pipeline(features[is_train], labels[is_train], training=True, shuffle_buffer=shuffle_buffer)
+    val_ds = build_feature_pipeline(features[~is_train], labels[~is_train], training=False)
+
+    # The same heads as the full model, built once and applied to both the
+    # cached features (for training) and the backbone's output (for serving).
+    embedding = layers.Dense(128, activation='relu', name='embedding')
+    soil_type_head = layers.Dense(num_classes, activation='softmax', name='soil_type_output')
+    pH_head = layers.Dense(1, activation='linear', name='pH_output')
+
+    feature_input = keras.Input(shape=(features.shape[1],))
+    x = embedding(feature_input)
+    heads = Model(inputs=feature_input, outputs=[soil_type_head(x), pH_head(x)])
+    compile_multi_task(heads)
+
+    print(f"Training the heads on {features.shape[1]}-dimensional '{backbone_name}' features for {epochs} epochs...")
+    started_at = time.perf_counter()
+    history = heads.fit(
+        train_ds,
+        validation_data=val_ds,
+        epochs=epochs,
+        callbacks=[InputPipelineTimer()] if time_pipeline else None
+    )
+    print(f"\nHead training complete in {time.perf_counter() - started_at:.1f}s.")
+
+    x = embedding(backbone.output)
+    model = Model(inputs=backbone.input, outputs=[soil_type_head(x), pH_head(x)])
+    compile_multi_task(model)
+    return model, class_names, history
 
 # --- Main execution ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the multi-task soil model.")
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--cache', default=CACHE_MODE,
+                        help="Cache decoded images: 'memory', 'none', or a file path prefix for an on-disk cache "
+                             f"(default: {CACHE_MODE}).")
+    parser.add_argument('--shuffle-buffer', type=int, default=SHUFFLE_BUFFER)
+    parser.add_argument('--augment', action='store_true', help="Apply random flips and brightness changes.")
+    parser.add_argument('--non-deterministic', action='store_true',
+                        help="Allow parallel maps to reorder elements for extra throughput.")
+    parser.add_argument('--time-pipeline', action='store_true',
+                        help="Print input pipeline vs. compute time for every epoch.")
+    parser.add_argument('--packed', default=None,
+                        help="Train from a packed dataset directory created by packed_dataset.py "
+                             "instead of decoding the image folders.")
+    parser.add_argument('--backbone', choices=sorted(BACKBONES), default=None,
+                        help="Train only the soil type and pH heads on top of this frozen pretrained backbone. "
+                             "Backbone features are cached per image, so retraining after adding images only "
+                             "runs the backbone on the new ones.")
+    parser.add_argument('--backbone-weights', default=None,
+                        help="Local weights file of the backbone (default: backbones/<backbone>_no_top.weights.h5).")
+    parser.add_argument('--feature-store', default=FEATURE_STORE_PATH,
+                        help=f"Cache of backbone features (default: {FEATURE_STORE_PATH}).")
+    parser.add_argument('--registry', default=REGISTRY_DIR,
+                        help=f"Model registry to publish the trained model to (default: {REGISTRY_DIR}). "
+                             "Running servers pick the new version up without a restart.")
+    parser.add_argument('--no-publish', action='store_true',
+                        help="Only write multi_task_soil_model.h5 and soil_classes.txt.")
+    args = parser.parse_args()
+
+    if args.backbone and (args.packed or args.augment):
+        parser.error("--backbone trains on cached features of the image folders; "
+                     "it cannot be combined with --packed or --augment.")
+
     full_dataset_path = os.path.join(os.path.dirname(__file__), DATASET_DIR)
-    trained_model, class_names_from_training = create_and_train_model(full_dataset_path, epochs=10)
+    if args.backbone:
+        weights_path = args.backbone_weights or default_weights_path(args.backbone)
+        trained_model, class_names_from_training, history = create_and_train_heads(
+            full_dataset_path,
+            args.backbone,
+            weights_path,
+            store_path=args.feature_store,
+            epochs=args.epochs,
+            shuffle_buffer=args.shuffle_buffer,
+            deterministic=not args.non_deterministic,
+            time_pipeline=args.time_pipeline
+        )
+    else:
+        trained_model, class_names_from_training, history = create_and_train_model(
+            full_dataset_path,
+            epochs=args.epochs,
+            cache=args.cache,
+            shuffle_buffer=args.shuffle_buffer,
+            augment=args.augment,
+            deterministic=not args.non_deterministic,
+            time_pipeline=args.time_pipeline,
+            packed_dir=args.packed
+        )
 
     if trained_model:
         model_filename = 'multi_task_soil_model.h5'
@@ -105,5 +396,21 @@ if __name__ == "__main__":
             for cls_name in class_names_from_training:
                 f.write(f"{cls_name}\n")
         print(f"Class names saved to '{class_names_path}'.")
+
+        if not args.no_publish:
+            metadata = {
+                "epochs": args.epochs,
+                "dataset": args.packed or DATASET_DIR,
+                "augment": args.augment,
+                "input_shape": [IMG_HEIGHT, IMG_WIDTH, 3],
+                # Frozen backbone the heads were trained on, or None for the full small CNN.
+                "backbone": backbone_id(args.backbone, weights_path) if args.backbone else None,
+                # Final-epoch values of every loss and metric Keras tracked.
+                "metrics": {name: float(values[-1]) for name, values in history.history.items() if values},
+            }
+            version = publish_model(trained_model, class_names_from_training, metadata, args.registry)
+            print(f"Published model version '{version}' to '{args.registry}'.")
+            print(f"MODEL_BACKEND=tflite servers serve their fixed TFLite file until this version is exported: "
+                  f"python export_tflite.py --registry-version {version}")
     else:
         print("Model was not trained. Please check dataset path.")
\ No newline at end of file
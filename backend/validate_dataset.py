@@ -0,0 +1,285 @@
+"""
+Single-pass, parallel validation of an image dataset, with optional quarantine.
+
+Every file under the dataset root is read once and decoded once with
+image_preprocessing.load_rgb(), the decoder train_model.py, packed_dataset.py
+and the server use, so a file passes exactly when training can read it. Work
+is spread over a process pool.
+
+Results are kept in a manifest next to the dataset (.validation_<root>.json)
+holding each file's size, mtime, SHA-256 and result. On the next run, files
+whose size and mtime are unchanged are not read again, and files whose bytes
+hash the same as before are not decoded again.
+
+Usage (from the 'backend' folder):
+
+    python validate_dataset.py                              # check ../Dataset/Train
+    python validate_dataset.py ../Dataset/test --report test_report.json
+    python validate_dataset.py --quarantine                 # move failures out of the dataset
+    python validate_dataset.py --full                       # ignore the manifest
+
+Quarantined files go to <dataset parent>/quarantine_invalid_files/<root name>/,
+keeping their path relative to the dataset root.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from dataset_files import IMAGE_EXTENSIONS
+from image_preprocessing import load_rgb, open_image
+
+DATASET_DIR = '../Dataset/Train'
+QUARANTINE_DIR_NAME = 'quarantine_invalid_files'
+# Version 1 manifests hold results of the old TensorFlow check.
+MANIFEST_VERSION = 2
+
+STATUS_OK = 'ok'
+STATUS_INVALID_EXTENSION = 'invalid_extension'
+STATUS_UNREADABLE = 'unreadable'
+STATUS_DECODE_ERROR = 'decode_error'
+
+_known_results = {}
+
+
+def _init_worker(known_results):
+    global _known_results
+    _known_results = known_results
+
+
+def check_file(path):
+    """
+    Reads path once and decodes the bytes with the training decoder
+    (image_preprocessing.load_rgb). If the bytes hash to a file already
+    checked in a previous run, that result is returned without decoding.
+
+    Returns:
+        dict: status, errors, sha256, format, mode, width and height.
+    """
+    result = {'status': STATUS_OK, 'errors': [], 'sha256': None, 'format': None, 'mode': None,
+              'width': None, 'height': None}
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in IMAGE_EXTENSIONS:
+        result['status'] = STATUS_INVALID_EXTENSION
+        result['errors'].append("Invalid extension")
+        return result
+
+    try:
+        with open(path, 'rb') as f:
+            img_bytes = f.read()
+    except OSError as e:
+        result['status'] = STATUS_UNREADABLE
+        result['errors'].append(f"Could not read file ({e})")
+        return result
+    result['sha256'] = hashlib.sha256(img_bytes).hexdigest()
+    known = _known_results.get(result['sha256'])
+    if known is not None:
+        return dict(known)
+
+    try:
+        with open_image(img_bytes) as img:
+            result['format'] = img.format
+            result['mode'] = img.mode
+            result['width'], result['height'] = img.size
+        # The full decode and resize, so truncated files fail here, unlike verify().
+        load_rgb(img_bytes)
+    except Exception as e:
+        result['status'] = STATUS_DECODE_ERROR
+        result['errors'].append(f"Decode: {e}")
+    return result
+
+
+def manifest_path_for(dataset_root):
+    dataset_root = os.path.abspath(dataset_root)
+    return os.path.join(os.path.dirname(dataset_root), f".validation_{os.path.basename(dataset_root)}.json")
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"WARNING: Ignoring unreadable manifest '{path}': {e}")
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('files', {})
+
+
+def save_manifest(path, files):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': MANIFEST_VERSION, 'files': files}, f)
+    os.replace(tmp_path, path)
+
+
+def quarantine_path_for(file_path, dataset_root, quarantine_dir_name=QUARANTINE_DIR_NAME):
+    dataset_root = os.path.abspath(dataset_root)
+    return os.path.join(
+        os.path.dirname(dataset_root),
+        quarantine_dir_name,
+        os.path.basename(dataset_root),
+        os.path.relpath(os.path.abspath(file_path), dataset_root)
+    )
+
+
+def quarantine_file(file_path, dataset_root, quarantine_dir_name=QUARANTINE_DIR_NAME):
+    """
+    Moves file_path out of the dataset into the quarantine folder and returns
+    the destination, or None if the move failed.
+    """
+    destination_path = quarantine_path_for(file_path, dataset_root, quarantine_dir_name)
+    os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+    try:
+        shutil.move(file_path, destination_path)
+        return destination_path
+    except Exception as e:
+        print(f"    ERROR moving {file_path}: {e}")
+        return None
+
+
+def _stored_result(entry):
+    return {k: v for k, v in entry.items() if k not in ('size', 'mtime_ns', 'reused', 'quarantined_to')}
+
+
+def _file_status(st, result, reused):
+    entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    entry.update(result)
+    entry['reused'] = reused
+    return entry
+
+
+def validate_dataset(dataset_root=DATASET_DIR, quarantine=False, workers=None,
+                     use_manifest=True, report_path=None, quarantine_dir_name=QUARANTINE_DIR_NAME,
+                     verbose=True):
+    """
+    Validates every file under dataset_root.
+
+    Args:
+        dataset_root (str): The dataset folder to scan (e.g. '../Dataset/Train').
+        quarantine (bool): Move failing files into the quarantine folder.
+        workers (int): Number of processes (default: core count).
+        use_manifest (bool): Skip files unchanged since the last run.
+        report_path (str): Optional path for a JSON report.
+        quarantine_dir_name (str): Name of the quarantine folder next to the dataset.
+        verbose (bool): Print each failing file.
+
+    Returns:
+        dict: The report, with per-file results under 'files' and totals
+              under 'summary'.
+    """
+    if not os.path.isdir(dataset_root):
+        print(f"Error: Directory not found at {dataset_root}")
+        return None
+
+    started_at = time.perf_counter()
+    dataset_root = os.path.abspath(dataset_root)
+    manifest_path = manifest_path_for(dataset_root)
+    previous = load_manifest(manifest_path) if use_manifest else {}
+
+    print(f"--- Validating {dataset_root} ---")
+
+    files = {}
+    to_check = []
+    stats = {}
+    for root, dirs, filenames in os.walk(dataset_root):
+        dirs.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(root, filename)
+            relpath = os.path.relpath(path, dataset_root)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stats[relpath] = st
+            old = previous.get(relpath)
+            if old is not None and old['size'] == st.st_size and old['mtime_ns'] == st.st_mtime_ns:
+                files[relpath] = _file_status(st, _stored_result(old), True)
+            else:
+                to_check.append(relpath)
+
+    # Files that were touched or copied but not modified are matched by hash instead of decoded.
+    known_results = {entry['sha256']: _stored_result(entry) for entry in previous.values() if entry.get('sha256')}
+
+    if to_check:
+        print(f"  {len(files)} files unchanged since last run, checking {len(to_check)} files...")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(known_results,)) as executor:
+            paths = [os.path.join(dataset_root, relpath) for relpath in to_check]
+            for relpath, result in zip(to_check, executor.map(check_file, paths, chunksize=8)):
+                files[relpath] = _file_status(stats[relpath], result, False)
+    else:
+        print(f"  All {len(files)} files unchanged since last run.")
+
+    failures = [relpath for relpath, entry in sorted(files.items()) if entry['status'] != STATUS_OK]
+    if verbose:
+        for relpath in failures:
+            print(f"  {files[relpath]['status']}: {relpath} ({'; '.join(files[relpath]['errors'])})")
+
+    quarantined = []
+    if quarantine and failures:
+        for relpath in failures:
+            destination = quarantine_file(os.path.join(dataset_root, relpath), dataset_root, quarantine_dir_name)
+            if destination is not None:
+                print(f"  Moved invalid file: {relpath} -> {destination}")
+                quarantined.append(relpath)
+                files[relpath]['quarantined_to'] = destination
+
+    if use_manifest:
+        save_manifest(manifest_path, {
+            relpath: {k: v for k, v in entry.items() if k not in ('reused', 'quarantined_to')}
+            for relpath, entry in files.items() if relpath not in quarantined
+        })
+
+    by_status = {}
+    for entry in files.values():
+        by_status[entry['status']] = by_status.get(entry['status'], 0) + 1
+    report = {
+        'dataset_root': dataset_root,
+        'summary': {
+            'total': len(files),
+            'checked': len(to_check),
+            'reused': len(files) - len(to_check),
+            'failed': len(failures),
+            'quarantined': len(quarantined),
+            'by_status': by_status,
+            'seconds': round(time.perf_counter() - started_at, 2),
+        },
+        'failures': failures,
+        'files': files,
+    }
+
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"  Report written to {report_path}")
+
+    summary = report['summary']
+    print(f"\n--- Validation complete in {summary['seconds']}s: {summary['failed']} problem files out of "
+          f"{summary['total']} ({summary['checked']} checked, {summary['reused']} reused from manifest) ---")
+    if quarantined:
+        print(f"{len(quarantined)} files moved to the '{quarantine_dir_name}' folder. Review them before deleting.")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate (and optionally quarantine) dataset images in parallel.")
+    parser.add_argument('dataset', nargs='?', default=DATASET_DIR, help=f"Dataset root (default: {DATASET_DIR}).")
+    parser.add_argument('--quarantine', action='store_true', help="Move failing files to the quarantine folder.")
+    parser.add_argument('--full', action='store_true', help="Ignore the manifest and re-check every file.")
+    parser.add_argument('--workers', type=int, default=None, help="Number of processes (default: core count).")
+    parser.add_argument('--report', default=None, help="Write a machine-readable JSON report to this path.")
+    args = parser.parse_args()
+
+    validate_dataset(
+        args.dataset,
+        quarantine=args.quarantine,
+        workers=args.workers,
+        use_manifest=not args.full,
+        report_path=args.report
+    )